@@ -25,26 +25,91 @@
 
 """
 
-import json
+import time
 import uuid
+import logging
 from datetime import datetime
 from collections import OrderedDict, defaultdict
-
-from settings import NoIndexWords
-from scraperdb import Article as ArticleRow, SessionContext, Word, Root, DataError, desc
+from itertools import chain
+
+from settings import Settings, NoIndexWords
+from scraperdb import (
+    Article as ArticleRow,
+    SessionContext,
+    Word,
+    TreeSymbol,
+    Root,
+    DataError,
+    desc,
+    undefer_group,
+)
 from fetcher import Fetcher
+from nertokenizer import tokenize_and_recognize
 from tokenizer import TOK, tokenize
-from reynir.fastparser import Fast_Parser, ParseError, ParseForestDumper
-from incparser import IncrementalParser
-from tree import Tree
-from treeutil import TreeUtility
-
-
-# We don't bother parsing sentences that have more tokens than 100,
-# since they require lots of memory (>16 GB) and may take
-# minutes to parse
+from reynir.fastparser import Fast_Parser
+from incparser import IncrementalParser, ParsedSentence
+from tree import Tree, tree_to_binary
+from treeutil import TreeUtility, WordTuple
+from parsecache import SentenceCache
+from grammardiff import GrammarDiff
+from governor import ParseGovernor
+from parsepool import ParsePool
+from corpusstream import CorpusStream
+from treeindex import tree_symbols, pattern_clauses, matching_sentences, ALL_SENTENCES
+from dedup import simhash, SignatureIndex
+from htmlstore import store_html, load_html
+import bintokens
+
+
+# Unless the parse governor is enabled (see governor.py), we don't bother
+# parsing sentences that have more tokens than 100, since they
+# require lots of memory (>16 GB) and may take minutes to parse
 MAX_SENTENCE_TOKENS = 100
 
+# Number of articles looked up in the tree symbol index at a time
+_INDEX_BATCH_SIZE = 500
+
+# The columns of an article row that are stored from Article attributes
+# of the same name, with a leading underscore
+_COLUMNS = (
+    "url",
+    "root_id",
+    "heading",
+    "author",
+    "timestamp",
+    "authority",
+    "scraped",
+    "parsed",
+    "processed",
+    "indexed",
+    "scr_module",
+    "scr_class",
+    "scr_version",
+    "parser_version",
+    "num_sentences",
+    "num_parsed",
+    "ambiguity",
+    "html",
+    "html_hash",
+    "tree",
+    "tree_bin",
+    "tokens",
+    "tokens_bin",
+    "simhash",
+    "duplicate_of",
+    "content_text",
+    "content_key",
+)
+
+# The columns that are replaced by a full parse, and therefore
+# need not be loaded for one
+_PARSE_OUTPUT_COLUMNS = ("tree", "tree_bin", "tokens", "tokens_bin")
+
+# The columns that are the input of a parse. They are not loaded with
+# articles that are loaded to read their parse results (see articles()),
+# but only if needed, and are not written unless they have been loaded.
+_CONTENT_COLUMNS = ("html", "content_text")
+
 
 class Article:
 
@@ -52,15 +117,49 @@ class Article:
         as it is tokenized, parsed and stored in the Reynir database. """
 
     _parser = None
+    _cache = None
+    _governor = None
+    # Word stems waiting to be written in batch mode, by article id
+    _word_batch = None
+    _word_batch_size = 0
+    # Signatures of recently scraped articles, for near-duplicate detection
+    _signatures = None
+    # Total time spent parsing sentences in this process, and their number
+    _parse_seconds = 0.0
+    _parse_sentences = 0
 
     @classmethod
     def _init_class(cls):
         """ Initialize class attributes """
         if cls._parser is None:
             cls._parser = Fast_Parser(verbose=False)  # Don't emit diagnostic messages
+        if cls._cache is None and Settings.SENTENCE_CACHE:
+            cls._cache = SentenceCache()
+        if cls._governor is None and Settings.PARSE_GOVERNOR:
+            cls._governor = ParseGovernor(cls._parser)
+
+    @classmethod
+    def cache_stats(cls):
+        """ Return a dict of sentence cache statistics for this process,
+            or None if the cache is not enabled """
+        return None if cls._cache is None else cls._cache.stats()
+
+    @classmethod
+    def governor_stats(cls):
+        """ Return a dict of parse governor statistics for this process,
+            or None if the governor is not enabled """
+        return None if cls._governor is None else cls._governor.stats()
+
+    @classmethod
+    def _close_governor(cls):
+        """ Stop the parse governor, whose workers use the current parser """
+        if cls._governor is not None:
+            cls._governor.close()
+            cls._governor = None
 
     @classmethod
     def cleanup(cls):
+        cls._close_governor()
         if cls._parser is not None:
             cls._parser.cleanup()
             cls._parser = None
@@ -74,8 +173,14 @@ class Article:
     @classmethod
     def reload_parser(cls):
         """ Force reload of a fresh parser instance """
+        old_version = None if cls._parser is None else cls._parser.version
         cls._parser = None
         cls._init_class()
+        if cls._parser.version != old_version:
+            # The grammar has changed: replace the governor,
+            # whose workers use the previous parser
+            cls._close_governor()
+            cls._init_class()
 
     @classmethod
     def parser_version(cls):
@@ -102,18 +207,62 @@ class Article:
         self._num_sentences = 0
         self._num_parsed = 0
         self._ambiguity = 1.0
-        self._html = None
+        self._html = None  # Loaded lazily if kept in the blob store
+        self._html_hash = None  # Key of the HTML in the blob store, if there
         self._tree = None
+        self._tree_bin = None  # The tree in binary format
         self._root_id = None
         self._root_domain = None
         self._helper = None
-        self._tokens = None  # JSON string
-        self._raw_tokens = None  # The tokens themselves
+        self._tokens = None  # JSON string, generated lazily from _tokens_bin
+        self._tokens_bin = None  # Compact token encoding (see bintokens.py)
+        self._token_doc = None  # The tokens themselves, as a TokenDoc
         self._words = None  # The individual word stems, in a dictionary
+        self._symbols = None  # Tree symbol index, in a dictionary (see treeindex.py)
+        self._simhash = None  # SimHash signature of the text (see dedup.py)
+        self._duplicate_of = None  # URL of the article this is a near-duplicate of
+        # Number of sentences whose results were taken from that article
+        self._duplicate_reused = 0
+        # The text content of the article, as extracted from its HTML by
+        # the scrape helper identified by content_key (see Fetcher.helper_key())
+        self._content_text = None
+        self._content_key = None
+        # False if the content columns have not been loaded (yet)
+        self._content_loaded = True
+        # The column values as last loaded from or stored in the database,
+        # used to find the columns that need to be written by an update
+        self._stored = dict()
+
+    def _column_values(self):
+        """ Return a dict of the current values of the article's columns """
+        values = {col: getattr(self, "_" + col) for col in _COLUMNS}
+        # The JSON token string is only kept for legacy articles
+        if self._tokens_bin:
+            values["tokens"] = None
+        # The HTML is not kept inline if it is in the blob store
+        if self._html_hash:
+            values["html"] = None
+        return values
+
+    def _dirty_columns(self):
+        """ Return a dict of the columns whose values have changed since
+            the article was loaded or stored, or that were not loaded """
+        stored = self._stored
+        dirty = dict()
+        for col, val in self._column_values().items():
+            if col in _CONTENT_COLUMNS and not self._content_loaded:
+                continue
+            if col in stored:
+                old = stored[col]
+                if old is val or (old == val and type(old) == type(val)):
+                    continue
+            dirty[col] = val
+        return dirty
 
     @classmethod
-    def _init_from_row(cls, ar):
-        """ Initialize a fresh Article instance from a database row object """
+    def _init_from_row(cls, ar, deferred=()):
+        """ Initialize a fresh Article instance from a database row object,
+            whose deferred columns (if any) are not to be loaded """
         a = cls(uuid=ar.id)
         a._url = ar.url
         a._heading = ar.heading
@@ -132,23 +281,61 @@ class Article:
         a._num_sentences = ar.num_sentences
         a._num_parsed = ar.num_parsed
         a._ambiguity = ar.ambiguity
-        a._html = ar.html
-        a._tree = ar.tree
-        a._tokens = ar.tokens
-        assert a._raw_tokens is None
+        if "html" not in deferred:
+            a._html = ar.html
+            a._content_text = ar.content_text
+        else:
+            a._content_loaded = False
+        a._html_hash = ar.html_hash
+        if "tree" not in deferred:
+            a._tree = ar.tree
+        if "tree_bin" not in deferred:
+            a._tree_bin = ar.tree_bin
+        if "tokens" not in deferred:
+            a._tokens = ar.tokens
+        if "tokens_bin" not in deferred:
+            a._tokens_bin = ar.tokens_bin
+        assert a._token_doc is None
         a._root_id = ar.root_id
         a._root_domain = ar.root.domain if ar.root else None
+        a._simhash = ar.simhash
+        a._duplicate_of = ar.duplicate_of
+        a._content_key = ar.content_key
+        # Remember the loaded values, so that an update only writes the
+        # columns that have changed. Deferred columns are always written.
+        a._stored = {
+            col: val
+            for col, val in a._column_values().items()
+            if col not in deferred
+        }
         return a
 
+    @staticmethod
+    def _load_options(for_parse):
+        """ Return a tuple of the columns not to load and the query options
+            that load the rest, when loading an article for a full parse or not.
+            The large columns of article rows are deferred by default. """
+        if for_parse:
+            return _PARSE_OUTPUT_COLUMNS, (undefer_group("content"),)
+        return (
+            (),
+            (undefer_group("content"), undefer_group("tree"), undefer_group("tokens")),
+        )
+
     @classmethod
-    def _init_from_scrape(cls, url, enclosing_session=None):
-        """ Scrape an article from its URL """
+    def _init_from_scrape(cls, url, enclosing_session=None, html=None, dedup=True):
+        """ Scrape an article from its URL, or from its already
+            fetched HTML, if given. If dedup is False, the signature of
+            the article is computed but not checked for near-duplicates,
+            which is then left to the caller (see check_duplicate()). """
         if url is None:
             return None
         a = cls(url=url)
         with SessionContext(enclosing_session) as session:
             # Obtain a helper corresponding to the URL
-            html, metadata, helper = Fetcher.fetch_url_html(url, session)
+            html, metadata, helper, text = Fetcher.fetch_url_html(
+                url, session, html, with_text=Settings.DEDUP or Settings.TEXT_CACHE
+            )
             if html is None:
                 return a
             a._html = html
@@ -164,70 +351,141 @@ class Article:
                 a._scr_version = helper.scr_version
                 a._root_id = helper.root_id
                 a._root_domain = helper.domain
+            if text is not None and Settings.TEXT_CACHE:
+                # Keep the text, sparing the parser from extracting it again
+                a._content_text = text
+                a._content_key = Fetcher.helper_key(helper)
+            if text and Settings.DEDUP:
+                a._simhash = simhash(text)
+                if dedup:
+                    a._duplicate_of = cls.find_duplicate(session, url, a._simhash)
             return a
 
     @classmethod
-    def load_from_url(cls, url, enclosing_session=None):
-        """ Load or scrape an article, given its URL """
+    def load_signatures(cls, enclosing_session=None):
+        """ Load the index of the signatures of recently scraped articles
+            into this process, if not already loaded """
+        if Article._signatures is None:
+            with SessionContext(enclosing_session, read_only=True) as session:
+                Article._signatures = SignatureIndex.load(
+                    session, Settings.DEDUP_DISTANCE, Settings.DEDUP_DAYS
+                )
+
+    @classmethod
+    def find_duplicate(cls, session, url, sig):
+        """ Check whether the article with the given URL and signature is
+            a near-duplicate of a recently scraped one, returning the URL
+            of that one, or None. The index of signatures is kept in this
+            process, so all articles of a scraping run should be checked
+            by the same process. """
+        if sig is None:
+            # Too short to tell
+            return None
+        cls.load_signatures(session)
+        match = Article._signatures.find(sig, exclude=url)
+        if match is None:
+            # Not a near-duplicate: other articles may be near-duplicates of this one
+            Article._signatures.add(sig, url)
+            return None
+        duplicate_of, distance = match
+        logging.info(
+            "Article {0} is a near-duplicate of {1} (distance {2})"
+            .format(url, duplicate_of, distance)
+        )
+        return duplicate_of
+
+    @classmethod
+    def check_duplicate(cls, url, sig, enclosing_session=None):
+        """ Check whether a stored article, scraped with dedup=False, is
+            a near-duplicate, and if so, mark it as such in the database.
+            Returns the URL of the article that it is a near-duplicate of,
+            or None. """
+        with SessionContext(enclosing_session, commit=True) as session:
+            duplicate_of = cls.find_duplicate(session, url, sig)
+            if duplicate_of is not None:
+                session.query(ArticleRow).filter(ArticleRow.url == url).update(
+                    dict(duplicate_of=duplicate_of), synchronize_session=False
+                )
+        return duplicate_of
+
+    @classmethod
+    def load_from_url(cls, url, enclosing_session=None, for_parse=False):
+        """ Load or scrape an article, given its URL. If for_parse is True,
+            the article is about to be fully parsed, and its previous parse
+            results are not loaded. """
+        deferred, options = cls._load_options(for_parse)
         with SessionContext(enclosing_session) as session:
-            ar = session.query(ArticleRow).filter(ArticleRow.url == url).one_or_none()
+            ar = (
+                session
+                .query(ArticleRow)
+                .options(*options)
+                .filter(ArticleRow.url == url)
+                .one_or_none()
+            )
             if ar is not None:
-                return cls._init_from_row(ar)
+                return cls._init_from_row(ar, deferred)
             # Not found in database: attempt to fetch
             return cls._init_from_scrape(url, session)
 
     @classmethod
-    def scrape_from_url(cls, url, enclosing_session=None):
-        """ Force fetch of an article, given its URL """
+    def scrape_from_url(cls, url, enclosing_session=None, html=None, dedup=True):
+        """ Force fetch of an article, given its URL, or scrape it
+            from its already fetched HTML, if given. See _init_from_scrape()
+            for the dedup parameter. """
         with SessionContext(enclosing_session) as session:
             ar = session.query(ArticleRow).filter(ArticleRow.url == url).one_or_none()
-            a = cls._init_from_scrape(url, session)
+            a = cls._init_from_scrape(url, session, html, dedup=dedup)
             if a is not None and ar is not None:
                 # This article already existed in the database, so note its UUID
                 a._uuid = ar.id
             return a
 
     @classmethod
-    def load_from_uuid(cls, uuid, enclosing_session=None):
-        """ Load an article, given its UUID """
+    def load_from_uuid(cls, uuid, enclosing_session=None, for_parse=False):
+        """ Load an article, given its UUID. If for_parse is True,
+            the article is about to be fully parsed, and its previous parse
+            results are not loaded. """
+        deferred, options = cls._load_options(for_parse)
         with SessionContext(enclosing_session) as session:
             try:
                 ar = (
                     session
                     .query(ArticleRow)
+                    .options(*options)
                     .filter(ArticleRow.id == uuid)
                     .one_or_none()
                 )
             except DataError:
                 # Probably wrong UUID format
                 ar = None
-            return None if ar is None else cls._init_from_row(ar)
+            return None if ar is None else cls._init_from_row(ar, deferred)
+
+    def _doc(self):
+        """ Return the tokens of the article as a TokenDoc, or None """
+        if self._token_doc is None:
+            # Lazy generation of the token document from the stored rep
+            self._token_doc = bintokens.load(self._tokens_bin, self._tokens)
+        return self._token_doc
 
     def person_names(self):
         """ A generator yielding all person names in an article token stream """
-        if self._raw_tokens is None and self._tokens:
-            # Lazy generation of the raw tokens from the JSON rep
-            self._raw_tokens = json.loads(self._tokens)
-        if self._raw_tokens:
-            for p in self._raw_tokens:
-                for sent in p:
-                    for t in sent:
-                        if t.get("k") == TOK.PERSON:
-                            # The full name of the person is in the v field
-                            yield t["v"]
+        doc = self._doc()
+        if doc is not None:
+            for _, sent in doc.sentences():
+                for t in sent:
+                    if t.get("k") == TOK.PERSON:
+                        # The full name of the person is in the v field
+                        yield t["v"]
 
     def entity_names(self):
         """ A generator for entity names from an article token stream """
-        if self._raw_tokens is None and self._tokens:
-            # Lazy generation of the raw tokens from the JSON rep
-            self._raw_tokens = json.loads(self._tokens)
-        if self._raw_tokens:
-            for p in self._raw_tokens:
-                for sent in p:
-                    for t in sent:
-                        if t.get("k") == TOK.ENTITY:
-                            # The entity name
-                            yield t["x"]
+        doc = self._doc()
+        if doc is not None:
+            for _, sent in doc.sentences():
+                for t in sent:
+                    if t.get("k") == TOK.ENTITY:
+                        # The entity name
+                        yield t["x"]
 
     def create_register(self, session, all_names=False):
         """ Create a name register dictionary for this article """
@@ -241,12 +499,33 @@ class Article:
             add_entity_to_register(name, register, session, all_names=all_names)
         return register
 
+    @classmethod
+    def begin_word_batch(cls, size):
+        """ Start batch mode for the words index: instead of being written
+            immediately, the word stems of stored articles are collected and
+            written for up to size articles at a time, in a single round trip.
+            The caller should call flush_words() after committing each stored
+            article, and flush_words(force=True) when done. Note that word
+            stems still pending when a process is killed are lost. """
+        cls._word_batch = dict()
+        cls._word_batch_size = size
+
+    @classmethod
+    def flush_words(cls, enclosing_session=None, force=False):
+        """ In batch mode, write the pending word stems to the database
+            if the batch is full, or in any case if force is True """
+        batch = cls._word_batch
+        if not batch or (len(batch) < cls._word_batch_size and not force):
+            return
+        cls._word_batch = dict()
+        with SessionContext(enclosing_session, commit=True) as session:
+            Word.replace(session, batch)
+
     def _store_words(self, session):
         """ Store word stems """
         assert session is not None
-        # Delete previously stored words for this article
-        session.execute(Word.table().delete().where(Word.article_id == self._uuid))
-        # Index the words by storing them in the words table
+        # Collect the interesting words
+        words = []
         for word, cnt in self._words.items():
             if word.cat not in NoIndexWords.CATEGORIES_TO_INDEX:
                 # We do not index closed word categories and non-distinctive constructs
@@ -258,20 +537,95 @@ class Article:
                 # Shield the database from too long words
                 continue
             # Interesting word: let's index it
-            w = Word(article_id=self._uuid, stem=word.stem, cat=word.cat, cnt=cnt)
-            session.add(w)
-        # Offload the new data from Python to PostgreSQL
+            words.append((word.stem, word.cat, cnt))
+        if self._word_batch is not None:
+            # Batch mode: the words will be written later,
+            # along with those of other articles
+            self._word_batch[self._uuid] = words
+            return
+        # Make sure that the article row is in the database
+        session.flush()
+        # Replace the previously stored words for this article,
+        # only writing the stems whose counts have changed
+        Word.replace(session, {self._uuid: words})
+
+    def _store_symbols(self, session):
+        """ Store the tree symbol index of the article """
+        # Make sure that the article row is in the database
         session.flush()
+        TreeSymbol.replace(session, {self._uuid: self._symbols})
+
+    def _load_content(self, enclosing_session=None):
+        """ Load the content columns of an article that was loaded without them """
+        if self._content_loaded:
+            return
+        with SessionContext(enclosing_session, read_only=True) as session:
+            row = (
+                session
+                .query(ArticleRow.html, ArticleRow.content_text)
+                .filter(ArticleRow.id == self._uuid)
+                .one_or_none()
+            )
+        if row is not None:
+            self._html, self._content_text = row
+        self._content_loaded = True
+        values = self._column_values()
+        for col in _CONTENT_COLUMNS:
+            self._stored[col] = values[col]
+
+    def _get_html(self, enclosing_session=None):
+        """ Return the HTML of the article, loading it from the database
+            or the blob store if it has not been loaded yet """
+        self._load_content(enclosing_session)
+        if self._html is None and self._html_hash is not None:
+            with SessionContext(enclosing_session, read_only=True) as session:
+                self._html = load_html(session, self._html_hash)
+        return self._html
 
-    def _parse(self, enclosing_session=None, verbose=False):
-        """ Parse the article content to yield parse trees and annotated token list """
+    def _store_html(self, session):
+        """ Move the HTML of the article into the blob store, if enabled
+            and not already there """
+        if Settings.HTML_BLOBS and self._html_hash is None and self._html is not None:
+            self._html_hash = store_html(session, self._html)
+
+    def _content(self, session):
+        """ Return the text content of the article, with paragraph markers,
+            or None if it has none. The text is kept with the article, and
+            only extracted again from the HTML if the scrape helper of the
+            article has changed since. """
+        self._load_content(session)
+        helper = Fetcher.helper_for(session, self._url)
+        if not Settings.TEXT_CACHE:
+            return Fetcher.html_text(self._get_html(session), helper)
+        key = Fetcher.helper_key(helper)
+        if self._content_key != key:
+            self._content_text = Fetcher.html_text(self._get_html(session), helper)
+            self._content_key = key
+        return self._content_text
+
+    def _parse(self, enclosing_session=None, verbose=False, reuse=None):
+        """ Parse the article content to yield parse trees and annotated token list.
+            If reuse is given, it is called with the 1-based sentence index and
+            the sentence, and may return an existing ParsedSentence to use
+            instead of parsing the sentence. """
         with SessionContext(enclosing_session) as session:
 
-            # Convert the content soup to a token iterable (generator)
-            toklist = Fetcher.tokenize_html(self._url, self._html, session)
+            # Convert the text content to a token iterable (generator)
+            text = self._content(session)
+            toklist = (
+                tokenize_and_recognize(text, enclosing_session=session)
+                if text is not None
+                else None
+            )
 
             bp = self.get_parser()
-            ip = IncrementalParser(bp, toklist, verbose=verbose)
+            ip = IncrementalParser(
+                bp,
+                toklist,
+                verbose=verbose,
+                cache=self._cache,
+                governor=self._governor,
+            )
 
             # List of paragraphs containing a list of sentences containing token lists
             # for sentences in string dump format (1-based paragraph and sentence indices)
@@ -283,56 +637,73 @@ class Article:
 
             # Word stem dictionary, indexed by (stem, cat)
             words = defaultdict(int)
-            num_sent = 0
 
+            # Split the token stream into paragraphs of sentences, noting
+            # for each sentence whether it is to be parsed and whether
+            # an existing result is being reused for it
+            plan = []
+            num_sent = 0
             for p in ip.paragraphs():
+                plan.append([])
+                for sent in p.sentences():
+                    num_sent += 1
+                    result = None if reuse is None else reuse(num_sent, sent)
+                    # Without the governor, we don't attempt to parse
+                    # very long sentences (>100 tokens) since they are
+                    # memory intensive (>16 GB) and may take minutes to process
+                    do_parse = result is None and (
+                        self._governor is not None or len(sent) <= MAX_SENTENCE_TOKENS
+                    )
+                    plan[-1].append((sent, result, do_parse))
+
+            # If a pool of parser processes is available, submit all the
+            # sentences to be parsed up front, to be parsed in parallel
+            pool = ParsePool.instance(bp)
+            if pool is not None:
+                for p in plan:
+                    for sent, _, do_parse in p:
+                        if do_parse:
+                            sent.submit(pool)
+
+            num_sent = 0
+            parse_seconds = 0.0
+            parse_sentences = 0
+            for p in plan:
 
                 pgs.append([])
 
-                for sent in p.sentences():
+                for sent, result, do_parse in p:
 
                     num_sent += 1
-                    num_tokens = len(sent)
-
-                    # We don't attempt to parse very long sentences (>100 tokens)
-                    # since they are memory intensive (>16 GB) and may take
-                    # minutest to process
-                    if num_tokens <= MAX_SENTENCE_TOKENS and sent.parse():
-                        # Obtain a text representation of the parse tree
-                        token_dicts = TreeUtility.dump_tokens(
-                            sent.tokens, sent.tree, words
-                        )
-                        # Create a verbose text representation of
-                        # the highest scoring parse tree
-                        tree = ParseForestDumper.dump_forest(
-                            sent.tree, token_dicts=token_dicts
-                        )
-                        # Add information about the sentence tree's score
-                        # and the number of tokens
-                        trees[num_sent] = "\n".join(
-                            [
-                                "C{0}".format(sent.score),
-                                "L{0}".format(num_tokens),
-                                tree
-                            ]
-                        )
+
+                    if result is not None:
+                        sent.reuse(result)
+                    elif do_parse:
+                        # Parse the sentence, unless its result is already
+                        # in the sentence cache, or collect its result from
+                        # the parser pool. If the parse governor is enabled,
+                        # it abandons the parse if the sentence takes too
+                        # much time or memory.
+                        t0 = time.time()
+                        sent.parse()
+                        parse_seconds += time.time() - t0
+                        parse_sentences += 1
                     else:
-                        # Error, sentence too long or no parse:
-                        # add an error index entry for this sentence
-                        if num_tokens > MAX_SENTENCE_TOKENS:
-                            # Set the error index at the first
-                            # token outside the maximum limit
-                            eix = MAX_SENTENCE_TOKENS
-                        else:
-                            eix = sent.err_index
-                        token_dicts = TreeUtility.dump_tokens(
-                            sent.tokens, None, None, eix
-                        )
-                        trees[num_sent] = "E{0}".format(eix)
+                        # Sentence too long: set the error index at
+                        # the first token outside the maximum limit
+                        sent.abandon("length", MAX_SENTENCE_TOKENS)
+                    # Obtain the tree in text dump format along with the token dicts
+                    result = sent.dump()
+                    trees[num_sent] = result.tree
+                    token_dicts = result.tokens
+                    for stem, cat, cnt in result.words:
+                        words[WordTuple(stem, cat)] += cnt
 
                     pgs[-1].append(token_dicts)
 
             # parse_time = ip.parse_time
+            Article._parse_seconds += parse_seconds
+            Article._parse_sentences += parse_sentences
 
             self._parsed = datetime.utcnow()
             self._parser_version = bp.version
@@ -341,9 +712,11 @@ class Article:
             self._num_parsed = ip.num_parsed
             self._ambiguity = ip.ambiguity
 
-            # Make one big JSON string for the paragraphs, sentences and tokens
-            self._raw_tokens = pgs
-            self._tokens = json.dumps(pgs, separators=(",", ":"), ensure_ascii=False)
+            # Store the paragraphs, sentences and tokens in the compact,
+            # sentence-indexed format. The JSON string is generated on demand.
+            self._token_doc = bintokens.TokenDoc(pgs=pgs)
+            self._tokens_bin = bintokens.encode(pgs)
+            self._tokens = None
 
             # Keep the bag of words (stem, category, count for each word)
             self._words = words
@@ -352,91 +725,64 @@ class Article:
             self._tree = "".join(
                 "S{0}\n{1}\n".format(key, val) for key, val in trees.items()
             )
+            # ...and its binary equivalent, which is faster to load
+            self._tree_bin = tree_to_binary(self._tree)
+            # Index the symbols occurring in the sentence trees
+            self._symbols = tree_symbols(self._tree_bin)
 
     def store(self, enclosing_session=None):
         """ Store an article in the database, inserting it or updating """
         with SessionContext(enclosing_session, commit=True) as session:
+            self._store_html(session)
             if self._uuid is None:
                 # Insert a new row
                 self._uuid = str(uuid.uuid1())
-                ar = ArticleRow(
-                    id=self._uuid,
-                    url=self._url,
-                    root_id=self._root_id,
-                    heading=self._heading,
-                    author=self._author,
-                    timestamp=self._timestamp,
-                    authority=self._authority,
-                    scraped=self._scraped,
-                    parsed=self._parsed,
-                    processed=self._processed,
-                    indexed=self._indexed,
-                    scr_module=self._scr_module,
-                    scr_class=self._scr_class,
-                    scr_version=self._scr_version,
-                    parser_version=self._parser_version,
-                    num_sentences=self._num_sentences,
-                    num_parsed=self._num_parsed,
-                    ambiguity=self._ambiguity,
-                    html=self._html,
-                    tree=self._tree,
-                    tokens=self._tokens,
-                )
+                values = self._column_values()
+                ar = ArticleRow(id=self._uuid, **values)
                 session.add(ar)
+                self._stored = values
                 if self._words:
                     # Store the word stems occurring in the article
                     self._store_words(session)
+                if self._symbols is not None:
+                    self._store_symbols(session)
                 return True
 
-            # Update an already existing row by UUID
-            ar = (
-                session
-                .query(ArticleRow)
-                .filter(ArticleRow.id == self._uuid)
-                .one_or_none()
-            )
-            if ar is None:
-                # UUID not found: something is wrong here...
-                return False
-
-            # Update the columns
+            # Update an already existing row by UUID, writing only
+            # the columns that have changed (the HTML, in particular,
+            # is not sent back to the database after a parse)
             # UUID is immutable
-            ar.url = self._url
-            ar.root_id = self._root_id
-            ar.heading = self._heading
-            ar.author = self._author
-            ar.timestamp = self._timestamp
-            ar.authority = self._authority
-            ar.scraped = self._scraped
-            ar.parsed = self._parsed
-            ar.processed = self._processed
-            ar.indexed = self._indexed
-            ar.scr_module = self._scr_module
-            ar.scr_class = self._scr_class
-            ar.scr_version = self._scr_version
-            ar.parser_version = self._parser_version
-            ar.num_sentences = self._num_sentences
-            ar.num_parsed = self._num_parsed
-            ar.ambiguity = self._ambiguity
-            ar.html = self._html
-            ar.tree = self._tree
-            ar.tokens = self._tokens
+            dirty = self._dirty_columns()
+            if dirty:
+                cnt = (
+                    session
+                    .query(ArticleRow)
+                    .filter(ArticleRow.id == self._uuid)
+                    .update(dirty, synchronize_session=False)
+                )
+                if not cnt:
+                    # UUID not found: something is wrong here...
+                    return False
+                self._stored.update(dirty)
             if self._words is not None:
                 # If the article has been parsed, update the index of word stems
                 # (This may cause all stems for the article to be deleted, if
                 # there are no successfully parsed sentences in the article)
                 self._store_words(session)
+            if self._symbols is not None:
+                # Likewise, update the index of tree symbols
+                self._store_symbols(session)
             return True
 
     def prepare(self, enclosing_session=None, verbose=False, reload_parser=False):
         """ Prepare the article for display. If it's not already tokenized and parsed, do it now. """
         with SessionContext(enclosing_session, commit=True) as session:
-            if self._tree is None or self._tokens is None:
+            if self._tree is None or (self._tokens is None and self._tokens_bin is None):
                 if reload_parser:
                     # We need a parse: Make sure we're using the newest grammar
                     self.reload_parser()
-                self._parse(session, verbose=verbose)
-                if self._tree is not None or self._tokens is not None:
+                self._parse(session, verbose=verbose, reuse=self._duplicate_reuse(session))
+                if self._tree is not None or self._tokens_bin is not None:
                     # Store the updated article in the database
                     self.store(session)
 
@@ -446,15 +792,198 @@ class Article:
             if reload_parser:
                 # We need a parse: Make sure we're using the newest grammar
                 self.reload_parser()
-            self._parse(session, verbose=verbose)
-            if self._tree is not None or self._tokens is not None:
+            self._parse(session, verbose=verbose, reuse=self._duplicate_reuse(session))
+            if self._tree is not None or self._tokens_bin is not None:
+                # Store the updated article in the database
+                self.store(session)
+
+    def _duplicate_reuse(self, session):
+        """ If this article is a near-duplicate of another one that has been
+            parsed with the current parser version, return a function for
+            _parse() that reuses the results of the sentences that occur
+            in both articles. Otherwise, return None. """
+        self._duplicate_reused = 0
+        if not self._duplicate_of:
+            return None
+        c = (
+            session
+            .query(
+                ArticleRow.tree,
+                ArticleRow.tokens,
+                ArticleRow.tokens_bin,
+                ArticleRow.ambiguity,
+            )
+            .filter(ArticleRow.url == self._duplicate_of)
+            .filter(ArticleRow.parser_version == self.parser_version())
+            .one_or_none()
+        )
+        if c is None or not c.tree:
+            # The canonical copy has not been parsed (yet)
+            return None
+        canonical = Article(url=self._duplicate_of)
+        canonical._tree = c.tree
+        canonical._tokens = c.tokens
+        canonical._tokens_bin = c.tokens_bin
+        doc = canonical._doc()
+        if doc is None:
+            return None
+        # The successfully parsed sentences of the canonical copy,
+        # by the text of their tokens
+        sentences = dict()
+        for num_sent, tree in canonical._sentence_trees().items():
+            if num_sent <= doc.num_sentences and tree.startswith("C"):
+                token_dicts = doc.sentence(num_sent - 1)
+                key = tuple(self._dash(d.get("x")) for d in token_dicts)
+                sentences.setdefault(key, (tree, token_dicts))
+        if not sentences:
+            return None
+        ambiguity = c.ambiguity or 1.0
+
+        def reuse(num_sent, sent):
+            """ Return the result of the same sentence in the canonical copy, if any """
+            key = tuple(self._dash(t.txt) for t in sent.tokens)
+            found = sentences.get(key)
+            if found is None or not self._same_tokens(found[1], sent.tokens):
+                return None
+            self._duplicate_reused += 1
+            return self._reused_result(found[0], found[1], sent, ambiguity)
+
+        return reuse
+
+    @staticmethod
+    def _dash(txt):
+        """ Normalize the dashes in a token text, for comparison purposes """
+        return "-" if txt in ("—", "–") else txt
+
+    @staticmethod
+    def _reused_result(tree, token_dicts, sent, ambiguity):
+        """ Return a ParsedSentence for a sentence, from the stored tree and
+            token dicts of an identical sentence. The number of parse tree
+            combinations is not stored, so it is estimated from the
+            ambiguity of the article that the results come from. """
+        words = defaultdict(int)
+        TreeUtility.words_from_token_dicts(token_dicts, words)
+        score = int(tree.split("\n", maxsplit=1)[0][1:])
+        return ParsedSentence(
+            ambiguity ** len(sent),
+            score,
+            None,
+            tree,
+            token_dicts,
+            [(w.stem, w.cat, cnt) for w, cnt in words.items()],
+        )
+
+    @classmethod
+    def estimated_parse_seconds(cls, num_sentences):
+        """ Return an estimate of the time needed to parse the given number
+            of sentences, from the average parse time in this process """
+        if not Article._parse_sentences:
+            return 0.0
+        return num_sentences * Article._parse_seconds / Article._parse_sentences
+
+    def reparse_incremental(self, enclosing_session=None, verbose=False):
+        """ Reparse an article that was parsed with an older grammar version,
+            only reparsing the sentences that failed or that may be affected
+            by the grammar change (see grammardiff.py), and keeping the
+            previous results of the rest. Returns a tuple of the number of
+            reused sentences and the number of (re)parsed sentences. """
+        reused = 0
+        reparsed = 0
+        with SessionContext(enclosing_session, commit=True) as session:
+            diff = GrammarDiff.load(session, self._parser_version, self.get_parser())
+            old_trees = self._sentence_trees() if diff is not None else {}
+            old_doc = self._doc() if old_trees else None
+            # The number of parse tree combinations of reused sentences
+            # is estimated from the previous ambiguity of the article
+            ambiguity = self._ambiguity or 1.0
+
+            def reuse(num_sent, sent):
+                """ Return the previous result of a sentence, if it is unaffected
+                    by the grammar change and still consists of the same tokens """
+                nonlocal reused, reparsed
+                tree = old_trees.get(num_sent)
+                result = None
+                if (
+                    tree is not None
+                    and old_doc is not None
+                    and num_sent <= old_doc.num_sentences
+                    and not diff.touches(tree)
+                ):
+                    token_dicts = old_doc.sentence(num_sent - 1)
+                    if self._same_tokens(token_dicts, sent.tokens):
+                        result = self._reused_result(tree, token_dicts, sent, ambiguity)
+                if result is None:
+                    reparsed += 1
+                else:
+                    reused += 1
+                return result
+
+            self._parse(session, verbose=verbose, reuse=reuse)
+            if self._tree is not None or self._tokens_bin is not None:
                 # Store the updated article in the database
                 self.store(session)
+        return reused, reparsed
+
+    def _sentence_trees(self):
+        """ Return a dict of the stored sentence trees in text format
+            (without the S lines), by 1-based sentence index """
+        trees = dict()
+        if not self._tree:
+            return trees
+        index = None
+        lines = []
+        for line in self._tree.split("\n"):
+            if line.startswith("S"):
+                if index is not None:
+                    trees[index] = "\n".join(lines)
+                index = int(line[1:])
+                lines = []
+            elif line:
+                lines.append(line)
+        if index is not None:
+            trees[index] = "\n".join(lines)
+        return trees
+
+    @staticmethod
+    def _same_tokens(token_dicts, tokens):
+        """ Return True if the stored token dicts correspond to the given tokens.
+            Besides the text, the kinds of the tokens must match, and person
+            tokens must have the full name and gender of the stored token as
+            their only meaning, since the entity recognizer resolves names
+            from their context in the article. """
+        if len(token_dicts) != len(tokens):
+            return False
+        for d, t in zip(token_dicts, tokens):
+            x = d.get("x")
+            # Hyphens may have been replaced by em or en dashes in the dicts
+            if x != t.txt and not (t.txt == "-" and x in ("—", "–")):
+                return False
+            if d.get("k", TOK.WORD) != t.kind:
+                return False
+            if t.kind == TOK.PERSON and t.val:
+                if {(fn, g) for fn, g, _ in t.val} != {(d.get("v"), d.get("g"))}:
+                    return False
+        return True
 
     @property
     def url(self):
         return self._url
 
+    @property
+    def duplicate_of(self):
+        return self._duplicate_of
+
+    @property
+    def signature(self):
+        """ The SimHash signature of the article text, if any (see dedup.py) """
+        return self._simhash
+
+    @property
+    def duplicate_reused(self):
+        """ The number of sentences whose results were taken from the
+            canonical copy of this near-duplicate in the last parse """
+        return self._duplicate_reused
+
     @property
     def uuid(self):
         return self._uuid
@@ -497,145 +1026,175 @@ class Article:
 
     @property
     def html(self):
-        return self._html
+        return self._get_html()
+
+    @property
+    def has_html(self):
+        """ Return True if the article has HTML, without loading it
+            from the blob store """
+        self._load_content()
+        return self._html is not None or self._html_hash is not None
 
     @property
     def tree(self):
         return self._tree
 
+    @property
+    def tree_bin(self):
+        return self._tree_bin
+
+    @property
+    def tree_data(self):
+        """ The parse tree in the fastest available format, for Tree.load() """
+        return self._tree_bin or self._tree
+
     @property
     def tokens(self):
+        """ The tokens of the article as a JSON string """
+        if self._tokens is None and self._tokens_bin:
+            self._tokens = self._doc().to_json()
         return self._tokens
 
+    @property
+    def token_doc(self):
+        """ The tokens of the article as a TokenDoc (see bintokens.py) """
+        return self._doc()
+
     @property
     def num_tokens(self):
         """ Count the tokens in the article and cache the result """
         if self._num_tokens is None:
-            if self._raw_tokens is None and self._tokens:
-                self._raw_tokens = json.loads(self._tokens)
-            cnt = 0
-            if self._raw_tokens:
-                for p in self._raw_tokens:
-                    for sent in p:
-                        cnt += len(sent)
-            self._num_tokens = cnt
+            doc = self._doc()
+            self._num_tokens = 0 if doc is None else doc.num_tokens
         return self._num_tokens
 
     @staticmethod
-    def token_stream(limit=None, skip_errors=True):
+    def token_stream(limit=None, skip_errors=True, processes=0):
         """ Generator of a token stream consisting of `limit` sentences (or less) from the
-            most recently parsed articles. After each sentence, None is yielded. """
-        with SessionContext(commit=True, read_only=True) as session:
-
-            q = (
-                session
-                .query(ArticleRow.url, ArticleRow.parsed, ArticleRow.tokens)
-                .filter(ArticleRow.tokens != None)
-                .order_by(desc(ArticleRow.parsed))
-                .yield_per(200)
-            )
-
-            count = 0
-            for a in q:
-                doc = json.loads(a.tokens)
-                for pg in doc:
-                    for sent in pg:
-                        if not sent:
-                            continue
-                        if skip_errors and any("err" in t for t in sent):
-                            # Skip error sentences
-                            continue
-                        for t in sent:
-                            # Yield the tokens
-                            yield t
-                        yield None  # End-of-sentence marker
-                        # Are we done?
-                        count += 1
-                        if limit is not None and count >= limit:
-                            return
+            most recently parsed articles. After each sentence, None is yielded.
+            If processes > 0, the tokens are decoded in a pool of that many
+            worker processes (see corpusstream.py). """
+        return CorpusStream(processes=processes, skip_errors=skip_errors).tokens(
+            limit=limit
+        )
 
     @staticmethod
-    def sentence_stream(limit=None, skip=None, skip_errors=True):
+    def sentence_stream(limit=None, skip=None, skip_errors=True, processes=0):
         """ Generator of a sentence stream consisting of `limit` sentences (or less) from the
-            most recently parsed articles. Each sentence is a list of token dicts. """
-        with SessionContext(commit=True, read_only=True) as session:
+            most recently parsed articles. Each sentence is a list of token dicts.
+            If processes > 0, the tokens are decoded in a pool of that many
+            worker processes. For a resumable stream with throughput
+            statistics, use corpusstream.CorpusStream directly. """
+        return CorpusStream(processes=processes, skip_errors=skip_errors).sentences(
+            limit=limit, skip=skip
+        )
 
+    @staticmethod
+    def _articles_query(session, criteria):
+        """ Return a query for the article rows that meet the given criteria """
+        # The criteria are currently "timestamp", "author" and "domain",
+        # as well as "order_by_parse" which if True indicates that the result
+        # should be ordered with the most recently parsed articles first.
+
+        # Only fetch articles that have a parse tree
+        q = session.query(ArticleRow).filter(ArticleRow.tree != None)
+
+        # timestamp is assumed to contain a tuple: (from, to)
+        if criteria and "timestamp" in criteria:
+            ts = criteria["timestamp"]
             q = (
-                session
-                .query(ArticleRow.url, ArticleRow.parsed, ArticleRow.tokens)
-                .filter(ArticleRow.tokens != None)
-                .order_by(desc(ArticleRow.parsed))
-                .yield_per(200)
+                q
+                .filter(ArticleRow.timestamp >= ts[0])
+                .filter(ArticleRow.timestamp < ts[1])
             )
 
-            count = 0
-            skipped = 0
-            for a in q:
-                doc = json.loads(a.tokens)
-                for pg in doc:
-                    for sent in pg:
-                        if not sent:
-                            continue
-                        if skip_errors and any("err" in t for t in sent):
-                            # Skip error sentences
-                            continue
-                        if skip is not None and skipped < skip:
-                            # If requested, skip sentences from the front (useful for test set)
-                            skipped += 1
-                            continue
-                        # Yield the sentence as a fresh token list
-                        yield [t for t in sent]
-                        # Are we done?
-                        count += 1
-                        if limit is not None and count >= limit:
-                            return
+        if criteria and "author" in criteria:
+            author = criteria["author"]
+            q = q.filter(ArticleRow.author == author)
+
+        if criteria and ("visible" in criteria or "domain" in criteria):
+            # Need a join with Root for these criteria
+            q = q.join(Root)
+            if "visible" in criteria:
+                # Return only articles from roots with the specified visibility
+                visible = criteria["visible"]
+                assert isinstance(visible, bool)
+                q = q.filter(Root.visible == visible)
+            if "domain" in criteria:
+                # Return only articles from the specified domain
+                domain = criteria["domain"]
+                assert isinstance(domain, str)
+                q = q.filter(Root.domain == domain)
+
+        if criteria and criteria.get("order_by_parse"):
+            # Order with newest parses first
+            q = q.order_by(desc(ArticleRow.parsed))
+
+        return q
 
     @classmethod
     def articles(cls, criteria, enclosing_session=None):
         """ Generator of Article objects from the database that meet the given criteria """
-        # The criteria are currently "timestamp", "author" and "domain",
-        # as well as "order_by_parse" which if True indicates that the result
-        # should be ordered with the most recently parsed articles first.
         with SessionContext(
             commit=True, read_only=True, session=enclosing_session
         ) as session:
 
-            # Only fetch articles that have a parse tree
-            q = session.query(ArticleRow).filter(ArticleRow.tree != None)
-
-            # timestamp is assumed to contain a tuple: (from, to)
-            if criteria and "timestamp" in criteria:
-                ts = criteria["timestamp"]
-                q = (
-                    q
-                    .filter(ArticleRow.timestamp >= ts[0])
-                    .filter(ArticleRow.timestamp < ts[1])
-                )
-
-            if criteria and "author" in criteria:
-                author = criteria["author"]
-                q = q.filter(ArticleRow.author == author)
-
-            if criteria and ("visible" in criteria or "domain" in criteria):
-                # Need a join with Root for these criteria
-                q = q.join(Root)
-                if "visible" in criteria:
-                    # Return only articles from roots with the specified visibility
-                    visible = criteria["visible"]
-                    assert isinstance(visible, bool)
-                    q = q.filter(Root.visible == visible)
-                if "domain" in criteria:
-                    # Return only articles from the specified domain
-                    domain = criteria["domain"]
-                    assert isinstance(domain, str)
-                    q = q.filter(Root.domain == domain)
-
-            if criteria and criteria.get("order_by_parse"):
-                # Order with newest parses first
-                q = q.order_by(desc(ArticleRow.parsed))
+            # Load the parse results, but not the content
+            q = cls._articles_query(session, criteria).options(
+                undefer_group("tree"), undefer_group("tokens")
+            )
 
             for arow in q.yield_per(500):
-                yield cls._init_from_row(arow)
+                yield cls._init_from_row(arow, _CONTENT_COLUMNS)
+
+    @classmethod
+    def _indexed_candidates(cls, session, criteria, clauses):
+        """ Generator of (Article, sentence index set) tuples for the
+            articles meeting the criteria that may contain sentences
+            satisfying the clauses, according to the tree symbol index.
+            The index set is None for articles that have not been
+            indexed, which must be scanned in full. """
+        symbols = set(chain.from_iterable(clauses))
+        symbols.add(ALL_SENTENCES)
+        q = cls._articles_query(session, criteria).with_entities(ArticleRow.id)
+        ids = []
+
+        def candidates(ids):
+            """ Look up a batch of article ids in the index, and
+                load the candidate articles, in the original order """
+            index = TreeSymbol.lookup(session, ids, symbols)
+            sentences = dict()
+            for article_id in ids:
+                syms = index.get(article_id)
+                if syms is None or ALL_SENTENCES not in syms:
+                    # Not indexed: fall back to a full scan of the article
+                    sentences[article_id] = None
+                else:
+                    ixs = matching_sentences(syms, clauses)
+                    if ixs:
+                        sentences[article_id] = ixs
+            if not sentences:
+                return
+            rows = {
+                arow.id: arow
+                for arow in session.query(ArticleRow)
+                .options(undefer_group("tree"), undefer_group("tokens"))
+                .filter(ArticleRow.id.in_(list(sentences.keys())))
+            }
+            for article_id in ids:
+                if article_id in sentences and article_id in rows:
+                    yield (
+                        cls._init_from_row(rows[article_id], _CONTENT_COLUMNS),
+                        sentences[article_id],
+                    )
+
+        for (article_id,) in q.yield_per(_INDEX_BATCH_SIZE):
+            ids.append(article_id)
+            if len(ids) >= _INDEX_BATCH_SIZE:
+                yield from candidates(ids)
+                ids = []
+        if ids:
+            yield from candidates(ids)
 
     @classmethod
     def all_matches(cls, criteria, pattern, enclosing_session=None):
@@ -646,14 +1205,25 @@ class Article:
             commit=True, read_only=True, session=enclosing_session
         ) as session:
 
+            # Find the symbols that a sentence must contain to match the pattern.
+            # If there are any, use the tree symbol index to select the articles,
+            # and the sentences within them, that need to be examined.
+            clauses = pattern_clauses(pattern)
+            if clauses:
+                candidates = cls._indexed_candidates(session, criteria, clauses)
+            else:
+                candidates = (
+                    (a, None) for a in cls.articles(criteria, enclosing_session=session)
+                )
+
             # t0 = time.time()
             mcnt = acnt = tcnt = 0
             # print("Starting article loop")
-            for a in cls.articles(criteria, enclosing_session=session):
+            for a, indices in candidates:
                 acnt += 1
                 tree = Tree(url=a.url, authority=a.authority)
-                tree.load(a.tree)
-                for ix, simple_tree in tree.simple_trees():
+                tree.load(a.tree_data)
+                for ix, simple_tree in tree.simple_trees(indices=indices):
                     tcnt += 1
                     for match in simple_tree.all_matches(pattern):
                         yield (a, ix, match)
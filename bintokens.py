@@ -0,0 +1,280 @@
+"""
+
+    Reynir: Natural language processing for Icelandic
+
+    Compact token storage module
+
+    Copyright (C) 2018 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+    This module implements a compressed, sentence-indexed encoding of the
+    tokens of an article, i.e. the list of paragraphs, each containing
+    a list of sentences, each containing a list of token dicts.
+
+    Each sentence is stored as a separately compressed JSON list, so that
+    a single sentence can be decoded without touching the rest of the
+    article. The compression uses a preset dictionary of common token
+    dict fragments, which makes it effective even for short sentences.
+
+    The encoding consists of:
+
+    * A 4-byte header: the magic bytes b"RTK" followed by a version byte.
+    * Two 32-bit little-endian unsigned integers: the number of
+      paragraphs and the number of sentences.
+    * The number of sentences in each paragraph (32-bit each).
+    * The offset of each sentence within the data area, plus the end
+      offset of the last sentence (32-bit each).
+    * The number of tokens in each sentence (32-bit each).
+    * A flag byte for each sentence, with bit 0 set if the sentence
+      contains an error token (i.e. it was not parsed).
+    * The data area: the compressed sentences, one after another.
+
+    The token counts and error flags allow counting tokens and skipping
+    error sentences without decompressing anything.
+
+"""
+
+import sys
+import json
+import zlib
+import struct
+
+from array import array
+
+
+# Magic header and current version number of the token encoding.
+# Note that the version number must be incremented if _ZDICT is modified.
+MAGIC = b"RTK"
+VERSION = 1
+
+# Sentence flags
+FLAG_ERROR = 1
+
+# Preset compression dictionary, containing fragments that occur
+# frequently in token dicts (see TreeUtility.dump_tokens()).
+# The most common fragments are at the end.
+_ZDICT = (
+    '"v":[null,null,null]},"k":12,"k":11,"k":10,"k":8,"k":7,"k":6,"k":5,'
+    '"k":4,"k":3,"k":2,"k":1,"err":1},"k":14,"k":15,"g":"kk"},"g":"kvk"},'
+    '"t":"sérnafn","t":"person_nf_kk","ao","alm","ÞF","ÞGF","EF","NF",'
+    '"GM-FH-ÞT-3P-ET"],"GM-FH-NT-3P-ET"],"GM-NH"],"so_0_et_p3",'
+    '"tala_ft_þf_kk","no_et_nf_kk","no_et_þf_kvk","no_et_þgf_hk",'
+    '"fs_þgf","fs_þf","fn_et_nf_kk","ob","-"],"st","so","kk","kvk","hk",'
+    '"NFET"],"ÞFET"],"ÞGFET"],"EFET"],"NFETgr"],"ÞFETgr"],"ÞGFETgr"],'
+    '"m":["og","st","ob","-"],"a":"\\"og:st\\""},{"x":".","k":1},'
+    '{"x":",","k":1},"a":"no_et_"m":["{"x":"","t":"","a":"{"x":"'
+).encode("utf-8")
+
+_HEADER = struct.Struct("<II")
+_HEADER_START = len(MAGIC) + 1
+_BIG_ENDIAN = sys.byteorder == "big"
+
+assert array("I").itemsize == 4
+
+
+class TokenDocError(Exception):
+
+    """ Exception class for malformed token documents """
+
+    pass
+
+
+def is_tokendoc(data):
+    """ Return True if data is (probably) an encoded token document """
+    return isinstance(data, (bytes, bytearray, memoryview)) and bytes(
+        data[0 : len(MAGIC)]
+    ) == MAGIC
+
+
+def _has_error(sent):
+    """ Return True if the sentence contains an error token """
+    return any("err" in t for t in sent)
+
+
+def encode(pgs):
+    """ Encode a list of paragraphs, each a list of sentences, each
+        a list of token dicts, returning a bytes object """
+    para_counts = array("I", (len(p) for p in pgs))
+    offsets = array("I", [0])
+    lengths = array("I")
+    flags = bytearray()
+    chunks = []
+    pos = 0
+    for p in pgs:
+        for sent in p:
+            c = zlib.compressobj(level=9, zdict=_ZDICT)
+            chunk = c.compress(
+                json.dumps(sent, separators=(",", ":"), ensure_ascii=False).encode(
+                    "utf-8"
+                )
+            ) + c.flush()
+            chunks.append(chunk)
+            pos += len(chunk)
+            offsets.append(pos)
+            lengths.append(len(sent))
+            flags.append(FLAG_ERROR if _has_error(sent) else 0)
+    if _BIG_ENDIAN:
+        for a in (para_counts, offsets, lengths):
+            a.byteswap()
+    return b"".join(
+        [
+            MAGIC,
+            bytes((VERSION,)),
+            _HEADER.pack(len(para_counts), len(lengths)),
+            para_counts.tobytes(),
+            offsets.tobytes(),
+            lengths.tobytes(),
+            bytes(flags),
+        ]
+        + chunks
+    )
+
+
+class TokenDoc:
+
+    """ Read access to the tokens of an article, either from the compact
+        encoding (decoding sentences lazily as they are requested) or
+        from an already decoded paragraph list """
+
+    def __init__(self, data=None, pgs=None):
+        if pgs is not None:
+            # Already decoded
+            self._data = None
+            self._base = 0
+            self._para_counts = [len(p) for p in pgs]
+            self._sents = [sent for p in pgs for sent in p]
+            self._offsets = None
+            self._lengths = [len(sent) for sent in self._sents]
+            self._flags = bytes(
+                FLAG_ERROR if _has_error(sent) else 0 for sent in self._sents
+            )
+            return
+        if not is_tokendoc(data):
+            raise TokenDocError("Not an encoded token document")
+        data = bytes(data)
+        version = data[len(MAGIC)]
+        if version != VERSION:
+            raise TokenDocError("Unsupported token document version {0}".format(version))
+        num_paras, num_sents = _HEADER.unpack_from(data, _HEADER_START)
+        pos = _HEADER_START + _HEADER.size
+
+        def read_array(n):
+            nonlocal pos
+            a = array("I")
+            a.frombytes(data[pos : pos + 4 * n])
+            if _BIG_ENDIAN:
+                a.byteswap()
+            pos += 4 * n
+            return a
+
+        self._para_counts = read_array(num_paras)
+        self._offsets = read_array(num_sents + 1)
+        self._lengths = read_array(num_sents)
+        self._flags = data[pos : pos + num_sents]
+        self._base = pos + num_sents
+        self._data = data
+        self._sents = None
+
+    @classmethod
+    def from_json(cls, tokens):
+        """ Create a TokenDoc from the JSON string format of the tokens """
+        return cls(pgs=json.loads(tokens))
+
+    @property
+    def num_paragraphs(self):
+        return len(self._para_counts)
+
+    @property
+    def num_sentences(self):
+        return len(self._lengths)
+
+    @property
+    def num_tokens(self):
+        """ The total number of tokens in the document """
+        return sum(self._lengths)
+
+    def sentence_length(self, ix):
+        """ Return the number of tokens in the sentence with
+            the given 0-based index """
+        return self._lengths[ix]
+
+    def has_error(self, ix):
+        """ Return True if the sentence with the given 0-based index
+            contains an error token, i.e. was not parsed """
+        return bool(self._flags[ix] & FLAG_ERROR)
+
+    def _sentence_json(self, ix):
+        """ Return the JSON string of the sentence with the given 0-based index """
+        if self._sents is not None:
+            return json.dumps(
+                self._sents[ix], separators=(",", ":"), ensure_ascii=False
+            )
+        start = self._base + self._offsets[ix]
+        end = self._base + self._offsets[ix + 1]
+        d = zlib.decompressobj(zdict=_ZDICT)
+        return d.decompress(self._data[start:end]).decode("utf-8")
+
+    def sentence(self, ix):
+        """ Return the sentence with the given 0-based index,
+            as a list of token dicts """
+        if self._sents is not None:
+            return self._sents[ix]
+        return json.loads(self._sentence_json(ix))
+
+    def sentences(self, skip_errors=False):
+        """ Generator of (index, sentence) tuples for all sentences
+            in the document, optionally skipping error sentences
+            without decoding them """
+        for ix in range(self.num_sentences):
+            if skip_errors and self.has_error(ix):
+                continue
+            yield ix, self.sentence(ix)
+
+    def paragraphs(self):
+        """ Generator of paragraphs, each a list of sentences """
+        ix = 0
+        for cnt in self._para_counts:
+            yield [self.sentence(i) for i in range(ix, ix + cnt)]
+            ix += cnt
+
+    def to_list(self):
+        """ Return the entire document as a list of paragraphs """
+        return list(self.paragraphs())
+
+    def to_json(self):
+        """ Return the entire document in the JSON string format """
+        if self._sents is not None:
+            return json.dumps(self.to_list(), separators=(",", ":"), ensure_ascii=False)
+        # Assemble the JSON directly from the stored sentence strings,
+        # avoiding a round trip through Python objects
+        pgs = []
+        ix = 0
+        for cnt in self._para_counts:
+            pgs.append(
+                "[" + ",".join(self._sentence_json(i) for i in range(ix, ix + cnt)) + "]"
+            )
+            ix += cnt
+        return "[" + ",".join(pgs) + "]"
+
+
+def load(tokens_bin, tokens=None):
+    """ Return a TokenDoc for the tokens of an article, preferring the
+        compact encoding and falling back to the JSON string format.
+        Returns None if neither is available. """
+    if tokens_bin:
+        return TokenDoc(tokens_bin)
+    if tokens:
+        return TokenDoc.from_json(tokens)
+    return None
@@ -0,0 +1,216 @@
+"""
+
+    Reynir: Natural language processing for Icelandic
+
+    Binary tree format module
+
+    Copyright (C) 2018 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+    This module implements a compact binary encoding of the parse trees
+    that are stored with each article, as an alternative to the
+    S/C/L/T/N text format. The binary format can be loaded without
+    any line splitting or regular expression matching.
+
+    The encoding consists of:
+
+    * A 5-byte header: the magic bytes b"RTB" followed by a version byte
+      and a byte giving the width of the integers in the integer array
+      (2 or 4 bytes).
+    * A 32-bit little-endian unsigned integer giving the byte length
+      of the string table.
+    * The string table: UTF-8 encoded strings separated by NUL bytes.
+      String index 0 is always the empty string.
+    * An array of 16- or 32-bit little-endian signed integers containing
+      the sentence records, described below. The narrower width is used
+      whenever all the integers fit, which is nearly always the case.
+
+    The integer array starts with the number of sentences, followed by
+    a record for each sentence:
+
+    * Sentence index (1-based), record length (number of integers
+      following this field within the sentence record), and sentence kind.
+    * For a parsed sentence (kind 0): score, length in tokens,
+      then the tree nodes in depth-first order:
+        N (0): level, nonterminal
+        T (1): level, terminal, augmented terminal, token,
+               token type, auxiliary info, terminal category
+        P (2): level
+      where the names are indices into the string table.
+    * For a sentence that was not parsed (kind 1): the error token index,
+      optionally followed by the reason why the parse was abandoned
+      (see governor.py), as an index into the string table.
+
+    The record length allows a reader to skip sentences that it is
+    not interested in without decoding their nodes.
+
+"""
+
+import sys
+import struct
+
+from array import array
+
+
+# Magic header and current version number of the binary tree format
+MAGIC = b"RTB"
+VERSION = 1
+
+# Sentence kinds
+SENT_PARSED = 0
+SENT_ERROR = 1
+
+# Node codes
+NODE_N = 0
+NODE_T = 1
+NODE_P = 2
+
+# Array type codes by integer width
+_TYPECODES = {2: "h", 4: "i"}
+_INT16_MIN, _INT16_MAX = -(1 << 15), (1 << 15) - 1
+
+_HEADER_LEN = len(MAGIC) + 2
+_LEN_STRUCT = struct.Struct("<I")
+_BIG_ENDIAN = sys.byteorder == "big"
+
+assert all(array(tc).itemsize == w for w, tc in _TYPECODES.items())
+
+
+class BinaryTreeError(Exception):
+
+    """ Exception class for malformed binary trees """
+
+    pass
+
+
+def is_binary(data):
+    """ Return True if data is (probably) a tree in binary format """
+    return isinstance(data, (bytes, bytearray, memoryview)) and bytes(
+        data[0 : len(MAGIC)]
+    ) == MAGIC
+
+
+class BinaryTreeWriter:
+
+    """ Accumulates sentences and nodes and returns a binary tree encoding """
+
+    def __init__(self):
+        # String table, with the empty string at index 0
+        self._strings = {"": 0}
+        self._ints = array("i", [0])  # Number of sentences, filled in later
+        self._num_sentences = 0
+        self._rec_start = None
+
+    def _str(self, s):
+        """ Return the string table index of s, adding it if required """
+        ix = self._strings.get(s)
+        if ix is None:
+            ix = self._strings[s] = len(self._strings)
+        return ix
+
+    def begin_sentence(self, index, score, length):
+        """ Start the record of a successfully parsed sentence """
+        assert self._rec_start is None
+        self._ints.extend((index, 0, SENT_PARSED, score, length))
+        # Note the position of the record length field
+        self._rec_start = len(self._ints) - 4
+
+    def nonterminal(self, level, nonterminal):
+        """ Add a nonterminal node """
+        self._ints.extend((NODE_N, level, self._str(nonterminal)))
+
+    def terminal(self, level, terminal, augmented_terminal, token, tokentype, aux, cat):
+        """ Add a terminal node """
+        s = self._str
+        self._ints.extend(
+            (
+                NODE_T,
+                level,
+                s(terminal),
+                s(augmented_terminal),
+                s(token),
+                s(tokentype),
+                s(aux),
+                s(cat),
+            )
+        )
+
+    def epsilon(self, level):
+        """ Add an epsilon (empty) node """
+        self._ints.extend((NODE_P, level))
+
+    def end_sentence(self):
+        """ Finish the record of a successfully parsed sentence """
+        start = self._rec_start
+        assert start is not None
+        self._ints[start] = len(self._ints) - start - 1
+        self._rec_start = None
+        self._num_sentences += 1
+
+    def error_sentence(self, index, err_index, reason=None):
+        """ Add a record for a sentence that was not parsed """
+        assert self._rec_start is None
+        if reason:
+            self._ints.extend((index, 3, SENT_ERROR, err_index, self._str(reason)))
+        else:
+            self._ints.extend((index, 2, SENT_ERROR, err_index))
+        self._num_sentences += 1
+
+    def result(self):
+        """ Return the binary encoding as a bytes object """
+        assert self._rec_start is None
+        self._ints[0] = self._num_sentences
+        strings = sorted(self._strings, key=self._strings.get)
+        stable = "\x00".join(strings).encode("utf-8")
+        ints = self._ints
+        width = 4
+        if _INT16_MIN <= min(ints) and max(ints) <= _INT16_MAX:
+            # All integers fit in 16 bits: use the narrower encoding
+            width = 2
+            ints = array(_TYPECODES[width], ints)
+        if _BIG_ENDIAN:
+            ints = array(_TYPECODES[width], ints)
+            ints.byteswap()
+        return b"".join(
+            (
+                MAGIC,
+                bytes((VERSION, width)),
+                _LEN_STRUCT.pack(len(stable)),
+                stable,
+                ints.tobytes(),
+            )
+        )
+
+
+def decode(data):
+    """ Decode a binary tree, returning a tuple (strings, ints) where
+        strings is the string table and ints is the integer array """
+    if not is_binary(data):
+        raise BinaryTreeError("Not a binary tree")
+    data = bytes(data)
+    version = data[len(MAGIC)]
+    if version != VERSION:
+        raise BinaryTreeError("Unsupported binary tree version {0}".format(version))
+    typecode = _TYPECODES.get(data[len(MAGIC) + 1])
+    if typecode is None:
+        raise BinaryTreeError("Invalid integer width in binary tree")
+    slen, = _LEN_STRUCT.unpack_from(data, _HEADER_LEN)
+    pos = _HEADER_LEN + _LEN_STRUCT.size
+    strings = data[pos : pos + slen].decode("utf-8").split("\x00")
+    ints = array(typecode)
+    ints.frombytes(data[pos + slen :])
+    if _BIG_ENDIAN:
+        ints.byteswap()
+    return strings, ints
@@ -16,14 +16,16 @@ with open(DIR + 'gunicorn_user.txt') as f:
 
 pidfile = DIR + 'gunicorn.pid'
 
-# Remove the Reynir.grammar.bin file to ensure that
-# the grammar will be reparsed and a fresh copy generated
-
-import os
-try:
-    os.remove (DIR + 'Reynir.grammar.bin')
-except OSError:
-    # File probably didn't exist
-    pass
+# Load the settings, the grammar and the BIN lexicon in the master process
+# before the workers are forked, so that the workers share their memory
+# pages instead of each loading a private copy (see preload.py).
+# The binary grammar is regenerated automatically if Reynir.grammar
+# is newer, so it is no longer deleted here.
+
+def on_starting(server):
+    import sys
+    sys.path.insert(0, DIR)
+    from preload import preload
+    preload(DIR + 'config/Reynir.conf')
 
 
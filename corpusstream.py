@@ -0,0 +1,268 @@
+"""
+
+    Reynir: Natural language processing for Icelandic
+
+    Corpus streaming module
+
+    Copyright (C) 2018 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+    This module implements a reader that streams the tokenized sentences
+    of parsed articles, most recently parsed first, for purposes such as
+    tagger training (see Article.sentence_stream() and utils/trainer.py).
+
+    The token blobs of the articles can be decoded in a pool of worker
+    processes, while the sentences are still delivered in order. Error
+    sentences are skipped using the flags of the compact token encoding,
+    without being decoded.
+
+    The position in the stream is kept as a checkpoint, consisting of the
+    parse timestamp and id of the current article and the index of the
+    next sentence within it. A stream can be resumed from a checkpoint,
+    which can also be saved to and loaded from a file.
+
+"""
+
+import json
+import time
+import logging
+from collections import deque, namedtuple
+from datetime import datetime
+from multiprocessing import Pool
+
+from scraperdb import SessionContext, Article as ArticleRow, desc, or_, tuple_
+import bintokens
+
+
+# Number of articles fetched from the database at a time
+_FETCH_SIZE = 200
+
+# Number of articles being decoded by each worker process at a time
+_PENDING_PER_PROCESS = 4
+
+_TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+
+# A position in the stream: the parse timestamp and id of an article,
+# and the index of the next sentence to be delivered from it
+Checkpoint = namedtuple("Checkpoint", ["parsed", "article_id", "sentence"])
+
+
+def load_checkpoint(fname):
+    """ Load a checkpoint from a file, returning None if the file doesn't exist """
+    try:
+        with open(fname, "r", encoding="utf-8") as f:
+            d = json.load(f)
+    except FileNotFoundError:
+        return None
+    return Checkpoint(
+        datetime.strptime(d["parsed"], _TIMESTAMP_FORMAT), d["article_id"], d["sentence"]
+    )
+
+
+def save_checkpoint(fname, checkpoint):
+    """ Save a checkpoint to a file """
+    with open(fname, "w", encoding="utf-8") as f:
+        json.dump(
+            dict(
+                parsed=checkpoint.parsed.strftime(_TIMESTAMP_FORMAT),
+                article_id=checkpoint.article_id,
+                sentence=checkpoint.sentence,
+            ),
+            f,
+        )
+
+
+def _decode(tokens_bin, tokens, skip_errors):
+    """ Decode the tokens of an article, returning a tuple of the number
+        of sentences and a list of (index, sentence) tuples for the
+        non-empty sentences, each sentence being a list of token dicts """
+    doc = bintokens.load(tokens_bin, tokens)
+    if doc is None:
+        return 0, []
+    return (
+        doc.num_sentences,
+        [
+            (ix, sent)
+            for ix, sent in doc.sentences(skip_errors=skip_errors)
+            if doc.sentence_length(ix)
+        ],
+    )
+
+
+def _decode_task(args):
+    """ Decode the tokens of an article in a worker process """
+    return _decode(*args)
+
+
+class CorpusStream:
+
+    """ A resumable stream of the sentences of parsed articles """
+
+    def __init__(
+        self,
+        processes=0,
+        skip_errors=True,
+        checkpoint=None,
+        checkpoint_file=None,
+        checkpoint_interval=1000,
+    ):
+        """ Create a stream, decoding tokens in a pool of the given number
+            of processes (or in the current process if 0), starting from
+            the given checkpoint or the one stored in checkpoint_file.
+            If checkpoint_file is given, the current position is saved to it
+            every checkpoint_interval articles and when the stream ends. """
+        self._processes = processes
+        self._skip_errors = skip_errors
+        self._checkpoint_file = checkpoint_file
+        self._checkpoint_interval = checkpoint_interval
+        if checkpoint is None and checkpoint_file:
+            checkpoint = load_checkpoint(checkpoint_file)
+        self._checkpoint = checkpoint
+        # Statistics
+        self.num_articles = 0
+        self.num_sentences = 0
+        self.elapsed = 0.0
+
+    @property
+    def checkpoint(self):
+        """ The current position in the stream, or None if at the start """
+        return self._checkpoint
+
+    def save_checkpoint(self):
+        """ Save the current position to the checkpoint file, if any """
+        if self._checkpoint_file and self._checkpoint is not None:
+            save_checkpoint(self._checkpoint_file, self._checkpoint)
+
+    @property
+    def sentences_per_second(self):
+        return self.num_sentences / self.elapsed if self.elapsed > 0.0 else 0.0
+
+    def throughput(self):
+        """ Return a description of the throughput of the stream so far """
+        return "{0} sentences from {1} articles in {2:.1f} seconds, {3:.0f} sentences/sec".format(
+            self.num_sentences, self.num_articles, self.elapsed, self.sentences_per_second
+        )
+
+    def _query(self, session):
+        """ Return a query for the articles in the stream, starting at the checkpoint """
+        q = session.query(
+            ArticleRow.id, ArticleRow.parsed, ArticleRow.tokens, ArticleRow.tokens_bin
+        ).filter(or_(ArticleRow.tokens_bin != None, ArticleRow.tokens != None))
+        cp = self._checkpoint
+        if cp is not None:
+            # Include the checkpoint article itself, since it may not be finished
+            q = q.filter(
+                tuple_(ArticleRow.parsed, ArticleRow.id) <= tuple_(cp.parsed, cp.article_id)
+            )
+        # The article id is a tie breaker, making the order well defined
+        return q.order_by(desc(ArticleRow.parsed), desc(ArticleRow.id)).yield_per(
+            _FETCH_SIZE
+        )
+
+    def _decoded(self, q):
+        """ Generator of (article id, parse timestamp, number of sentences,
+            sentence list) tuples, in the order of the query """
+        skip_errors = self._skip_errors
+        if self._processes <= 0:
+            for a in q:
+                yield (a.id, a.parsed) + _decode(a.tokens_bin, a.tokens, skip_errors)
+            return
+        pool = Pool(self._processes)
+        try:
+            # Keep a bounded number of articles in flight, and collect
+            # the results in the original order
+            pending = deque()
+            max_pending = self._processes * _PENDING_PER_PROCESS
+            for a in q:
+                pending.append(
+                    (
+                        a.id,
+                        a.parsed,
+                        pool.apply_async(
+                            _decode_task,
+                            (
+                                (
+                                    # The database driver may return a memoryview,
+                                    # which cannot be pickled
+                                    None if a.tokens_bin is None else bytes(a.tokens_bin),
+                                    a.tokens,
+                                    skip_errors,
+                                ),
+                            ),
+                        ),
+                    )
+                )
+                if len(pending) >= max_pending:
+                    article_id, parsed, r = pending.popleft()
+                    yield (article_id, parsed) + r.get()
+            while pending:
+                article_id, parsed, r = pending.popleft()
+                yield (article_id, parsed) + r.get()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def sentences(self, limit=None, skip=None):
+        """ Generator of up to limit sentences, each a list of token dicts,
+            optionally skipping the first skip sentences """
+        t0 = time.time()
+        elapsed = self.elapsed
+        count = 0
+        skipped = 0
+        cp = self._checkpoint
+        try:
+            with SessionContext(commit=True, read_only=True) as session:
+                for article_id, parsed, num_sentences, sents in self._decoded(
+                    self._query(session)
+                ):
+                    start = 0
+                    if cp is not None and article_id == cp.article_id:
+                        # Resume within the checkpoint article
+                        start = cp.sentence
+                    for ix, sent in sents:
+                        if ix < start:
+                            continue
+                        if skip is not None and skipped < skip:
+                            # If requested, skip sentences from the front
+                            # (useful for a test set)
+                            skipped += 1
+                            continue
+                        self._checkpoint = Checkpoint(parsed, article_id, ix + 1)
+                        count += 1
+                        self.num_sentences += 1
+                        yield sent
+                        # Are we done?
+                        if limit is not None and count >= limit:
+                            return
+                    # The article is finished
+                    self._checkpoint = Checkpoint(parsed, article_id, num_sentences)
+                    self.num_articles += 1
+                    self.elapsed = elapsed + time.time() - t0
+                    if self._checkpoint_file and (
+                        self.num_articles % self._checkpoint_interval == 0
+                    ):
+                        self.save_checkpoint()
+                        logging.info("Corpus stream: {0}".format(self.throughput()))
+        finally:
+            self.elapsed = elapsed + time.time() - t0
+            self.save_checkpoint()
+
+    def tokens(self, limit=None):
+        """ Generator of the tokens of up to limit sentences,
+            with None yielded after each sentence """
+        for sent in self.sentences(limit=limit):
+            yield from sent
+            yield None  # End-of-sentence marker
@@ -0,0 +1,176 @@
+"""
+
+    Reynir: Natural language processing for Icelandic
+
+    Near-duplicate detection module
+
+    Copyright (C) 2018 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+    This module detects near-duplicate articles, such as the same news
+    story appearing under several roots or republished under a new URL.
+
+    The text of each scraped article is summarized by a 64-bit SimHash
+    signature, computed from its three-word shingles. The signatures of
+    similar texts differ in few bits, so near-duplicates are found by
+    comparing the Hamming distance of the signatures to a threshold.
+
+    The signatures of recently scraped articles are kept in an index,
+    where the 64 bits are split into one more band than the maximum
+    distance. Two signatures within the maximum distance must agree
+    exactly on at least one band (by the pigeonhole principle), so only
+    the signatures that share a band with a new one need be compared.
+
+    The signatures are signed 64-bit integers, suitable for storing in
+    a bigint column (articles.simhash).
+
+"""
+
+import re
+import time
+import calendar
+import hashlib
+from datetime import datetime, timedelta
+from collections import deque, defaultdict
+
+from scraperdb import Article as ArticleRow
+
+
+# Number of bits in a signature
+_BITS = 64
+_MASK = (1 << _BITS) - 1
+
+# Number of words in a shingle
+_SHINGLE = 3
+
+# Texts with fewer words than this are not given a signature, since
+# short texts (captions, video pages) are too alike to be told apart
+_MIN_WORDS = 30
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def simhash(text):
+    """ Return the SimHash signature of a text as a signed 64-bit
+        integer, or None if the text is too short """
+    words = _WORD_RE.findall(text.lower())
+    if len(words) < _MIN_WORDS:
+        return None
+    counts = [0] * _BITS
+    for i in range(len(words) - _SHINGLE + 1):
+        shingle = " ".join(words[i : i + _SHINGLE])
+        h = int.from_bytes(
+            hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "little"
+        )
+        for bit in range(_BITS):
+            counts[bit] += 1 if (h >> bit) & 1 else -1
+    sig = 0
+    for bit, cnt in enumerate(counts):
+        if cnt > 0:
+            sig |= 1 << bit
+    # Convert to a signed integer
+    return sig - (1 << _BITS) if sig >> (_BITS - 1) else sig
+
+
+def distance(sig1, sig2):
+    """ Return the Hamming distance between two signatures """
+    return bin((sig1 ^ sig2) & _MASK).count("1")
+
+
+class SignatureIndex:
+
+    """ An index of the signatures of recently scraped articles, for
+        finding the near-duplicates of new ones """
+
+    def __init__(self, max_distance, max_age):
+        """ Create an index for finding signatures within max_distance bits,
+            keeping them for max_age seconds """
+        self._max_distance = max_distance
+        self._max_age = max_age
+        # Split the signature into max_distance + 1 bands, as (shift, mask)
+        bands = max_distance + 1
+        width = _BITS // bands
+        self._bands = [
+            (i * width, (1 << (width if i < bands - 1 else _BITS - i * width)) - 1)
+            for i in range(bands)
+        ]
+        # Entries by band index and band value
+        self._buckets = [defaultdict(list) for _ in self._bands]
+        # Entries in order of addition, for expiry
+        self._entries = deque()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @classmethod
+    def load(cls, session, max_distance, days):
+        """ Create an index of the signatures of the articles scraped
+            within the given number of days, except near-duplicates """
+        index = cls(max_distance, days * 24 * 3600)
+        cutoff = datetime.utcnow() - timedelta(days=days)
+        q = (
+            session
+            .query(ArticleRow.url, ArticleRow.simhash, ArticleRow.scraped)
+            .filter(ArticleRow.simhash != None)
+            .filter(ArticleRow.duplicate_of == None)
+            .filter(ArticleRow.scraped >= cutoff)
+            .order_by(ArticleRow.scraped)
+            .yield_per(1000)
+        )
+        for url, sig, scraped in q:
+            # The scrape timestamps are in UTC
+            index.add(sig, url, calendar.timegm(scraped.timetuple()))
+        return index
+
+    def _expire(self, now):
+        """ Remove the entries that are older than the maximum age """
+        cutoff = now - self._max_age
+        while self._entries and self._entries[0][0] < cutoff:
+            entry = self._entries.popleft()
+            sig = entry[1]
+            for (shift, mask), buckets in zip(self._bands, self._buckets):
+                key = (sig >> shift) & mask
+                bucket = buckets[key]
+                bucket.remove(entry)
+                if not bucket:
+                    del buckets[key]
+
+    def add(self, sig, url, timestamp=None):
+        """ Add the signature of an article to the index """
+        now = time.time()
+        entry = (now if timestamp is None else timestamp, sig & _MASK, url)
+        self._entries.append(entry)
+        for (shift, mask), buckets in zip(self._bands, self._buckets):
+            buckets[(entry[1] >> shift) & mask].append(entry)
+        self._expire(now)
+
+    def find(self, sig, exclude=None):
+        """ Return a tuple (url, distance) of the closest article within
+            the maximum distance of the given signature, other than the
+            one with the excluded URL, or None if there is none """
+        self._expire(time.time())
+        sig &= _MASK
+        best = None
+        seen = set()
+        for (shift, mask), buckets in zip(self._bands, self._buckets):
+            for entry in buckets.get((sig >> shift) & mask, ()):
+                url = entry[2]
+                if url == exclude or url in seen:
+                    continue
+                seen.add(url)
+                d = distance(sig, entry[1])
+                if d <= self._max_distance and (best is None or d < best[1]):
+                    best = (url, d)
+        return best
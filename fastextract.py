@@ -0,0 +1,137 @@
+"""
+
+    Reynir: Natural language processing for Icelandic
+
+    Fast content extraction module
+
+    Copyright (C) 2018 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+    This module finds the content of an article in its HTML using lxml,
+    which parses HTML in C, instead of building a BeautifulSoup tree with
+    the pure-Python html.parser and searching it with filter functions.
+
+    A scrape helper class opts in by declaring its content selectors as
+    class attributes:
+
+    * CONTENT_SELECTORS: a sequence of selectors that are tried in order,
+      the first element matched by any of them being the content of the
+      article. If none matches, the content is the body of the document.
+    * CONTENT_REMOVE: a sequence of selectors of elements to remove from
+      the content, such as images, captions and sharing widgets.
+
+    A selector is a CSS selector, such as "div.article-body" or
+    "main[role=main]", or an XPath expression relative to the document,
+    starting with "." or "/", such as ".//p[.//strong//a]". The selectors
+    of each helper class are compiled once.
+
+    The fast path is optional. If lxml (and cssselect) is not installed,
+    the helper declares no selectors, or the HTML can't be parsed, None
+    is returned and the caller falls back to the helper's soup-based
+    get_content(). The helper's get_metadata() always uses the soup.
+
+    The text of the content is extracted by Fetcher.extract_text_lxml(),
+    following the same rules as for a soup. The two paths can be compared
+    on stored articles with utils/extractbench.py.
+
+"""
+
+import logging
+
+try:
+    import lxml.html
+    from lxml import etree
+    from lxml.cssselect import CSSSelector
+
+    HAS_LXML = True
+except ImportError:
+    # lxml.cssselect raises ImportError if cssselect is not installed
+    HAS_LXML = False
+
+
+def compile_selector(selector):
+    """ Compile a CSS selector or XPath expression into a callable that
+        returns the list of matching elements under a given element """
+    if selector.startswith((".", "/", "(")):
+        return etree.XPath(selector)
+    return CSSSelector(selector)
+
+
+class FastExtractor:
+
+    """ Finds the content of articles of a scrape helper class with
+        precompiled selectors """
+
+    # Extractors by helper class, or None for classes without selectors
+    _extractors = dict()
+
+    def __init__(self, content_selectors, remove_selectors=()):
+        self._content = [compile_selector(s) for s in content_selectors]
+        self._remove = [compile_selector(s) for s in remove_selectors]
+
+    @classmethod
+    def for_helper(cls, helper):
+        """ Return the extractor for a scrape helper, or None if the fast
+            path is not available for it """
+        if not HAS_LXML or helper is None:
+            return None
+        helper_class = helper.__class__
+        if helper_class in cls._extractors:
+            return cls._extractors[helper_class]
+        extractor = None
+        selectors = getattr(helper_class, "CONTENT_SELECTORS", None)
+        if selectors:
+            try:
+                extractor = cls(
+                    selectors, getattr(helper_class, "CONTENT_REMOVE", ())
+                )
+            except Exception as e:
+                logging.warning(
+                    "Invalid content selectors in {0}: {1!r}"
+                    .format(helper_class.__name__, e)
+                )
+        cls._extractors[helper_class] = extractor
+        return extractor
+
+    @staticmethod
+    def parse(html):
+        """ Parse an HTML document, returning its root element or None """
+        try:
+            return lxml.html.document_fromstring(html)
+        except (etree.ParserError, ValueError):
+            # Empty document, or a string with an encoding declaration
+            return None
+
+    def content(self, html):
+        """ Return the content element of an HTML document, with the
+            unwanted elements removed, or None if there is none """
+        doc = self.parse(html) if html else None
+        if doc is None:
+            return None
+        content = None
+        for selector in self._content:
+            found = selector(doc)
+            if found:
+                content = found[0]
+                break
+        if content is None:
+            # Return the entire body, as ScrapeHelper.get_content() does
+            return doc.find("body")
+        for selector in self._remove:
+            for element in selector(content):
+                if element is not content:
+                    # Keeps the text that follows the element (its tail)
+                    element.drop_tree()
+        return content
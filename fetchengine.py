@@ -0,0 +1,341 @@
+"""
+
+    Reynir: Natural language processing for Icelandic
+
+    Fetch engine module
+
+    Copyright (C) 2018 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+    This module implements a concurrent HTTP fetch engine for the scraper.
+    Instead of forking a pool of processes that mostly wait on sockets,
+    the scraper hands a stream of URLs to the engine and receives the
+    fetched documents, in order of completion, for storage.
+
+    The engine is driven by an asyncio event loop, which runs in a
+    background thread and schedules the requests subject to:
+
+    * a limit on the total number of concurrent requests;
+    * a limit on the number of concurrent requests per domain, so that
+      no single site is hammered;
+    * a minimum delay between the starts of consecutive requests to
+      the same domain (politeness);
+    * a timeout on connecting to and reading from each server;
+    * retries with exponential backoff upon connection errors, timeouts
+      and server-side (5xx, 429) HTTP errors.
+
+    Requests can carry additional headers, such as the If-None-Match and
+    If-Modified-Since headers of a conditional GET. A 304 Not Modified
+    response is reported with a status of 304 and no document, and the
+    validators (ETag and Last-Modified) of each response are returned.
+
+    The requests themselves are made in a thread pool, through a shared
+    requests session that keeps a pool of reusable connections per host.
+    The number of documents that have been fetched but not yet consumed
+    is bounded, so a slow consumer throttles the fetching.
+
+    The engine doesn't depend on the database and can be pointed at any
+    HTTP server, such as the local stub server in test/test_fetchengine.py.
+
+"""
+
+import time
+import queue
+import random
+import asyncio
+import logging
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import urllib.parse as urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from settings import Settings
+
+
+# The result of fetching a URL: the url and data of the submitted item,
+# the document as a string (or None if the fetch failed or the document
+# was not modified), the final HTTP status code (or None), an error
+# description (or None), the number of attempts made, and a dict of the
+# validators of the response (with keys etag and last_modified, if present)
+FetchResult = namedtuple(
+    "FetchResult",
+    ["url", "data", "html", "status", "error", "attempts", "validators"],
+)
+
+# HTTP status code of a response to a conditional GET for an unchanged document
+NOT_MODIFIED = 304
+
+# HTTP status codes that indicate a transient failure, worth retrying
+_RETRY_STATUS = frozenset((429, 500, 502, 503, 504))
+
+# Maximum number of per-host connection pools kept by the requests session
+_MAX_HOST_POOLS = 100
+
+
+def domain_of(url):
+    """ Return the domain that a URL belongs to for purposes of
+        concurrency limits, i.e. www.ruv.is -> ruv.is """
+    netloc = urlparse.urlsplit(url).netloc.lower()
+    # Remove the port, if any
+    netloc = netloc.rsplit(":", maxsplit=1)[0] if ":" in netloc else netloc
+    if netloc.replace(".", "").isdigit():
+        # IP address
+        return netloc
+    return ".".join(netloc.split(".")[-2:])
+
+
+class _Retry(Exception):
+
+    """ A transient fetch failure, which may be retried """
+
+    def __init__(self, error, status=None):
+        super().__init__(error)
+        self.error = error
+        self.status = status
+
+
+class FetchEngine:
+
+    """ Fetches documents concurrently, within per-domain limits """
+
+    def __init__(
+        self,
+        connections=None,
+        domain_connections=None,
+        timeout=None,
+        retries=None,
+        backoff=None,
+        domain_delay=None,
+    ):
+        self._connections = connections or Settings.FETCH_CONNECTIONS
+        self._domain_connections = (
+            domain_connections or Settings.FETCH_DOMAIN_CONNECTIONS
+        )
+        self._timeout = Settings.FETCH_TIMEOUT if timeout is None else timeout
+        self._retries = Settings.FETCH_RETRIES if retries is None else retries
+        self._backoff = Settings.FETCH_BACKOFF if backoff is None else backoff
+        self._domain_delay = (
+            Settings.FETCH_DOMAIN_DELAY if domain_delay is None else domain_delay
+        )
+        self._session = requests.Session()
+        # Let the engine, rather than the adapter, do the retrying
+        adapter = HTTPAdapter(
+            pool_connections=_MAX_HOST_POOLS,
+            pool_maxsize=self._domain_connections,
+            max_retries=0,
+        )
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        # Statistics
+        self.fetched = 0
+        self.not_modified = 0
+        self.failed = 0
+        self.retried = 0
+        self.delayed = 0
+        self.bytes = 0
+        self.elapsed = 0.0
+
+    def _get(self, url, headers):
+        """ Fetch a URL over HTTP, in a thread of the pool. Returns
+            a tuple (html, status, validators) or raises _Retry. """
+        try:
+            r = self._session.get(url, headers=headers, timeout=self._timeout)
+        except requests.exceptions.Timeout as e:
+            raise _Retry("Timeout: {0}".format(e))
+        except (
+            requests.exceptions.ConnectionError,
+            requests.exceptions.ChunkedEncodingError,
+        ) as e:
+            raise _Retry("{0}: {1}".format(type(e).__name__, e))
+        if r.status_code in _RETRY_STATUS:
+            raise _Retry("HTTP status {0}".format(r.status_code), r.status_code)
+        validators = dict()
+        if "ETag" in r.headers:
+            validators["etag"] = r.headers["ETag"]
+        if "Last-Modified" in r.headers:
+            validators["last_modified"] = r.headers["Last-Modified"]
+        if r.status_code != requests.codes.ok:
+            return None, r.status_code, validators
+        return r.text, r.status_code, validators
+
+    def _call(self, url, fetch, headers):
+        """ Fetch a URL, either over HTTP or with a custom fetch function
+            (such as a scrape helper's fetch_url method) """
+        if fetch is None:
+            return self._get(url, headers)
+        html = fetch(url)
+        return html, None, dict()
+
+    async def _wait_turn(self, loop, starts, domain):
+        """ Wait until a request to the domain may be started, at least
+            the politeness delay after the previous one """
+        if self._domain_delay <= 0.0:
+            return
+        now = loop.time()
+        start = max(now, starts.get(domain, now))
+        # Reserve the start time before waiting, so that concurrent
+        # requests to the same domain are spaced out in turn
+        starts[domain] = start + self._domain_delay
+        if start > now:
+            self.delayed += 1
+            await asyncio.sleep(start - now)
+
+    async def _fetch(self, loop, executor, semaphores, starts, url, data, fetch, headers):
+        """ Fetch a single URL with retries, returning a FetchResult """
+        domain = domain_of(url)
+        semaphore = semaphores.get(domain)
+        if semaphore is None:
+            semaphore = semaphores[domain] = asyncio.Semaphore(
+                self._domain_connections
+            )
+        attempts = 0
+        while True:
+            attempts += 1
+            try:
+                async with semaphore:
+                    await self._wait_turn(loop, starts, domain)
+                    html, status, validators = await loop.run_in_executor(
+                        executor, self._call, url, fetch, headers
+                    )
+                if html:
+                    self.fetched += 1
+                    self.bytes += len(html)
+                    return FetchResult(
+                        url, data, html, status, None, attempts, validators
+                    )
+                if status == NOT_MODIFIED:
+                    self.not_modified += 1
+                    return FetchResult(
+                        url, data, None, status, None, attempts, validators
+                    )
+                self.failed += 1
+                error = "No document returned"
+                if status is not None:
+                    error = "HTTP status {0}".format(status)
+                return FetchResult(url, data, None, status, error, attempts, validators)
+            except _Retry as e:
+                if attempts > self._retries:
+                    self.failed += 1
+                    return FetchResult(
+                        url, data, None, e.status, e.error, attempts, dict()
+                    )
+                self.retried += 1
+                # Exponential backoff, with jitter to spread out the retries
+                delay = self._backoff * (2 ** (attempts - 1))
+                await asyncio.sleep(delay * (0.5 + random.random()))
+            except Exception as e:
+                # Unicode errors and the like: not worth retrying
+                self.failed += 1
+                return FetchResult(url, data, None, None, repr(e), attempts, dict())
+
+    async def _run(self, items, results, state):
+        """ Fetch all items, putting the results into the results queue """
+        loop = asyncio.get_event_loop()
+        # Bound the number of documents being fetched or waiting for the
+        # consumer to twice the number of concurrent connections. A slot
+        # is released when the consumer has taken a result.
+        slots = state["slots"] = asyncio.Semaphore(2 * self._connections)
+        state["task"] = asyncio.current_task()
+        semaphores = dict()
+        # The earliest start time of the next request to each domain
+        starts = dict()
+        tasks = set()
+        with ThreadPoolExecutor(max_workers=self._connections) as executor:
+
+            async def fetch_one(url, data, fetch, headers):
+                try:
+                    r = await self._fetch(
+                        loop, executor, semaphores, starts, url, data, fetch, headers
+                    )
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    r = FetchResult(url, data, None, None, repr(e), 0, dict())
+                results.put(r)
+
+            try:
+                for url, data, fetch, headers in items:
+                    await slots.acquire()
+                    task = loop.create_task(fetch_one(url, data, fetch, headers))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                if tasks:
+                    await asyncio.wait(tasks)
+            except asyncio.CancelledError:
+                # The consumer has gone away
+                for task in tasks:
+                    task.cancel()
+
+    def fetch_all(self, items):
+        """ Fetch the given items, each a tuple (url, data, fetch, headers),
+            where fetch is None for a plain HTTP fetch or a function taking
+            the url and returning a document, and headers is None or a dict
+            of additional request headers for an HTTP fetch. Returns a
+            generator of FetchResult tuples, in order of completion.
+            The items are iterated in a background thread. """
+        results = queue.Queue()
+        done = object()
+        loop = asyncio.new_event_loop()
+        state = dict()
+
+        def run():
+            try:
+                asyncio.set_event_loop(loop)
+                loop.run_until_complete(self._run(items, results, state))
+            except Exception as e:
+                logging.warning("Exception in fetch engine: {0!r}".format(e))
+            finally:
+                results.put(done)
+
+        t0 = time.time()
+        thread = threading.Thread(target=run, name="FetchEngine", daemon=True)
+        thread.start()
+        finished = False
+        try:
+            while True:
+                r = results.get()
+                if r is done:
+                    finished = True
+                    break
+                loop.call_soon_threadsafe(state["slots"].release)
+                yield r
+        finally:
+            if not finished:
+                # Stopped early: cancel the fetches that are still under way
+                task = state.get("task")
+                if task is not None:
+                    loop.call_soon_threadsafe(task.cancel)
+            thread.join()
+            loop.close()
+            self.elapsed += time.time() - t0
+
+    def close(self):
+        """ Close the connections of the engine """
+        self._session.close()
+
+    def stats(self):
+        """ Return a dict of this engine's statistics """
+        return dict(
+            fetched=self.fetched,
+            not_modified=self.not_modified,
+            failed=self.failed,
+            retried=self.retried,
+            delayed=self.delayed,
+            bytes=self.bytes,
+            elapsed=self.elapsed,
+        )
@@ -23,6 +23,7 @@
 """
 
 import re
+import logging
 import importlib
 
 import requests
@@ -31,8 +32,11 @@ from urllib.error import HTTPError
 
 from bs4 import BeautifulSoup, NavigableString
 
+from settings import Settings
+from fastextract import FastExtractor
 from nertokenizer import tokenize_and_recognize
 from scraperdb import SessionContext, Root, Article as ArticleRow
+from htmlstore import row_html
 
 
 # The HTML parser to use with BeautifulSoup
@@ -185,13 +189,68 @@ class Fetcher:
                 Fetcher.extract_text(t, result)
 
     @staticmethod
-    def to_tokens(soup, enclosing_session=None):
-        """ Convert an HTML soup root into a parsable token stream """
+    def extract_text_lxml(element, result):
+        """ Append the human-readable text found under an lxml element to
+            the result TextList, by the same rules as extract_text() """
+        if element is None:
+            return
+        if element.text:
+            result.append(element.text)
+        for t in element:
+            name = t.tag
+            if not isinstance(name, str):
+                # Comment or processing instruction: ignore
+                pass
+            elif name in Fetcher._BREAK_TAGS:
+                result.insert_break()
+            elif name in Fetcher._WHITESPACE_TAGS:
+                result.append_whitespace()
+            elif name in Fetcher._BLOCK_TAGS:
+                result.begin()
+                Fetcher.extract_text_lxml(t, result)
+                result.end()
+            elif name in Fetcher._INLINE_BLOCK_TAGS:
+                result.append_whitespace()
+                Fetcher.extract_text_lxml(t, result)
+                result.append_whitespace()
+            elif name not in Fetcher._EXCLUDE_TAGS:
+                Fetcher.extract_text_lxml(t, result)
+            # The text following an element belongs to its parent
+            if t.tail:
+                result.append(t.tail)
+
+    @staticmethod
+    def fast_content_text(html, helper):
+        """ Return the text content of an article's HTML, with paragraph
+            markers, as found by lxml with the helper's content selectors,
+            or None if the fast path is not available for the helper """
+        extractor = FastExtractor.for_helper(helper)
+        if extractor is None:
+            return None
+        try:
+            content = extractor.content(html)
+        except Exception as e:
+            logging.warning("Exception in fast content extraction: {0!r}".format(e))
+            return None
+        if content is None:
+            return None
+        tlist = Fetcher.TextList()
+        Fetcher.extract_text_lxml(content, tlist)
+        return tlist.result()
 
-        # Extract the text content of the HTML into a list
+    @staticmethod
+    def content_text(soup):
+        """ Return the text content of an HTML soup root, with paragraph markers """
         tlist = Fetcher.TextList()
         Fetcher.extract_text(soup, tlist)
-        text = tlist.result()
+        return tlist.result()
+
+    @staticmethod
+    def to_tokens(soup, enclosing_session=None):
+        """ Convert an HTML soup root into a parsable token stream """
+
+        # Extract the text content of the HTML
+        text = Fetcher.content_text(soup)
 
         # Tokenize the resulting text, returning a generator
         return tokenize_and_recognize(text, enclosing_session=enclosing_session)
@@ -203,7 +262,7 @@ class Fetcher:
         try:
 
             # Normal external HTTP/HTTPS fetch
-            r = requests.get(url)
+            r = requests.get(url, timeout=Settings.FETCH_TIMEOUT)
             if r is None:
                 print("No document returned for URL {0}".format(url))
                 return None
@@ -215,6 +274,9 @@ class Fetcher:
         except requests.exceptions.ConnectionError as e:
             print("ConnectionError: {0} for URL {1}".format(e, url))
             html_doc = None
+        except requests.exceptions.Timeout as e:
+            print("Timeout: {0} for URL {1}".format(e, url))
+            html_doc = None
         except requests.exceptions.ChunkedEncodingError as e:
             print("ChunkedEncodingError: {0} for URL {1}".format(e, url))
             html_doc = None
@@ -264,22 +326,51 @@ class Fetcher:
             soup = helper.make_soup(doc) if doc else None
         return soup
 
+    @staticmethod
+    def lxml_extracts(helper):
+        """ Return True if the text content of articles is extracted by lxml,
+            instead of from a soup, for the given scrape helper """
+        return Settings.LXML_EXTRACT and FastExtractor.for_helper(helper) is not None
+
+    @staticmethod
+    def helper_key(helper):
+        """ Return a string identifying the scrape helper, and the version
+            of it, that extracts the text content of an article, along
+            with the extraction path, since the two paths may produce
+            slightly different text """
+        if helper is None:
+            return ""
+        key = "{0}.{1}/{2}".format(
+            helper.scr_module, helper.scr_class, helper.scr_version
+        )
+        return key + "/lxml" if Fetcher.lxml_extracts(helper) else key
+
+    @staticmethod
+    def html_text(html, helper):
+        """ Return the text content of an article's HTML, with paragraph
+            markers, or None if no content is found """
+        if html and Fetcher.lxml_extracts(helper):
+            text = Fetcher.fast_content_text(html, helper)
+            if text is not None:
+                return text
+        soup = Fetcher.make_soup(html, helper)
+        if soup is None:
+            content = None
+        elif helper is None:
+            content = soup.html.body
+        else:
+            content = helper.get_content(soup)
+        return Fetcher.content_text(content) if content else None
+
     @classmethod
     def tokenize_html(cls, url, html, enclosing_session=None):
         """ Convert HTML into a token iterable (generator) """
         with SessionContext(enclosing_session) as session:
             helper = cls.helper_for(session, url)
-            soup = Fetcher.make_soup(html, helper)
-            if soup is None:
-                content = None
-            elif helper is None:
-                content = soup.html.body
-            else:
-                content = helper.get_content(soup)
-            # Convert the content soup to a token iterable (generator)
+            text = Fetcher.html_text(html, helper)
             return (
-                Fetcher.to_tokens(content, enclosing_session=session)
-                if content
+                tokenize_and_recognize(text, enclosing_session=session)
+                if text is not None
                 else None
             )
 
@@ -385,7 +476,7 @@ class Fetcher:
             if article is None:
                 return (None, None, None)
 
-            html_doc = article.html
+            html_doc = row_html(session, article)
             if not html_doc:
                 return (None, None, None)
 
@@ -432,15 +523,21 @@ class Fetcher:
             return (metadata, content)
 
     @classmethod
-    def fetch_url_html(cls, url, enclosing_session=None):
+    def fetch_url_html(cls, url, enclosing_session=None, html_doc=None, with_text=False):
         """ Fetch a URL using the scraping mechanism, returning
-            a tuple (html, metadata, helper) or None if error """
+            a tuple (html, metadata, helper, text), with None values if error.
+            If html_doc is given, it has already been fetched
+            (see fetchengine.py). The text content of the article
+            is only extracted if with_text is True. """
 
         with SessionContext(enclosing_session) as session:
 
             helper = cls.helper_for(session, url)
 
-            if helper is None or not hasattr(helper, "fetch_url"):
+            if html_doc is not None:
+                # Already fetched
+                pass
+            elif helper is None or not hasattr(helper, "fetch_url"):
                 # Do a straight HTTP fetch
                 html_doc = cls.raw_fetch_url(url)
             else:
@@ -448,14 +545,24 @@ class Fetcher:
                 html_doc = helper.fetch_url(url)
 
             if not html_doc:
-                return (None, None, None)
+                return (None, None, None, None)
 
             # Parse the HTML
             soup = Fetcher.make_soup(html_doc, helper)
             if soup is None:
                 print("Fetcher.fetch_url_html({0}): No soup".format(url))
-                return (None, None, None)
+                return (None, None, None, None)
 
             # Obtain the metadata from the resulting soup
             metadata = helper.get_metadata(soup) if helper else None
-            return (html_doc, metadata, helper)
+            text = None
+            if with_text and Fetcher.lxml_extracts(helper):
+                # Obtain the text content in the same way as Fetcher.html_text(),
+                # so that it matches the text key of the helper
+                text = Fetcher.fast_content_text(html_doc, helper)
+            if with_text and text is None:
+                # Obtain the text content, after the metadata,
+                # since the helper may modify the soup
+                content = helper.get_content(soup) if helper else soup.html.body
+                text = Fetcher.content_text(content) if content else ""
+            return (html_doc, metadata, helper, text)
@@ -0,0 +1,134 @@
+"""
+
+    Reynir: Natural language processing for Icelandic
+
+    Crawl frontier module
+
+    Copyright (C) 2018 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+    This module decides which roots the scraper polls on each run, and
+    learns how often each root should be polled.
+
+    For each root, the frontier keeps an estimate of the rate at which new
+    articles appear on it (new child URLs per hour), as an exponentially
+    weighted moving average of the rates observed between polls. The
+    interval until the next poll of a root is the time in which a target
+    number of new articles is expected, within configured bounds and at
+    most doubling from one poll to the next. A root that changes rarely
+    is thus polled less and less often, while a busy one is polled as
+    often as allowed.
+
+    A root is due when its next poll time has come (or nearly so, since
+    the scraper runs periodically). Roots that have never been polled
+    are always due. The state is kept in the roots table: the time of the
+    last poll (scraped), the estimated rate (new_rate), the current
+    interval in seconds (poll_interval) and the next poll time (next_poll).
+
+    Per-domain politeness delays between requests are enforced by the
+    fetch engine (see fetchengine.py).
+
+"""
+
+import logging
+from datetime import datetime, timedelta
+
+from settings import Settings
+from scraperdb import SessionContext, Root
+
+
+# Weight of the most recently observed rate in the moving average
+_ALPHA = 0.3
+
+# A root is considered due if its next poll time is within this
+# fraction of its poll interval from now
+_SLACK = 0.1
+
+# Shortest time between polls that is used to compute a rate, in hours
+_MIN_HOURS = 1.0 / 60.0
+
+
+class Frontier:
+
+    """ Schedules the polling of roots, adapting to how often they publish """
+
+    def __init__(self, min_interval=None, max_interval=None, target=None):
+        """ Create a frontier whose poll intervals are between min_interval
+            and max_interval seconds, aiming for target new articles per poll """
+        self._min_interval = min_interval or Settings.FRONTIER_MIN_INTERVAL
+        self._max_interval = max(
+            self._min_interval, max_interval or Settings.FRONTIER_MAX_INTERVAL
+        )
+        self._target = target or Settings.FRONTIER_TARGET
+        # Statistics
+        self.due_roots = 0
+        self.skipped_roots = 0
+
+    def _clamp(self, interval):
+        return max(self._min_interval, min(self._max_interval, interval))
+
+    def due(self, roots, now=None):
+        """ Return the roots that are due to be polled, in order of
+            their next poll time """
+        now = now or datetime.utcnow()
+        due = []
+        for r in roots:
+            if r.next_poll is not None:
+                slack = timedelta(seconds=_SLACK * (r.poll_interval or 0.0))
+                if r.next_poll > now + slack:
+                    self.skipped_roots += 1
+                    continue
+            due.append(r)
+        self.due_roots += len(due)
+        due.sort(key=lambda r: r.next_poll or datetime.min)
+        return due
+
+    def schedule(self, root, new_urls, now=None):
+        """ Return a dict of the new frontier state of a root that has been
+            polled, finding new_urls new child URLs (0 if the root page was
+            not modified, None if it could not be fetched) """
+        now = now or datetime.utcnow()
+        rate = root.new_rate
+        interval = root.poll_interval or self._min_interval
+        if new_urls is not None and root.scraped is not None:
+            # Update the rate estimate from the time since the last poll.
+            # The first poll of a root is not used, since all of the
+            # children of the root page are new.
+            hours = max(_MIN_HOURS, (now - root.scraped).total_seconds() / 3600.0)
+            observed = new_urls / hours
+            rate = observed if rate is None else _ALPHA * observed + (1 - _ALPHA) * rate
+            if rate > 0.0:
+                interval = min(self._target / rate * 3600.0, 2 * interval)
+            else:
+                interval = 2 * interval
+        interval = self._clamp(interval)
+        return dict(
+            scraped=now if new_urls is not None else root.scraped,
+            new_rate=rate,
+            poll_interval=interval,
+            next_poll=now + timedelta(seconds=interval),
+        )
+
+    def record(self, root, new_urls, now=None):
+        """ Store the new frontier state of a root that has been polled """
+        state = self.schedule(root, new_urls, now)
+        with SessionContext(commit=True) as session:
+            session.query(Root).filter(Root.id == root.id).update(
+                state, synchronize_session=False
+            )
+        logging.info(
+            "Root {0}: {1:.2f} new articles per hour, next poll in {2:.1f} hours"
+            .format(root.url, state["new_rate"] or 0.0, state["poll_interval"] / 3600.0)
+        )
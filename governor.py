@@ -0,0 +1,221 @@
+"""
+
+    Reynir: Natural language processing for Icelandic
+
+    Sentence parse governor module
+
+    Copyright (C) 2018 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+    This module implements a resource governor for sentence parsing.
+    Instead of refusing to parse sentences above a fixed number of tokens,
+    each sentence is parsed in a worker process that is forked from the
+    current process, and thus shares its already loaded parser and grammar.
+    The worker is subject to a wall-clock time budget per sentence and
+    to a memory budget (an address space limit). If a sentence exceeds
+    either budget, or the worker dies, the parse of the sentence is
+    abandoned and the worker is replaced by a fresh one when needed.
+    The reason for abandoning the sentence ('timeout', 'memory', 'crash'
+    or 'error') is recorded in its error entry in the stored tree.
+
+    The worker is created with os.fork() rather than multiprocessing.Process,
+    since the latter cannot be used within (daemonic) pool worker processes.
+    Each thread of the calling process has its own worker.
+
+"""
+
+import os
+import signal
+import logging
+import resource
+import threading
+import traceback
+from multiprocessing import Pipe
+
+from settings import Settings
+from incparser import IncrementalParser, SentenceAbandoned
+
+
+def _limit_memory(budget):
+    """ Limit the address space of the current process to its
+        current size plus the given budget in megabytes """
+    if not budget:
+        return
+    try:
+        with open("/proc/self/statm") as f:
+            size = int(f.read().split()[0]) * resource.getpagesize()
+    except (OSError, ValueError, IndexError):
+        # Unable to determine the current size: don't impose a limit
+        return
+    limit = size + budget * 1024 * 1024
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
+
+def _worker(conn, parser, memory_budget):
+    """ The main loop of a parse worker process: receive sentence token
+        lists, parse them and send back ParsedSentence results """
+    _limit_memory(memory_budget)
+    ip = IncrementalParser(parser, [])
+    while True:
+        try:
+            tokens = conn.recv()
+        except (EOFError, OSError):
+            # The governor has gone away
+            break
+        if tokens is None:
+            break
+        try:
+            sent = IncrementalParser._IncrementalSentence(ip, tokens)
+            sent.parse()
+            reply = ("ok", sent.dump())
+        except MemoryError:
+            reply = ("abandoned", "memory")
+        except Exception:
+            reply = ("error", traceback.format_exc())
+        try:
+            conn.send(reply)
+        except MemoryError:
+            reply = ("abandoned", "memory")
+        if reply[0] == "abandoned":
+            # Start afresh rather than continue with a fragmented heap
+            break
+
+
+class _WorkerHandle:
+
+    """ A parse worker process, as seen from the governor """
+
+    def __init__(self, parser, memory_budget):
+        self.owner = os.getpid()
+        conn, child_conn = Pipe()
+        pid = os.fork()
+        if pid == 0:
+            # In the worker process
+            conn.close()
+            try:
+                _worker(child_conn, parser, memory_budget)
+            finally:
+                # Don't run any exit handlers inherited from the parent
+                os._exit(0)
+        child_conn.close()
+        self.pid = pid
+        self.conn = conn
+
+    def exit_signal(self):
+        """ Wait for the worker process to exit, returning the number
+            of the signal that terminated it, or None """
+        try:
+            _, status = os.waitpid(self.pid, 0)
+        except OSError:
+            return None
+        return os.WTERMSIG(status) if os.WIFSIGNALED(status) else None
+
+    def kill(self):
+        """ Kill the worker process and reap it """
+        try:
+            self.conn.close()
+        except OSError:
+            pass
+        try:
+            os.kill(self.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        try:
+            os.waitpid(self.pid, 0)
+        except OSError:
+            pass
+
+    def close(self):
+        """ Ask the worker process to exit, killing it if it doesn't """
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.kill()
+
+
+class ParseGovernor:
+
+    """ Parses sentences in worker processes, within a time and memory budget.
+        Usable as the governor parameter of IncrementalParser. """
+
+    def __init__(self, parser, time_budget=None, memory_budget=None):
+        self._parser = parser
+        self._time_budget = (
+            Settings.PARSE_TIME_BUDGET if time_budget is None else time_budget
+        )
+        self._memory_budget = (
+            Settings.PARSE_MEMORY_BUDGET if memory_budget is None else memory_budget
+        )
+        self._local = threading.local()
+        # Statistics
+        self.parsed = 0
+        self.abandoned = 0
+
+    def _worker(self):
+        """ Return the worker of the current thread, starting it if required """
+        w = getattr(self._local, "worker", None)
+        if w is not None and w.owner != os.getpid():
+            # Inherited from a parent process by fork(): not ours to use
+            w = None
+        if w is None:
+            w = self._local.worker = _WorkerHandle(self._parser, self._memory_budget)
+        return w
+
+    def _abandon(self, reason):
+        """ Discard the current worker and abandon the sentence """
+        self._local.worker.kill()
+        self._local.worker = None
+        self.abandoned += 1
+        raise SentenceAbandoned(reason)
+
+    def parse(self, tokens):
+        """ Parse a sentence, given as a list of tokens, returning a
+            ParsedSentence or raising SentenceAbandoned """
+        w = self._worker()
+        try:
+            w.conn.send(tokens)
+            if not w.conn.poll(self._time_budget):
+                self._abandon("timeout")
+            kind, payload = w.conn.recv()
+        except (EOFError, OSError):
+            # The worker died. If it was aborted while subject to a memory
+            # limit, it most likely failed to allocate memory within the
+            # C++ parser (std::bad_alloc).
+            sig = w.exit_signal()
+            if sig == signal.SIGABRT and self._memory_budget:
+                self._abandon("memory")
+            self._abandon("crash")
+        if kind == "ok":
+            self.parsed += 1
+            return payload
+        if kind == "error":
+            logging.warning("Sentence parse failed in worker:\n{0}".format(payload))
+            payload = "error"
+        self._abandon(payload)
+
+    def close(self):
+        """ Stop the worker of the current thread, if any """
+        w = getattr(self._local, "worker", None)
+        if w is not None and w.owner == os.getpid():
+            w.close()
+        self._local.worker = None
+
+    def stats(self):
+        """ Return a dict of this governor's statistics """
+        return dict(parsed=self.parsed, abandoned=self.abandoned)
@@ -0,0 +1,158 @@
+"""
+
+    Reynir: Natural language processing for Icelandic
+
+    Grammar difference module
+
+    Copyright (C) 2018 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+    This module finds the differences between two versions of the
+    grammar, to support incremental reparsing of articles, i.e. reparsing
+    only the sentences that may be affected by a grammar change.
+
+    Each grammar version that is used for parsing is recorded in the
+    grammars table, along with a digest of the productions (and score)
+    of each nonterminal. When comparing an older version to the current
+    one, the nonterminals whose digests differ are considered touched,
+    as are the terminals occurring in the current productions of those
+    nonterminals. A stored sentence tree is affected by the change if it
+    contains a touched nonterminal or terminal.
+
+    Note that this is a heuristic: a sentence that parsed successfully,
+    and whose tree does not contain any touched symbol, keeps its tree
+    even if the changed grammar could now yield a better scoring one.
+    A full reparse is still required if the parser code itself changes.
+
+"""
+
+import hashlib
+from datetime import datetime
+
+from reynir.grammar import Nonterminal
+
+from scraperdb import GrammarVersion
+
+
+def grammar_digests(grammar):
+    """ Return a dict of nonterminal names and digests of their productions """
+    digests = {}
+    for nt, plist in grammar.nt_dict.items():
+        h = hashlib.sha1(str(grammar.nt_score(nt)).encode("utf-8"))
+        for prio, prod in plist:
+            h.update("|{0}:{1}".format(prio, prod).encode("utf-8"))
+        # A 64-bit digest is plenty for this purpose
+        digests[nt.name] = h.hexdigest()[0:16]
+    return digests
+
+
+def _code_version(version):
+    """ Return the part of a parser version string that identifies
+        the parser code, i.e. everything except the grammar timestamp """
+    return version.split("/", maxsplit=1)[-1]
+
+
+def record_grammar(session, parser):
+    """ Record the grammar version currently in use by the parser,
+        if it is not already in the grammars table """
+    version = parser.version
+    if session.query(GrammarVersion.version).filter(
+        GrammarVersion.version == version
+    ).one_or_none() is None:
+        session.add(
+            GrammarVersion(
+                version=version,
+                timestamp=datetime.utcnow(),
+                digests=grammar_digests(parser.grammar),
+            )
+        )
+
+
+class GrammarDiff:
+
+    """ The difference between an older grammar version and the current one """
+
+    # Cache of diffs, by old and new version
+    _diffs = dict()
+
+    def __init__(self, old_digests, grammar):
+        new_digests = grammar_digests(grammar)
+        self._nonterminals = set(
+            name
+            for name in set(old_digests) | set(new_digests)
+            if old_digests.get(name) != new_digests.get(name)
+        )
+        self._terminals = set()
+        for nt, plist in grammar.nt_dict.items():
+            if nt.name in self._nonterminals:
+                for _, prod in plist:
+                    for sym in prod:
+                        if not isinstance(sym, Nonterminal):
+                            self._terminals.add(sym.name)
+
+    @classmethod
+    def load(cls, session, old_version, parser):
+        """ Return a GrammarDiff between the given older version and the
+            parser's current version, or None if the difference cannot be
+            determined and a full reparse is required """
+        if not old_version:
+            return None
+        new_version = parser.version
+        if _code_version(old_version) != _code_version(new_version):
+            # The parser code has changed: everything may be affected
+            return None
+        key = (old_version, new_version)
+        if key not in cls._diffs:
+            row = (
+                session.query(GrammarVersion.digests)
+                .filter(GrammarVersion.version == old_version)
+                .one_or_none()
+            )
+            cls._diffs[key] = (
+                None if row is None else cls(row.digests, parser.grammar)
+            )
+        return cls._diffs[key]
+
+    @property
+    def nonterminals(self):
+        """ The set of touched nonterminal names """
+        return self._nonterminals
+
+    @property
+    def terminals(self):
+        """ The set of touched terminal names """
+        return self._terminals
+
+    def touches(self, tree):
+        """ Return True if the given sentence tree, in the text format
+            stored in Article.tree (without the S line), contains a
+            touched symbol or is an error entry """
+        for line in tree.split("\n"):
+            if not line:
+                continue
+            code = line[0]
+            if code == "E":
+                # The sentence did not parse: always reparse it
+                return True
+            if code == "N" or code == "T":
+                a = line.split(" ", maxsplit=2)
+                if len(a) < 2:
+                    continue
+                if code == "N":
+                    if a[1] in self._nonterminals:
+                        return True
+                elif a[1] in self._terminals:
+                    return True
+        return False
@@ -0,0 +1,106 @@
+"""
+
+    Reynir: Natural language processing for Icelandic
+
+    HTML blob store module
+
+    Copyright (C) 2018 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+    This module keeps the raw HTML of scraped articles compressed in a
+    side table (htmlblobs), instead of inline in the articles table, where
+    it makes every full row read expensive and the table's storage huge.
+
+    The blobs are content-addressed: the key of a blob is the SHA-256 hash
+    of its HTML, which the article refers to in its html_hash column. An
+    article that is scraped again without changes, or a page that appears
+    under several URLs, is thus stored only once.
+
+    The HTML is compressed with Zstandard if the zstandard package is
+    installed, and with zlib otherwise. The method is recorded with each
+    blob, so that blobs of both kinds can be read. Zstandard compresses
+    HTML considerably better than PostgreSQL's built-in TOAST compression,
+    and decompresses faster than zlib.
+
+    The Article class loads the HTML of an article lazily, i.e. only when
+    it is needed, such as when the text content of the article has to be
+    extracted again. Existing articles are moved into the blob store, and
+    the space used is reported, by utils/htmlblobs.py.
+
+"""
+
+import zlib
+import hashlib
+
+try:
+    import zstandard
+
+    HAS_ZSTD = True
+except ImportError:
+    HAS_ZSTD = False
+
+from scraperdb import HtmlBlob
+
+
+# Compression levels, chosen for a good ratio at a moderate cost,
+# since a document is compressed once but may be read many times
+_ZSTD_LEVEL = 9
+_ZLIB_LEVEL = 6
+
+
+def compress(data):
+    """ Compress a bytes object, returning a tuple (codec, compressed data) """
+    if HAS_ZSTD:
+        return "zstd", zstandard.ZstdCompressor(level=_ZSTD_LEVEL).compress(data)
+    return "zlib", zlib.compress(data, _ZLIB_LEVEL)
+
+
+def decompress(codec, data):
+    """ Decompress the data of a blob, returning a bytes object """
+    if codec == "zlib":
+        return zlib.decompress(data)
+    if codec == "zstd":
+        if not HAS_ZSTD:
+            raise ValueError("The zstandard package is required to read this blob")
+        # The compressor records the content size in the frame header
+        return zstandard.ZstdDecompressor().decompress(data)
+    raise ValueError("Unknown blob codec '{0}'".format(codec))
+
+
+def store_html(session, html):
+    """ Store an HTML document in the blob store, unless it is already
+        there, returning its key """
+    data = html.encode("utf-8")
+    key = hashlib.sha256(data).hexdigest()
+    codec, compressed = compress(data)
+    HtmlBlob.store(session, key, codec, len(data), compressed)
+    return key
+
+
+def load_html(session, key):
+    """ Return the HTML document with the given key from the blob store,
+        or None if it is not found """
+    blob = HtmlBlob.load(session, key)
+    if blob is None:
+        return None
+    codec, data = blob
+    return decompress(codec, data).decode("utf-8")
+
+
+def row_html(session, ar):
+    """ Return the HTML of an article row, inline or from the blob store """
+    if ar.html is not None or ar.html_hash is None:
+        return ar.html
+    return load_html(session, ar.html_hash)
@@ -26,14 +26,23 @@
     it is processed. Also, time.sleep(0) is called between sentences
     to make multi-threaded parses proceed more smoothly and evenly.
 
+    The parse result of a sentence can be obtained in a detached form
+    (ParsedSentence) that does not reference the parse forest. Such
+    results can be cached by an optional sentence cache (see parsecache.py),
+    in which case sentences that have been parsed before are not re-parsed.
+    Sentences can also be parsed under the control of a resource governor
+    (see governor.py), which abandons the parse of a sentence if it takes
+    too much time or memory, and the sentences of a token stream can be
+    parsed in parallel by a pool of parser processes (see parsepool.py).
+
 """
 
 import time
-from collections import defaultdict
+from collections import defaultdict, namedtuple
 
 from tokenizer import TOK, paragraphs
 
-from reynir.fastparser import Fast_Parser, ParseError
+from reynir.fastparser import Fast_Parser, ParseError, ParseForestDumper
 from reynir.reducer import Reducer
 from settings import Settings
 
@@ -42,6 +51,29 @@ from settings import Settings
 _VERBOSE_AMBIGUITY_THRESHOLD = 1000
 
 
+# The detached result of parsing a sentence:
+# num is the number of parse tree combinations (0 if the parse failed),
+# score is the score of the best tree,
+# err_index is the index of the error token, or None if the parse succeeded,
+# tree is the sentence tree in the text format stored in Article.tree
+# (without the leading S line),
+# tokens is the list of token dicts (see TreeUtility.dump_tokens()), and
+# words is a list of (stem, cat, count) tuples for the word stems in the sentence
+ParsedSentence = namedtuple(
+    "ParsedSentence", ["num", "score", "err_index", "tree", "tokens", "words"]
+)
+
+
+class SentenceAbandoned(Exception):
+
+    """ Raised by a parse governor when the parse of a sentence is
+        abandoned, e.g. because it exceeded its time or memory budget """
+
+    def __init__(self, reason):
+        super().__init__("Sentence parse abandoned: {0}".format(reason))
+        self.reason = reason
+
+
 class IncrementalParser:
 
     """ Utility class to parse a token list as a sequence of paragraphs
@@ -75,12 +107,57 @@ class IncrementalParser:
             self._err_index = None
             self._tree = None
             self._score = 0
+            self._num = 0
+            self._result = None  # Detached result, from dump() or the cache
+            self._abandoned = False
+            # Result from the cache, or pending result from a parse pool,
+            # when the sentence has been submitted to a pool
+            self._prefetched = None
+            self._pending = None
 
         def __len__(self):
             return self._len
 
+        def submit(self, pool):
+            """ Submit the sentence for parsing in a pool of parser processes
+                (see parsepool.py). The result is collected by parse(). """
+            cache = self._ip._cache
+            if cache is not None:
+                result = cache.lookup(self._s, self._ip._parser.version)
+                if result is not None:
+                    self._prefetched = result
+                    return
+            self._pending = pool.submit(self._s, self._ip._governor is not None)
+
         def parse(self):
             """ Parse the sentence """
+            cache = self._ip._cache
+            if self._prefetched is not None:
+                # Cache hit, found when the sentence was submitted to a pool
+                return self.reuse(self._prefetched)
+            if self._pending is not None:
+                # Collect the result from the parse pool
+                result, abandoned = self._pending.get()
+                self._pending = None
+                self._abandoned = abandoned
+                if cache is not None and not abandoned:
+                    cache.store(self._s, self._ip._parser.version, result)
+                return self.reuse(result)
+            if cache is not None:
+                result = cache.lookup(self._s, self._ip._parser.version)
+                if result is not None:
+                    # Cache hit: no need to parse
+                    return self.reuse(result)
+            governor = self._ip._governor
+            if governor is not None:
+                # Parse in a separate process, within a time and memory budget
+                try:
+                    result = governor.parse(self._s)
+                except SentenceAbandoned as e:
+                    return self.abandon(e.reason)
+                if cache is not None:
+                    cache.store(self._s, self._ip._parser.version, result)
+                return self.reuse(result)
             num = 0
             score = 0
             try:
@@ -94,9 +171,87 @@ class IncrementalParser:
                 self._err_index = e.token_index
             self._tree = forest
             self._score = score
+            self._num = num
             self._ip._add_sentence(self, num)
             return num > 0
 
+        def reuse(self, result):
+            """ Use an existing ParsedSentence as the result of this sentence,
+                instead of parsing it. Note that the tree property is None
+                in this case; use dump() to obtain the result. """
+            self._result = result
+            self._num = result.num
+            self._score = result.score
+            self._err_index = result.err_index
+            self._ip._add_sentence(self, result.num)
+            return result.num > 0
+
+        def abandon(self, reason, err_index=None):
+            """ Give up on parsing the sentence, recording the reason in its
+                error entry. The error token is the last token of the sentence,
+                unless another index is given. Abandoned sentences are not
+                stored in the sentence cache, since the outcome depends on
+                the resource budget rather than the sentence itself. """
+            # Avoid a circular import
+            from treeutil import TreeUtility
+
+            if err_index is not None:
+                self._err_index = err_index
+            err_index = self.err_index
+            self._result = ParsedSentence(
+                0,
+                0,
+                err_index,
+                "E{0} {1}".format(err_index, reason),
+                TreeUtility.dump_tokens(self._s, None, None, err_index),
+                [],
+            )
+            self._num = 0
+            self._score = 0
+            self._abandoned = True
+            self._ip._add_sentence(self, 0)
+            return False
+
+        def dump(self):
+            """ Return the result of the parse as a ParsedSentence, which does
+                not reference the parse forest. The result is stored in the
+                sentence cache, if the parser has one. """
+            if self._result is None:
+                # Avoid a circular import
+                from treeutil import TreeUtility
+
+                words = defaultdict(int)
+                if self._num > 0:
+                    err_index = None
+                    token_dicts = TreeUtility.dump_tokens(self._s, self._tree, words)
+                    # Create a verbose text representation of the highest scoring
+                    # parse tree, including its score and the number of tokens
+                    tree = "\n".join(
+                        [
+                            "C{0}".format(self._score),
+                            "L{0}".format(self._len),
+                            ParseForestDumper.dump_forest(
+                                self._tree, token_dicts=token_dicts
+                            ),
+                        ]
+                    )
+                else:
+                    err_index = self.err_index
+                    token_dicts = TreeUtility.dump_tokens(self._s, None, None, err_index)
+                    tree = "E{0}".format(err_index)
+                self._result = ParsedSentence(
+                    self._num,
+                    self._score,
+                    err_index,
+                    tree,
+                    token_dicts,
+                    [(w.stem, w.cat, cnt) for w, cnt in words.items()],
+                )
+                cache = self._ip._cache
+                if cache is not None:
+                    cache.store(self._s, self._ip._parser.version, self._result)
+            return self._result
+
         @property
         def tokens(self):
             return self._s
@@ -105,6 +260,15 @@ class IncrementalParser:
         def tree(self):
             return self._tree
 
+        @property
+        def num(self):
+            return self._num
+
+        @property
+        def abandoned(self):
+            """ True if the parse of the sentence was abandoned """
+            return self._abandoned
+
         @property
         def score(self):
             return self._score
@@ -138,8 +302,10 @@ class IncrementalParser:
                 yield IncrementalParser._IncrementalSentence(self._ip, sent)
 
 
-    def __init__(self, parser, toklist, verbose = False):
+    def __init__(self, parser, toklist, verbose = False, cache = None, governor = None):
         self._parser = parser
+        self._cache = cache
+        self._governor = governor
         self._reducer = Reducer(parser.grammar)
         self._num_sent = 0
         self._num_parsed_sent = 0
@@ -0,0 +1,158 @@
+"""
+
+    Reynir: Natural language processing for Icelandic
+
+    Job queue module
+
+    Copyright (C) 2018 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+    This module implements a queue of jobs, such as articles to be parsed
+    or processed, that is kept in the jobs table of the scraper database
+    and shared by any number of hosts without further coordination.
+
+    Each host adds the jobs that it finds to the queue, ignoring those that
+    are already there, and then claims jobs from the queue in batches,
+    most expensive first. A claim takes a lease on the jobs for a given
+    number of seconds, and uses SELECT ... FOR UPDATE SKIP LOCKED, so that
+    concurrent claims by other hosts get different jobs without waiting.
+
+    While a host is working, a background thread renews the leases of its
+    jobs (a heartbeat). A job is deleted from the queue when it has been
+    completed. If a host dies, its leases expire and its jobs are claimed
+    again by others, up to a maximum number of attempts, so that a job
+    that repeatedly brings down its worker does not circulate forever.
+
+    The queue uses its own database engine without a connection pool,
+    so that worker processes forked by the host (which may complete jobs)
+    don't inherit open connections.
+
+"""
+
+import os
+import socket
+import logging
+import threading
+
+from settings import Settings
+from scraperdb import Scraper_DB, Job
+
+
+class JobQueue:
+
+    """ A host's access to the shared queue of jobs of a stage """
+
+    def __init__(self, stage, owner=None, lease=None, batch=None, attempts=None):
+        """ Create access to the queue of the given stage, such as 'parse'.
+            Jobs are claimed batch at a time, for lease seconds, and claimed
+            at most attempts times. The owner identifies this host and
+            process, by default as hostname:pid. """
+        self._stage = stage
+        self._owner = owner or "{0}:{1}".format(socket.gethostname(), os.getpid())
+        self._lease = Settings.JOB_LEASE if lease is None else lease
+        self._batch = batch or Settings.JOB_BATCH
+        self._attempts = attempts or Settings.JOB_ATTEMPTS
+        self._db = Scraper_DB(pooled=False)
+        self._heartbeat = None
+        self._stop = threading.Event()
+        # Number of jobs claimed by this host
+        self.claimed = 0
+
+    @property
+    def owner(self):
+        return self._owner
+
+    def _execute(self, func, **kwargs):
+        """ Call a Job method with a fresh session, committing afterwards """
+        session = self._db.session
+        try:
+            result = func(session, stage=self._stage, **kwargs)
+            session.commit()
+            return result
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def enqueue(self, jobs):
+        """ Add jobs, given as (url, cost) tuples, to the queue """
+        self._execute(Job.enqueue, jobs=list(jobs), attempts=self._attempts)
+
+    def claim(self):
+        """ Claim a batch of jobs, returning a list of (url, cost) tuples """
+        jobs = self._execute(
+            Job.claim,
+            owner=self._owner,
+            batch=self._batch,
+            lease=self._lease,
+            attempts=self._attempts,
+        )
+        self.claimed += len(jobs)
+        return jobs
+
+    def batches(self):
+        """ Generator of batches of jobs claimed from the queue, each a list
+            of (url, cost) tuples, until there are no more jobs to claim.
+            The leases of the claimed jobs are kept alive until close()
+            is called. """
+        self.start()
+        while True:
+            batch = self.claim()
+            if not batch:
+                break
+            yield batch
+
+    def complete(self, url):
+        """ Remove a completed job from the queue. May be called from
+            a worker process forked by this host. """
+        self._execute(Job.complete, url=url, owner=self._owner)
+
+    def release(self, url=None):
+        """ Release the claim on a job, or on all jobs claimed by this host,
+            so that they can be claimed again (if attempts remain) """
+        self._execute(Job.release, url=url, owner=self._owner)
+
+    def _renew(self):
+        """ Renew the leases of the claimed jobs periodically, until stopped """
+        interval = self._lease / 3.0
+        while not self._stop.wait(interval):
+            try:
+                self._execute(Job.renew, owner=self._owner, lease=self._lease)
+            except Exception as e:
+                logging.warning("Unable to renew job leases: {0!r}".format(e))
+
+    def start(self):
+        """ Start renewing the leases of the claimed jobs """
+        if self._heartbeat is None:
+            self._stop.clear()
+            self._heartbeat = threading.Thread(
+                target=self._renew, name="JobQueueHeartbeat", daemon=True
+            )
+            self._heartbeat.start()
+
+    def close(self):
+        """ Stop renewing leases, and release the jobs that were claimed but
+            not completed, such as those whose worker process died """
+        if self._heartbeat is not None:
+            self._stop.set()
+            self._heartbeat.join()
+            self._heartbeat = None
+        self.release()
+
+    def counts(self):
+        """ Return a tuple of the numbers of queued, claimed and failed
+            jobs in the queue """
+        return self._execute(Job.counts, attempts=self._attempts)
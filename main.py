@@ -66,6 +66,7 @@ from reynir.binparser import canonicalize_token
 from reynir.fastparser import Fast_Parser, ParseForestFlattener
 from article import Article as ArticleProxy
 from treeutil import TreeUtility
+import bintokens
 from scraperdb import (
     SessionContext,
     desc,
@@ -507,16 +508,24 @@ def chart_stats(session=None, num_days=7):
     }
 
     today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    first = today - timedelta(days=num_days - 1)
     labels = []
     sources = {}
     parsed_data = []
 
-    # Get article count for each source for each day
+    # Get article count and parsing stats per source for each day,
+    # in a single query
+    names = set()
+    counts = {}
+    q = ChartsQuery.daily(first, today + timedelta(days=1), enclosing_session=session)
+    for (name, day, cnt, s, p) in q:
+        names.add(name)
+        if day is not None:
+            counts[(name, day)] = (cnt, s, p)
+
     with changedlocale(category="LC_TIME"):
         for n in range(0, num_days):
-            days_back = num_days - n - 1
-            start = today - timedelta(days=days_back)
-            end = today - timedelta(days=days_back - 1)
+            start = first + timedelta(days=n)
 
             # Generate label
             if start < today - timedelta(days=6):
@@ -527,10 +536,8 @@ def chart_stats(session=None, num_days=7):
             sent = 0
             parsed = 0
 
-            # Get article count per source for day
-            # Also collect parsing stats
-            q = ChartsQuery.period(start, end, enclosing_session=session)
-            for (name, cnt, s, p) in q:
+            for name in sorted(names):
+                cnt, s, p = counts.get((name, start.date()), (0, 0, 0))
                 sources.setdefault(name, []).append(cnt)
                 sent += s
                 parsed += p
@@ -749,7 +756,7 @@ def article_api(version=1):
         if a is None:
             return better_jsonify(valid=False, reason="Article not found")
 
-        if a.html is None:
+        if not a.has_html:
             return better_jsonify(valid=False, reason="Unable to fetch article")
 
         # Prepare the article for display
@@ -1392,7 +1399,9 @@ def parsefail():
 
     with SessionContext(read_only=True) as session:
         q = (
-            session.query(Article.id, Article.timestamp, Article.tokens)
+            session.query(
+                Article.id, Article.timestamp, Article.tokens, Article.tokens_bin
+            )
             .filter(Article.tree != None)
             .filter(Article.timestamp != None)
             .filter(Article.timestamp <= datetime.utcnow())
@@ -1406,19 +1415,17 @@ def parsefail():
         sfails = []
 
         for a in q.all():
-            tokens = json.loads(a.tokens)
-            # Paragraphs
-            for p in tokens:
-                # Sentences
-                for s in p:
-                    # Tokens
-                    for t in s:
-                        if "err" in t:
-                            # Only add well-formed sentences that start   
-                            # with a capital letter and end with a period
-                            if s[0]['x'][0].isupper() and s[-1]['x'] == '.':
-                                sfails.append([s])
-                                break
+            doc = bintokens.load(a.tokens_bin, a.tokens)
+            if doc is None:
+                continue
+            # Only decode the sentences that were not parsed
+            for ix in range(doc.num_sentences):
+                if doc.has_error(ix):
+                    s = doc.sentence(ix)
+                    # Only add well-formed sentences that start
+                    # with a capital letter and end with a period
+                    if s[0]['x'][0].isupper() and s[-1]['x'] == '.':
+                        sfails.append([s])
 
     return render_template("parsefail.html", sentences=json.dumps(sfails), num=num)
 
@@ -0,0 +1,173 @@
+"""
+
+    Reynir: Natural language processing for Icelandic
+
+    Sentence parse cache module
+
+    Copyright (C) 2018 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+    This module implements a content-addressed cache of sentence parse
+    results (see incparser.ParsedSentence). News sites repeat many
+    identical sentences (bylines, boilerplate, syndicated copy), which
+    then only need to be parsed once for each parser version.
+
+    The cache key is a hash of the sentence tokens (kind and text of each
+    token) and the parser version. The values of person tokens are also
+    included, in a canonical order, since the entity recognizer fills a
+    bare surname with the full names and genders of a person mentioned
+    earlier in the same article, so that the same text may have different
+    meanings in different articles. The cache has two levels:
+    a small in-process LRU dictionary, and the sentcache table in the
+    scraper database, which is shared between all parser processes.
+    The table is kept within a maximum number of entries by periodically
+    evicting the least recently used ones.
+
+"""
+
+import json
+import zlib
+import hashlib
+import logging
+from datetime import datetime
+from collections import OrderedDict
+
+from tokenizer import TOK
+
+from settings import Settings
+from scraperdb import SessionContext, CachedSentence, DatabaseError
+from incparser import ParsedSentence
+
+
+# Number of stores between evictions of old entries from the database table
+_EVICT_INTERVAL = 1000
+
+
+def person_names(token):
+    """ Return the names of a person token as a sorted tuple of
+        (name, gender, case) tuples, independent of their original order """
+    return tuple(sorted((fn or "", g or "", c or "") for fn, g, c in token.val or ()))
+
+
+def sentence_key(tokens, version):
+    """ Return a cache key for the given sentence tokens and parser version """
+    h = hashlib.sha1(version.encode("utf-8"))
+    for t in tokens:
+        h.update("\x1e{0}\x1f{1}".format(t.kind, t.txt).encode("utf-8"))
+        if t.kind == TOK.PERSON:
+            for name in person_names(t):
+                h.update("\x1d{0}/{1}/{2}".format(*name).encode("utf-8"))
+    return h.hexdigest()
+
+
+class SentenceCache:
+
+    """ A two-level cache of sentence parse results, usable as the
+        cache parameter of IncrementalParser """
+
+    def __init__(self, local_size=None, max_entries=None):
+        self._local = OrderedDict()
+        self._local_size = (
+            Settings.SENTENCE_CACHE_LOCAL_SIZE if local_size is None else local_size
+        )
+        self._max_entries = (
+            Settings.SENTENCE_CACHE_SIZE if max_entries is None else max_entries
+        )
+        self._stores_since_evict = 0
+        # Statistics
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+
+    @staticmethod
+    def _encode(result):
+        return zlib.compress(
+            json.dumps(result, separators=(",", ":"), ensure_ascii=False).encode(
+                "utf-8"
+            )
+        )
+
+    @staticmethod
+    def _decode(data):
+        return ParsedSentence(*json.loads(zlib.decompress(data).decode("utf-8")))
+
+    def _remember(self, key, result):
+        """ Add an entry to the local LRU dictionary """
+        self._local[key] = result
+        self._local.move_to_end(key)
+        if len(self._local) > self._local_size:
+            # Discard the least recently used entry
+            self._local.popitem(last=False)
+
+    def lookup(self, tokens, version):
+        """ Return the cached ParsedSentence for the given tokens
+            and parser version, or None if not found """
+        key = sentence_key(tokens, version)
+        result = self._local.get(key)
+        if result is not None:
+            self._local.move_to_end(key)
+            self.hits += 1
+            return result
+        try:
+            with SessionContext(commit=True) as session:
+                row = (
+                    session.query(CachedSentence.data)
+                    .filter(CachedSentence.key == key)
+                    .one_or_none()
+                )
+                if row is not None:
+                    CachedSentence.hit(session, key, datetime.utcnow())
+        except DatabaseError as e:
+            logging.warning("Sentence cache lookup failed: {0}".format(e))
+            row = None
+        if row is None:
+            self.misses += 1
+            return None
+        result = self._decode(row.data)
+        self._remember(key, result)
+        self.hits += 1
+        return result
+
+    def store(self, tokens, version, result):
+        """ Store a ParsedSentence for the given tokens and parser version """
+        key = sentence_key(tokens, version)
+        self._remember(key, result)
+        try:
+            with SessionContext(commit=True) as session:
+                CachedSentence.insert(
+                    session, key, version, self._encode(result), datetime.utcnow()
+                )
+                self._stores_since_evict += 1
+                if self._stores_since_evict >= _EVICT_INTERVAL:
+                    CachedSentence.evict(session, self._max_entries)
+                    self._stores_since_evict = 0
+        except DatabaseError as e:
+            logging.warning("Sentence cache store failed: {0}".format(e))
+            return
+        self.stores += 1
+
+    @property
+    def hit_ratio(self):
+        n = self.hits + self.misses
+        return self.hits / n if n else 0.0
+
+    def stats(self):
+        """ Return a dict of this process' cache statistics """
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            stores=self.stores,
+            hit_ratio=self.hit_ratio,
+        )
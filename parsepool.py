@@ -0,0 +1,159 @@
+"""
+
+    Reynir: Natural language processing for Icelandic
+
+    Parallel sentence parsing module
+
+    Copyright (C) 2018 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+    This module implements a warm pool of parser processes, used to parse
+    the sentences of a single article or text in parallel, in order to
+    reduce the latency of interactive requests (/page, /reparse.api,
+    /analyze.api and friends). The worker processes are forked after the
+    grammar has been loaded, so they are ready to parse immediately.
+
+    Sentences are submitted to the pool all at once and their results are
+    collected in the original order, so the output is identical to that of
+    the serial path. The results come back in detached form: either as a
+    ParsedSentence, or as the value of a transformation function (xform)
+    that is applied to the parse forest within the worker. Such functions
+    must be picklable, i.e. defined at module or class level.
+
+    The pool is not available within daemonic processes (such as the
+    scraper's pool workers), which cannot have child processes; the
+    scraper parallelizes across articles instead.
+
+"""
+
+import threading
+import multiprocessing
+
+from reynir.fastparser import Fast_Parser
+
+from settings import Settings
+from incparser import IncrementalParser, ParsedSentence
+from governor import ParseGovernor
+
+
+# The parser of a worker process, inherited from the parent by fork()
+_worker_parser = None
+# Incremental parsers of a worker process, without and with a parse governor
+_worker_ip = None
+_worker_governed_ip = None
+
+
+def _init_worker():
+    """ Initialize a worker process of the pool """
+    global _worker_ip, _worker_governed_ip
+    _worker_ip = IncrementalParser(_worker_parser, [])
+    if Settings.PARSE_GOVERNOR:
+        _worker_governed_ip = IncrementalParser(
+            _worker_parser, [], governor=ParseGovernor(_worker_parser)
+        )
+    else:
+        _worker_governed_ip = _worker_ip
+
+
+def _parse_sentence(tokens, governed):
+    """ Parse a sentence in a worker process, returning a tuple of
+        the ParsedSentence and a flag indicating whether the parse
+        was abandoned by the governor """
+    ip = _worker_governed_ip if governed else _worker_ip
+    sent = IncrementalParser._IncrementalSentence(ip, tokens)
+    sent.parse()
+    return sent.dump(), sent.abandoned
+
+
+def _transform_sentence(tokens, xform):
+    """ Parse a sentence in a worker process, returning a tuple of
+        a ParsedSentence containing the statistics of the parse
+        (but no tree, tokens or words) and the result of the
+        transformation function xform """
+    sent = IncrementalParser._IncrementalSentence(_worker_ip, tokens)
+    if sent.parse():
+        value = xform(sent.tokens, sent.tree, None)
+        err_index = None
+    else:
+        err_index = sent.err_index
+        value = xform(sent.tokens, None, err_index)
+    return ParsedSentence(sent.num, sent.score, err_index, None, None, None), value
+
+
+class ParsePool:
+
+    """ A pool of warm parser processes for parsing the sentences
+        of a single article or text in parallel """
+
+    # The pool of the current process
+    _instance = None
+    _lock = threading.Lock()
+
+    def __init__(self, processes):
+        global _worker_parser
+        # The pool has its own parser, which the worker processes inherit
+        self._parser = Fast_Parser(verbose=False)
+        self._version = self._parser.version
+        _worker_parser = self._parser
+        self._pool = multiprocessing.get_context("fork").Pool(
+            processes, initializer=_init_worker
+        )
+        self._owner = multiprocessing.current_process().pid
+
+    @classmethod
+    def instance(cls, parser):
+        """ Return the pool of the current process, if enabled and usable
+            with the given parser; otherwise None """
+        if Settings.PARSE_POOL <= 0:
+            return None
+        proc = multiprocessing.current_process()
+        if proc.daemon:
+            # Daemonic processes are not allowed to have children
+            return None
+        if parser._root_index != 0:
+            # The workers only use the default root nonterminal
+            return None
+        with cls._lock:
+            pool = cls._instance
+            if pool is not None and (
+                pool._owner != proc.pid or pool._version != parser.version
+            ):
+                # The pool was inherited from a parent process,
+                # or the grammar has been changed since it was created
+                if pool._owner == proc.pid:
+                    pool.close()
+                pool = None
+            if pool is None:
+                pool = cls._instance = cls(Settings.PARSE_POOL)
+        if pool._version != parser.version:
+            # The caller's parser is out of date with regard to the grammar
+            return None
+        return pool
+
+    def submit(self, tokens, governed=False):
+        """ Submit a sentence for parsing, returning an AsyncResult
+            whose value is a tuple (ParsedSentence, abandoned) """
+        return self._pool.apply_async(_parse_sentence, (tokens, governed))
+
+    def submit_xform(self, tokens, xform):
+        """ Submit a sentence for parsing and transformation, returning
+            an AsyncResult whose value is a tuple (ParsedSentence, value) """
+        return self._pool.apply_async(_transform_sentence, (tokens, xform))
+
+    def close(self):
+        """ Terminate the worker processes """
+        self._pool.terminate()
+        self._pool.join()
+        self._parser.cleanup()
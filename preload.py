@@ -0,0 +1,110 @@
+"""
+
+    Reynir: Natural language processing for Icelandic
+
+    Preload module
+
+    Copyright (C) 2018 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+    This module loads the data that is common to all parser processes,
+    i.e. the settings, the grammar (in Python and in the C++ parser) and
+    the compressed BIN lexicon, into a parent process before it forks
+    worker processes, such as the scraper's parser processes or the
+    gunicorn web server workers. The workers then find the data already
+    loaded, and share its memory pages with the parent (copy-on-write)
+    instead of each loading a private copy.
+
+    After loading, the objects of the parent are moved to the permanent
+    generation of the garbage collector (gc.freeze()), so that garbage
+    collection in the workers doesn't write to - and thereby unshare -
+    the pages that hold them.
+
+    The module also contains a function to measure the resident, shared
+    and private memory of a process (see utils/forkbench.py).
+
+"""
+
+import os
+import gc
+import time
+import logging
+
+from reynir.fastparser import Fast_Parser
+from reynir.bindb import BIN_Db
+
+from settings import Settings
+
+
+# The memory statistics reported by memory_usage(), from /proc/<pid>/smaps_rollup
+_MEMORY_FIELDS = {
+    "Rss": "rss",
+    "Pss": "pss",
+    "Shared_Clean": "shared",
+    "Shared_Dirty": "shared",
+    "Private_Clean": "private",
+    "Private_Dirty": "private",
+}
+
+
+def preload(config_file=None, freeze=True):
+    """ Load the settings, grammar and BIN lexicon into the current
+        process, to be shared by the worker processes that it forks.
+        Returns the elapsed time in seconds. """
+    t0 = time.time()
+    if config_file is not None:
+        Settings.read(config_file)
+    # Read the grammar (generating its binary form if it is out of date)
+    # and load it into the C++ parser
+    with Fast_Parser(verbose=False):
+        pass
+    # Open the compressed BIN lexicon and make sure its pages are mapped
+    with BIN_Db.get_db() as db:
+        db.meanings("og")
+    if freeze:
+        gc.collect()
+        gc.freeze()
+    elapsed = time.time() - t0
+    logging.info("Preloaded grammar and lexicon in {0:.2f} seconds".format(elapsed))
+    return elapsed
+
+
+def memory_usage(pid=None):
+    """ Return a dict of the resident set size (rss), proportional set
+        size (pss), shared and private memory of a process, in megabytes,
+        or None if unavailable """
+    fname = "/proc/{0}/smaps_rollup".format(pid or "self")
+    result = dict(rss=0.0, pss=0.0, shared=0.0, private=0.0)
+    try:
+        with open(fname) as f:
+            for line in f:
+                a = line.split()
+                field = _MEMORY_FIELDS.get(a[0].rstrip(":"))
+                if field is not None:
+                    result[field] += int(a[1]) / 1024.0
+    except (OSError, ValueError, IndexError):
+        return None
+    return result
+
+
+def log_memory_usage(label, pid=None):
+    """ Log the memory usage of a process """
+    m = memory_usage(pid)
+    if m is not None:
+        logging.info(
+            "{0} (pid {1}): RSS {2:.0f} MB, PSS {3:.0f} MB, "
+            "shared {4:.0f} MB, private {5:.0f} MB"
+            .format(label, pid or os.getpid(), m["rss"], m["pss"], m["shared"], m["private"])
+        )
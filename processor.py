@@ -45,6 +45,8 @@ from collections import OrderedDict
 from settings import Settings, ConfigError
 from scraperdb import Scraper_DB, Article, Person
 from tree import Tree
+from workerpool import WorkerPool
+from jobqueue import JobQueue
 
 _PROFILING = False
 
@@ -70,6 +72,9 @@ class Processor:
 
         Processor._init_class()
         self.workers = workers
+        self.single_processor = single_processor
+        # The shared queue of articles to process, if enabled (see jobqueue.py)
+        self._jobs = None
 
         # Dynamically load all processor modules
         # (i.e. .py files found in the processor directory, except those
@@ -123,7 +128,9 @@ class Processor:
 
     def go_single(self, url):
         """ Single article processor that will be called by a process within a
-            multiprocessing pool """
+            multiprocessing pool. Returns True if the article was processed
+            (or is not in the database); an exception is reported and
+            raised again. """
 
         print("Processing article {0}".format(url))
         sys.stdout.flush()
@@ -139,22 +146,36 @@ class Processor:
 
             try:
 
-                article = session.query(Article).filter_by(url=url).one_or_none()
+                # Read only the columns that the processors need,
+                # instead of the whole article row
+                row = (
+                    session
+                    .query(Article.authority, Article.tree_bin, Article.tree != None)
+                    .filter_by(url=url)
+                    .one_or_none()
+                )
 
-                if article is None:
+                if row is None:
                     print("Article not found in scraper database")
                 else:
-                    if article.tree:
-                        tree = Tree(url, article.authority)
-                        # print("Tree:\n{0}\n".format(article.tree))
-                        tree.load(article.tree)
+                    authority, tree_bin, has_tree = row
+                    if has_tree:
+                        tree = Tree(url, authority)
+                        # Prefer the binary tree format, which loads faster,
+                        # and only read the text format if there is none
+                        tree.load(
+                            tree_bin
+                            or session.query(Article.tree).filter_by(url=url).scalar()
+                        )
 
                         # Run all processors in turn
                         for p in self.pmodules:
                             tree.process(session, p)
 
                     # Mark the article as being processed
-                    article.processed = datetime.utcnow()
+                    session.query(Article).filter_by(url=url).update(
+                        dict(processed=datetime.utcnow()), synchronize_session=False
+                    )
 
                 # So far, so good: commit to the database
                 session.commit()
@@ -170,6 +191,52 @@ class Processor:
                 raise
 
         sys.stdout.flush()
+        return True
+
+    def _go_single_job(self, url):
+        """ Process an article claimed from the shared job queue, within
+            a worker process, and remove it from the queue when done.
+            Returns True if the article was processed. """
+        try:
+            ok = self.go_single(url)
+        except Exception:
+            # Already reported by go_single()
+            ok = False
+        if ok:
+            self._jobs.complete(url)
+        else:
+            # Let the article be claimed again, if it has attempts left
+            self._jobs.release(url)
+        return ok
+
+    def _go_queued(self, urls):
+        """ Put the given articles into the shared job queue and process
+            the articles claimed from it, which may also have been put there
+            by other hosts, in a pool of worker processes """
+        self._jobs = JobQueue("process")
+        try:
+            self._jobs.enqueue((url, 0) for url in urls)
+            # Don't let the workers inherit the pooled database connections
+            self._db.dispose()
+            # Unlike Pool.map(), the pool takes the articles from the queue
+            # as it needs them, leaving the rest to other hosts
+            pool = WorkerPool(self._go_single_job, processes=self.workers)
+            failed = 0
+            for ok in pool.imap_unordered(
+                url for batch in self._jobs.batches() for url, _ in batch
+            ):
+                if not ok:
+                    failed += 1
+        finally:
+            # Release the articles that were claimed but not processed
+            self._jobs.close()
+        queued, claimed, dead = self._jobs.counts()
+        print(
+            "Job queue: {0} articles claimed by this host, {1} failed; "
+            "{2} queued, {3} claimed by other hosts, {4} failed in all"
+            .format(self._jobs.claimed, failed, queued, claimed, dead)
+        )
+        self._jobs = None
 
     def go(self, from_date=None, limit=0, force=False, update=False, title=None):
         """ Process already parsed articles from the database """
@@ -217,6 +284,9 @@ class Processor:
             # If profiling, just do a simple map within a single thread and process
             for url in iter_parsed_articles():
                 self.go_single(url)
+        elif Settings.JOB_QUEUE and title is None and not self.single_processor:
+            # Share the processing with other hosts
+            self._go_queued(iter_parsed_articles())
         else:
             # Use a multiprocessing pool to process the articles
             # Defaults to using as many processes as there are CPUs
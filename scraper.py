@@ -31,33 +31,59 @@
 """
 
 import sys
-import gc
 import getopt
 import time
 import logging
+import hashlib
 
 # import traceback
 
 # from multiprocessing.dummy import Pool, cpu_count
-from multiprocessing import Pool, cpu_count
+from multiprocessing import cpu_count
+from multiprocessing.util import Finalize
 
 from settings import Settings, ConfigError
 from fetcher import Fetcher
+from fetchengine import FetchEngine, NOT_MODIFIED
+from workerpool import WorkerPool
+from jobqueue import JobQueue
+from frontier import Frontier
+from preload import preload, log_memory_usage
 from article import Article
 from scraperinit import init_roots
+from grammardiff import record_grammar
 
-from scraperdb import SessionContext, Root, IntegrityError
+from scraperdb import SessionContext, Root, RootStats, HtmlBlob, desc, dbfunc
 from scraperdb import Article as ArticleRow
 
 
+# Number of articles whose word stems are written together
+# to the words index by each parser process
+WORD_BATCH_SIZE = 20
+
+# Number of parsed articles between progress reports
+PROGRESS_INTERVAL = 100
+
+
+def _init_parse_worker():
+    """ Initialize a parser process within a multiprocessing pool """
+    # Write the word stems of parsed articles in batches,
+    # making sure that the last batch is written when the process exits
+    Article.begin_word_batch(WORD_BATCH_SIZE)
+    Finalize(None, Article.flush_words, kwargs=dict(force=True), exitpriority=10)
+    # Report how much of the process' memory is shared with the parent
+    Finalize(None, log_memory_usage, args=("Parser process",), exitpriority=5)
+
+
 class ArticleDescr:
 
     """ Unit of work descriptor that is shipped between processes """
 
-    def __init__(self, seq, root, url):
+    def __init__(self, seq, root, url, cost=0):
         self.seq = seq  # Sequence number
         self.root = root
         self.url = url
+        self.cost = cost  # Estimated parse cost (stored size of the HTML)
 
 
 class Scraper:
@@ -67,20 +93,47 @@ class Scraper:
     def __init__(self):
 
         logging.info("Initializing scraper instance")
-
-    def scrape_root(self, root, helper):
-        """ Scrape a root URL """
+        self._incremental = False
+        # Counters of root fetches, showing how many fetches were avoided
+        # by conditional GETs and how many parses by unchanged content.
+        # Also count the child URLs found on the root pages, new and known
+        self._root_stats = dict(
+            fetched=0, not_modified=0, unchanged=0, parsed=0, new_urls=0, known_urls=0
+        )
+        # Number of scraped articles found to be near-duplicates (see dedup.py)
+        self._duplicates = 0
+        # The shared queue of articles to parse, if enabled (see jobqueue.py)
+        self._jobs = None
+        # The schedule of root polls, if enabled (see frontier.py)
+        self._frontier = Frontier() if Settings.FRONTIER else None
+
+    def scrape_root(self, root, helper, html_doc=None, validators=None):
+        """ Scrape a root URL, or its already fetched HTML document along
+            with the validators (ETag, Last-Modified) of the response.
+            Returns the number of new child URLs found, or None if the
+            root could not be scraped. """
 
         t0 = time.time()
         # Fetch the root URL and scrape all child URLs that refer
         # to the same domain suffix and we haven't seen before
-        logging.info("Fetching root {0}".format(root.url))
-
-        # Read the HTML document at the root URL
-        html_doc = Fetcher.raw_fetch_url(root.url)
+        if html_doc is None:
+            logging.info("Fetching root {0}".format(root.url))
+            # Read the HTML document at the root URL
+            html_doc = Fetcher.raw_fetch_url(root.url)
         if not html_doc:
             logging.warning("Unable to fetch root {0}".format(root.url))
             return
+        self._root_stats["fetched"] += 1
+
+        content_hash = hashlib.sha256(html_doc.encode("utf-8")).hexdigest()
+        if content_hash == root.content_hash:
+            # The root page hasn't changed since it was last scraped,
+            # so it can't contain any new child URLs
+            logging.info("Root {0} is unchanged".format(root.url))
+            self._root_stats["unchanged"] += 1
+            self._update_root(root, validators, content_hash)
+            return 0
+        self._root_stats["parsed"] += 1
 
         # Parse the HTML document
         soup = Fetcher.make_soup(html_doc)
@@ -89,118 +142,215 @@ class Scraper:
         fetch_set = Fetcher.children(root, soup)
 
         # Add the children whose URLs we don't already have to the
-        # scraper articles table
-        with SessionContext() as session:
-
-            for url in fetch_set:
-
-                if helper and helper.skip_url(url):
-                    # The helper doesn't want this URL
-                    continue
+        # scraper articles table, leaving article.scraped as NULL
+        # for later retrieval
+        urls = [url for url in fetch_set if not (helper and helper.skip_url(url))]
+        try:
+            with SessionContext(commit=True) as session:
+                new_urls = ArticleRow.insert_urls(session, root.id, urls)
+        except Exception as e:
+            logging.warning(
+                "Unable to store the child URLs of root {0}: {1}"
+                .format(root.url, e)
+            )
+            return
+        num_new = len(new_urls)
+        self._root_stats["new_urls"] += num_new
+        self._root_stats["known_urls"] += len(urls) - num_new
+        logging.info(
+            "Root {0}: {1} new URLs, {2} already known"
+            .format(root.url, num_new, len(urls) - num_new)
+        )
 
-                # noinspection PyBroadException
-                try:
-                    article = ArticleRow(url=url, root_id=root.id)
-                    # Leave article.scraped as NULL for later retrieval
-                    session.add(article)
-                    session.commit()
-                except IntegrityError as e:
-                    # Article URL already exists in database:
-                    # roll back and continue
-                    session.rollback()
-                except Exception as e:
-                    logging.warning(
-                        "Roll back due to exception in scrape_root: {0}"
-                        .format(e)
-                    )
-                    session.rollback()
+        # Only note the new state of the root once its children are stored
+        self._update_root(root, validators, content_hash)
 
         t1 = time.time()
 
         logging.info("Root scrape completed in {0:.2f} seconds".format(t1 - t0))
+        return num_new
 
-    def scrape_article(self, url, helper):
-        """ Scrape a single article, retrieving its HTML and metadata """
+    @staticmethod
+    def _update_root(root, validators, content_hash):
+        """ Store the validators and content hash of a scraped root page """
+        validators = validators or dict()
+        with SessionContext(commit=True) as session:
+            session.query(Root).filter(Root.id == root.id).update(
+                dict(
+                    etag=validators.get("etag"),
+                    last_modified=validators.get("last_modified"),
+                    content_hash=content_hash,
+                ),
+                synchronize_session=False,
+            )
+
+    @staticmethod
+    def _conditional_headers(root):
+        """ Return the headers of a conditional GET of a root page """
+        headers = dict()
+        if root.etag:
+            headers["If-None-Match"] = root.etag
+        if root.last_modified:
+            headers["If-Modified-Since"] = root.last_modified
+        return headers or None
+
+    def scrape_article(self, url, helper, html=None):
+        """ Scrape a single article, retrieving its HTML and metadata,
+            unless the HTML has already been fetched. Returns the
+            signature of the article text, to be checked for near-duplicates
+            by the caller, or None. """
 
         if helper.skip_url(url):
             logging.info("Skipping article {0}".format(url))
-            return
+            return None
 
         # Fetch the root URL and scrape all child URLs that refer
         # to the same domain suffix and we haven't seen before
         logging.info("Scraping article {0}".format(url))
         t0 = time.time()
 
+        sig = None
         with SessionContext(commit=True) as session:
 
-            a = Article.scrape_from_url(url, session)
+            a = Article.scrape_from_url(url, session, html, dedup=False)
             if a is not None:
                 a.store(session)
+                sig = a.signature
 
         t1 = time.time()
         logging.info("Scraping completed in {0:.2f} seconds".format(t1 - t0))
+        return sig
 
-    def parse_article(self, seq, url, helper):
-        """ Parse a single article """
+    def parse_article(self, seq, url, helper, incremental=False):
+        """ Parse a single article. Returns a tuple of the number
+            of reused and the number of parsed sentences, the number of
+            sentences taken from the canonical copy of a near-duplicate
+            article, and the estimated parse time saved by that. """
 
         logging.info("[{1}] Parsing article {0}".format(url, seq))
         t0 = time.time()
         num_sentences = 0
         num_parsed = 0
+        reused = 0
+        reparsed = 0
+        duplicate_reused = 0
 
         # Load the article
         with SessionContext(commit=True) as session:
-            a = Article.load_from_url(url, session)
+            # A full parse replaces the previous results, so they aren't loaded
+            a = Article.load_from_url(url, session, for_parse=not incremental)
             if a is not None:
-                a.parse(session)
+                if incremental:
+                    reused, reparsed = a.reparse_incremental(session)
+                else:
+                    a.parse(session)
+                    duplicate_reused = a.duplicate_reused
+                    reparsed = a.num_sentences - duplicate_reused
                 num_sentences = a.num_sentences
                 num_parsed = a.num_parsed
 
+        # Write the word stems of this and previous articles, if the batch is full
+        Article.flush_words()
+
         t1 = time.time()
         logging.info(
             "[{3}] Parsing of {2}/{1} sentences completed in {0:.2f} seconds"
             .format(t1 - t0, num_sentences, num_parsed, seq)
         )
+        if incremental:
+            logging.info(
+                "[{0}] Incremental reparse: {1} sentences reused, {2} reparsed"
+                .format(seq, reused, reparsed)
+            )
+        saved = 0.0
+        if duplicate_reused:
+            saved = Article.estimated_parse_seconds(duplicate_reused)
+            logging.info(
+                "[{0}] Near-duplicate of {1}: {2} sentences reused, "
+                "saving an estimated {3:.2f} seconds"
+                .format(seq, a.duplicate_of, duplicate_reused, saved)
+            )
+        cs = Article.cache_stats()
+        if cs is not None:
+            logging.info(
+                "[{0}] Sentence cache: {1} hits, {2} misses, hit ratio {3:.1%} "
+                "in this process"
+                .format(seq, cs["hits"], cs["misses"], cs["hit_ratio"])
+            )
+        gs = Article.governor_stats()
+        if gs is not None and gs["abandoned"]:
+            logging.info(
+                "[{0}] Parse governor: {1} sentences parsed, {2} abandoned "
+                "in this process"
+                .format(seq, gs["parsed"], gs["abandoned"])
+            )
+        return reused, reparsed, duplicate_reused, saved
 
-    def _scrape_single_root(self, r):
-        """ Single root scraper that will be called by a process within a
-            multiprocessing pool """
+    def _scrape_single_root(self, r, html_doc=None, validators=None):
+        """ Single root scraper, called with the root's HTML document
+            as fetched by the fetch engine. Returns the number of new
+            child URLs found, or None if the root could not be scraped. """
         if r.domain.endswith(".local"):
             # We do not scrape .local roots
-            return
+            return None
         try:
             logging.info("Scraping root of {0} at {1}...".format(r.description, r.url))
             # Process a single top-level domain and root URL,
             # parsing child URLs that have not been seen before
             helper = Fetcher._get_helper(r)
             if helper:
-                self.scrape_root(r, helper)
+                return self.scrape_root(r, helper, html_doc, validators)
         except Exception as e:
             logging.warning(
                 "Exception when scraping root at {0}: {1!r}"
                 .format(r.url, e)
             )
-
-    def _scrape_single_article(self, d):
-        """ Single article scraper that will be called by a process within a
-            multiprocessing pool """
+        return None
+
+    def _scrape_single_article(self, task):
+        """ Single article scraper that will be called by a process within
+            a worker pool, with the article's descriptor and its HTML as
+            fetched by the fetch engine. Returns a tuple of the article's
+            URL and the signature of its text, or None. """
+        d, html = task
         try:
             helper = Fetcher._get_helper(d.root)
             if helper:
-                self.scrape_article(d.url, helper)
+                return d.url, self.scrape_article(d.url, helper, html)
         except Exception as e:
             logging.warning(
                 "[{2}] Exception when scraping article at {0}: {1!r}"
                 .format(d.url, e, d.seq)
             )
+        return None
+
+    def _scrape_articles(self, articles, processes=None):
+        """ Scrape the fetched articles, an iterable of (descriptor, html)
+            tuples, in a pool of worker processes, and check them for
+            near-duplicates in this process, against a single index of
+            signatures, so that copies of the same story scraped by
+            different workers are also found. Returns the pool statistics. """
+        pool = WorkerPool(
+            self._scrape_single_article, processes=processes or cpu_count()
+        )
+        for result in pool.imap_unordered(articles):
+            if result is None:
+                continue
+            url, sig = result
+            if sig is not None and Article.check_duplicate(url, sig) is not None:
+                self._duplicates += 1
+        return pool.stats()
 
     def _parse_single_article(self, d):
         """ Single article parser that will be called by a process within a
             multiprocessing pool """
+        result = None
         try:
             helper = Fetcher._get_helper(d.root)
             if helper:
-                self.parse_article(d.seq, d.url, helper)
+                result = self.parse_article(
+                    d.seq, d.url, helper, incremental=self._incremental
+                )
         except KeyboardInterrupt:
             logging.info("KeyboardInterrupt in _parse_single_article()")
             sys.exit(1)
@@ -214,61 +364,187 @@ class Scraper:
             )
             # traceback.print_exc()
             # raise
-        return True
+        if self._jobs is not None:
+            # Done with this article, successfully or not: an article that
+            # is still unparsed will be queued again by the next run
+            try:
+                self._jobs.complete(d.url)
+            except Exception as e:
+                logging.warning(
+                    "[{2}] Unable to complete parse job for {0}: {1!r}"
+                    .format(d.url, e, d.seq)
+                )
+        return result
 
-    def go(self, reparse=False, limit=0, urls=None):
-        """ Run a scraping pass from all roots in the scraping database """
+    def go(self, reparse=False, limit=0, urls=None, incremental=False):
+        """ Run a scraping pass from all roots in the scraping database.
+            If incremental is True, reparsing only reparses the sentences
+            that may be affected by grammar changes. """
 
         version = Article.parser_version()
+        self._incremental = incremental and reparse
+        total_reused = 0
+        total_reparsed = 0
+        duplicate_reused = 0
+        duplicate_saved = 0.0
+
+        # Record the current grammar version, enabling later incremental reparses
+        with SessionContext(commit=True) as session:
+            record_grammar(session, Article.get_parser())
 
         # Go through the roots and scrape them, inserting into the articles table
         with SessionContext(commit=True) as session:
 
             if urls is None and not reparse:
 
-                def iter_roots():
-                    """ Iterate the roots to be scraped """
-                    for r in session.query(Root).filter(Root.scrape == True).all():
-                        yield r
-
-                # Use a multiprocessing pool to scrape the roots
+                # The roots and then the articles are fetched concurrently
+                # by the fetch engine, and stored as they arrive
+                engine = FetchEngine()
+
+                roots = [
+                    r
+                    for r in session.query(Root).filter(Root.scrape == True).all()
+                    if not r.domain.endswith(".local")
+                ]
+                frontier = self._frontier
+                if frontier is not None:
+                    # Only poll the roots whose time has come
+                    roots = frontier.due(roots)
+                    logging.info(
+                        "Frontier: {0} roots due, {1} not due"
+                        .format(frontier.due_roots, frontier.skipped_roots)
+                    )
+                for result in engine.fetch_all(
+                    [(r.url, r, None, self._conditional_headers(r)) for r in roots]
+                ):
+                    if result.status == NOT_MODIFIED:
+                        # Conditional GET: the root page hasn't changed
+                        logging.info("Root {0} is not modified".format(result.url))
+                        self._root_stats["not_modified"] += 1
+                        num_new = 0
+                    elif result.html is None:
+                        logging.warning(
+                            "Unable to fetch root {0}: {1}"
+                            .format(result.url, result.error)
+                        )
+                        num_new = None
+                    else:
+                        num_new = self._scrape_single_root(
+                            result.data, result.html, result.validators
+                        )
+                    if frontier is not None:
+                        try:
+                            frontier.record(result.data, num_new)
+                        except Exception as e:
+                            logging.warning(
+                                "Unable to schedule root {0}: {1!r}"
+                                .format(result.url, e)
+                            )
 
-                pool = Pool(4)
-                pool.imap_unordered(self._scrape_single_root, iter_roots())
-                pool.close()
-                pool.join()
+                rs = self._root_stats
+                logging.info(
+                    "Roots: {0} fetched, {1} not modified, {2} unchanged, {3} parsed; "
+                    "{1} fetches and {4} parses avoided; "
+                    "{5} new and {6} known child URLs"
+                    .format(
+                        rs["fetched"], rs["not_modified"], rs["unchanged"], rs["parsed"],
+                        rs["not_modified"] + rs["unchanged"],
+                        rs["new_urls"], rs["known_urls"]
+                    )
+                )
 
                 # noinspection PyComparisonWithNone
                 def iter_unscraped_articles():
                     """ Go through any unscraped articles and scrape them """
-                    # Note that the query(ArticleRow) below cannot be directly changed
-                    # to query(ArticleRow.root, ArticleRow.url) since ArticleRow.root is a joined subrecord
+                    # Only the URL and root id of each article are read; the
+                    # roots themselves are looked up in a dictionary instead
+                    # of being joined into every row
+                    roots = {r.id: r for r in session.query(Root).all()}
                     seq = 0
-                    for a in (
+                    for url, root_id in (
                         session
-                        .query(ArticleRow)
+                        .query(ArticleRow.url, ArticleRow.root_id)
                         .filter(ArticleRow.scraped == None)
                         .filter(ArticleRow.root_id != None)
                         .yield_per(100)
                     ):
-                        yield ArticleDescr(seq, a.root, a.url)
-                        seq += 1
+                        root = roots.get(root_id)
+                        if root is not None:
+                            yield ArticleDescr(seq, root, url)
+                            seq += 1
+
+                # Collect the articles to fetch, with their scrape helpers,
+                # before handing them to the fetch engine, which iterates
+                # them in a thread of its own
+                helpers = dict()
+                items = []
+                for d in iter_unscraped_articles():
+                    helper = helpers.get(d.root.id)
+                    if helper is None and d.root.id not in helpers:
+                        helper = helpers[d.root.id] = Fetcher._get_helper(d.root)
+                    if not helper or helper.skip_url(d.url):
+                        continue
+                    # Scrape helpers may have their own way of fetching documents
+                    items.append(
+                        (d.url, (d, helper), getattr(helper, "fetch_url", None), None)
+                    )
 
-                # Use a multiprocessing pool to scrape the articles
+                def iter_fetched_articles():
+                    """ Go through the fetched articles, to be scraped """
+                    for result in engine.fetch_all(items):
+                        d, _ = result.data
+                        if result.html is None:
+                            logging.warning(
+                                "[{0}] Unable to fetch article {1}: {2}"
+                                .format(d.seq, result.url, result.error)
+                            )
+                            continue
+                        yield (d, result.html)
+
+                # The fetched documents are handed to a pool of worker
+                # processes, which build the soup, extract the metadata
+                # and text and store the article, while the fetch engine,
+                # driven by the pool's feeder thread, fetches the rest.
+                if Settings.DEDUP:
+                    # Load the signatures of recent articles before forking
+                    Article.load_signatures(session)
+                # Don't let the workers inherit the pooled database connections
+                SessionContext.db.dispose()
+                ps = self._scrape_articles(iter_fetched_articles())
+                logging.info(
+                    "Scraper processes: {0} articles scraped, {1} failed "
+                    "in {2:.1f} seconds; utilization {3:.1%}"
+                    .format(ps.tasks, ps.failed, ps.elapsed, ps.utilization)
+                )
 
-                pool = Pool(8)
-                pool.imap_unordered(
-                    self._scrape_single_article, iter_unscraped_articles()
+                es = engine.stats()
+                logging.info(
+                    "Fetch engine: {0} documents fetched, {1} not modified, {2} failed, "
+                    "{3} retries, {4} politeness delays, {5:.1f} MB in {6:.1f} seconds"
+                    .format(
+                        es["fetched"], es["not_modified"], es["failed"], es["retried"],
+                        es["delayed"], es["bytes"] / (1024 * 1024), es["elapsed"]
+                    )
                 )
-                pool.close()
-                pool.join()
+                engine.close()
+
+            # The roots by id, for the article iterators below, which
+            # read only the URL and root id of each article
+            roots_by_id = {r.id: r for r in session.query(Root).all()}
+
+            # The stored size of the HTML of an article, inline or in the
+            # blob store, as an estimate of its parse cost
+            html_cost = dbfunc.coalesce(
+                dbfunc.pg_column_size(ArticleRow.html),
+                session
+                .query(dbfunc.octet_length(HtmlBlob.data))
+                .filter(HtmlBlob.hash == ArticleRow.html_hash)
+                .as_scalar(),
+            )
 
             # noinspection PyComparisonWithNone
-            def iter_unparsed_articles(reparse, limit):
-                """ Go through articles to be parsed """
-                # Fetch 100 rows at a time
-                # Note that the query(ArticleRow) below cannot be directly changed
-                # to query(ArticleRow.root, ArticleRow.url) since ArticleRow.root is a joined subrecord
+            def unparsed_query(reparse, limit):
+                """ Return a query for the articles to be parsed """
                 q = session.query(ArticleRow).filter(ArticleRow.scraped != None)
                 if reparse:
                     # Reparse articles that were originally parsed with an older
@@ -281,12 +557,64 @@ class Scraper:
                 else:
                     # Only parse articles that have no parse tree
                     q = q.filter(ArticleRow.tree == None)
-                q = q.filter(ArticleRow.root_id != None).yield_per(100)
+                q = q.filter(ArticleRow.root_id != None)
+                if Settings.DEDUP_SKIP:
+                    # Near-duplicates of other articles are not parsed
+                    q = q.filter(ArticleRow.duplicate_of == None)
                 if limit > 0:
                     # Impose a limit on the query, if given
                     q = q.limit(limit)
-                for seq, a in enumerate(q):
-                    yield ArticleDescr(seq, a.root, a.url)
+                return q
+
+            def iter_unparsed_articles(reparse, limit):
+                """ Go through articles to be parsed """
+                q = unparsed_query(reparse, limit)
+                # Dispatch the most expensive articles first, so that the
+                # huge ones don't end up alone at the tail of the run.
+                # The parse cost is estimated from the stored size of
+                # the HTML, which is obtained without reading it.
+                selected = q.with_entities(ArticleRow.url).subquery()
+                cost = html_cost
+                # Fetch 100 rows at a time
+                q = (
+                    session
+                    .query(ArticleRow.url, ArticleRow.root_id, cost)
+                    .join(selected, ArticleRow.url == selected.c.url)
+                    .order_by(desc(cost))
+                    .yield_per(100)
+                )
+                seq = 0
+                for url, root_id, a_cost in q:
+                    root = roots_by_id.get(root_id)
+                    if root is not None:
+                        yield ArticleDescr(seq, root, url, a_cost or 0)
+                        seq += 1
+
+            def iter_claimed_articles(reparse, limit):
+                """ Put the articles to be parsed into the shared job queue,
+                    and go through the articles claimed from it, which may
+                    also have been put there by other hosts. The queue
+                    hands out the most expensive articles first. """
+                self._jobs.enqueue(
+                    (url, a_cost or 0)
+                    for url, a_cost in unparsed_query(reparse, limit)
+                    .with_entities(ArticleRow.url, html_cost)
+                )
+                seq = 0
+                for batch in self._jobs.batches():
+                    root_ids = dict(
+                        session
+                        .query(ArticleRow.url, ArticleRow.root_id)
+                        .filter(ArticleRow.url.in_([url for url, _ in batch]))
+                    )
+                    for url, a_cost in batch:
+                        root = roots_by_id.get(root_ids.get(url))
+                        if root is None:
+                            # The article or its root no longer exists
+                            self._jobs.complete(url)
+                            continue
+                        yield ArticleDescr(seq, root, url, a_cost)
+                        seq += 1
 
             def iter_urls(urls):
                 """ Iterate through the text file whose name is given in urls """
@@ -295,64 +623,108 @@ class Scraper:
                     for url in f:
                         url = url.strip()
                         if url:
-                            a = (
+                            r = (
                                 session
-                                .query(ArticleRow)
+                                .query(ArticleRow.root_id, html_cost)
                                 .filter(ArticleRow.url == url)
                                 .one_or_none()
                             )
-                            if a is not None:
-                                # Found the article: yield it
-                                yield ArticleDescr(seq, a.root, a.url)
-                                seq += 1
-
-            # Use a multiprocessing pool to parse the articles.
-            # Let the pool work on chunks of articles, recycling the
-            # processes after each chunk to contain memory creep.
-
-            CPU_COUNT = cpu_count()
-            # Distribute the load between the CPUs, although never exceeding
-            # 100 articles per CPU per process cycle
-            if limit > 0:
-                CHUNK_SIZE = min(100 * CPU_COUNT, limit)
+                            if r is not None:
+                                root_id, a_cost = r
+                                root = roots_by_id.get(root_id)
+                                if root is not None:
+                                    # Found the article: yield it
+                                    yield ArticleDescr(seq, root, url, a_cost or 0)
+                                    seq += 1
+
+            # Use a long-lived pool of worker processes to parse the articles,
+            # feeding it from a bounded queue. The workers are recycled after
+            # a number of articles, or when they grow too large, to contain
+            # memory creep.
+
+            if urls is not None:
+                g = iter_urls(urls)
+            elif Settings.JOB_QUEUE:
+                self._jobs = JobQueue("parse")
+                g = iter_claimed_articles(reparse, limit)
             else:
-                CHUNK_SIZE = 100 * CPU_COUNT
-            if urls is None:
                 g = iter_unparsed_articles(reparse, limit)
-            else:
-                g = iter_urls(urls)
-                limit = 0
+
+            # Load the grammar and lexicon before forking the workers, so that
+            # they share them with this process, and run garbage collection
+            # to minimize the common memory footprint
+            preload()
+            log_memory_usage("Scraper process")
+            # Defaults to using as many processes as there are CPUs
+            pool = WorkerPool(
+                self._parse_single_article,
+                processes=cpu_count(),
+                initializer=_init_parse_worker,
+                maxtasks=Settings.PARSE_WORKER_TASKS,
+                max_rss=Settings.PARSE_WORKER_RSS,
+                cost=lambda d: d.cost,
+                max_cost=(
+                    Settings.PARSE_MAX_COST * 1024 if Settings.PARSE_MAX_COST else None
+                ),
+            )
             cnt = 0
-            while True:
-                adlist = []
-                lcnt = 0
-                for ad in g:
-                    adlist.append(ad)
-                    lcnt += 1
-                    if lcnt == CHUNK_SIZE or (0 < limit <= cnt + lcnt):
-                        break
-                if lcnt:
-                    # Run garbage collection to minimize common memory footprint
-                    gc.collect()
-                    logging.info(
-                        "Parser processes forking, chunk of {0} articles"
-                        .format(lcnt)
+            try:
+                for result in pool.imap_unordered(g):
+                    cnt += 1
+                    if result is not None:
+                        total_reused += result[0]
+                        total_reparsed += result[1]
+                        duplicate_reused += result[2]
+                        duplicate_saved += result[3]
+                    if cnt % PROGRESS_INTERVAL == 0:
+                        logging.info("Parser processes: {0} articles parsed".format(cnt))
+            except Exception as e:
+                logging.warning("Caught exception: {0}".format(e))
+            finally:
+                if self._jobs is not None:
+                    # Release the articles that were claimed but not parsed
+                    self._jobs.close()
+            ps = pool.stats()
+            logging.info(
+                "Parser processes: {0} articles parsed, {1} failed in {2:.1f} seconds; "
+                "{3} workers recycled, {4} died; utilization {5:.1%}"
+                .format(
+                    ps.tasks, ps.failed, ps.elapsed, ps.recycled, ps.crashed, ps.utilization
+                )
+            )
+            if self._jobs is not None:
+                queued, claimed, failed = self._jobs.counts()
+                logging.info(
+                    "Parse job queue: {0} articles claimed by this host; "
+                    "{1} queued, {2} claimed by other hosts, {3} failed"
+                    .format(self._jobs.claimed, queued, claimed, failed)
+                )
+                self._jobs = None
+            if Settings.DEDUP:
+                if Settings.DEDUP_SKIP:
+                    # Estimate the time saved from the average time per article
+                    duplicate_saved = (
+                        self._duplicates * ps.busy / ps.tasks if ps.tasks else 0.0
                     )
-                    # Defaults to using as many processes as there are CPUs
-                    pool = Pool()
-                    try:
-                        pool.imap_unordered(self._parse_single_article, adlist)
-                    except Exception as e:
-                        logging.warning("Caught exception: {0}".format(e))
-                    pool.close()
-                    pool.join()
-                    cnt += lcnt
-                    logging.info(
-                        "Parser processes joined, chunk of {0} articles parsed, total {1}"
-                        .format(lcnt, cnt)
+                logging.info(
+                    "Near-duplicates: {0} scraped articles were near-duplicates, "
+                    "{1}; saving an estimated {2:.1f} seconds of parsing"
+                    .format(
+                        self._duplicates,
+                        "skipped by the parser"
+                        if Settings.DEDUP_SKIP
+                        else "{0} sentences reused".format(duplicate_reused),
+                        duplicate_saved,
                     )
-                if lcnt < CHUNK_SIZE:
-                    break
+                )
+
+        if self._incremental:
+            total = total_reused + total_reparsed
+            logging.info(
+                "Incremental reparse: {0} of {1} sentences reused, "
+                "saving {2:.1f}% of the parsing work"
+                .format(total_reused, total, 100.0 * total_reused / total if total else 0.0)
+            )
 
     @staticmethod
     def stats():
@@ -360,56 +732,46 @@ class Scraper:
 
         db = SessionContext.db
 
-        q = "select count(*) from articles;"
-
-        result = db.execute(q).fetchall()[0]
-
-        num_articles = result[0]
-
-        q = "select count(*) from articles where scraped is not null;"
-
-        result = db.execute(q).fetchall()[0]
-
-        num_scraped = result[0]
-
-        q = "select count(*) from articles where tree is not null;"
-
-        result = db.execute(q).fetchall()[0]
-
-        num_parsed = result[0]
-
-        q = "select count(*) from articles where tree is not null and num_sentences > 1;"
+        # Read the totals from the per-root, per-day statistics counters
+        # (see RootStats in scraperdb.py) instead of scanning the articles
+        q = (
+            "select sum(articles), sum(scraped), sum(parsed), sum(parsed_multi), "
+            "sum(multi_sentences), sum(multi_sent_parsed) from rootstats;"
+        )
 
         result = db.execute(q).fetchall()[0]
 
-        num_parsed_over_1 = result[0]
+        # Result of query can be None
+        num_articles, num_scraped, num_parsed, num_parsed_over_1 = (
+            r or 0 for r in result[0:4]
+        )
 
         logging.info(
             "Num_articles is {0}, scraped {1}, parsed {2}, parsed with >1 sentence {3}"
             .format(num_articles, num_scraped, num_parsed, num_parsed_over_1)
         )
 
-        q = (
-            "select sum(num_sentences) as sent, sum(num_parsed) as parsed "
-            "from articles where tree is not null and num_sentences > 1;"
-        )
-
-        result = db.execute(q).fetchall()[0]
-
-        num_sentences = result[0] or 0  # Result of query can be None
-        num_sent_parsed = result[1] or 0
+        num_sentences = result[4] or 0
+        num_sent_parsed = result[5] or 0
 
         logging.info(
             "Num_sentences is {0}, num_sent_parsed is {1}, ratio is {2:.1f}%"
-            .format(num_sentences, num_sent_parsed, 100.0 * num_sent_parsed / num_sentences)
+            .format(
+                num_sentences,
+                num_sent_parsed,
+                100.0 * num_sent_parsed / num_sentences if num_sentences else 0.0,
+            )
         )
 
 
-def scrape_articles(reparse=False, limit=0, urls=None):
+def scrape_articles(reparse=False, limit=0, urls=None, incremental=False):
 
     logging.info("------ Reynir starting scrape -------")
     if urls is None:
-        logging.info("Limit: {0}, reparse: {1}".format(limit, reparse))
+        logging.info(
+            "Limit: {0}, reparse: {1}, incremental: {2}"
+            .format(limit, reparse, incremental)
+        )
     else:
         logging.info("URLs read from: {0}".format(urls))
     t0 = time.time()
@@ -417,7 +779,7 @@ def scrape_articles(reparse=False, limit=0, urls=None):
     try:
         sc = Scraper()
         try:
-            sc.go(reparse=reparse, limit=limit, urls=urls)
+            sc.go(reparse=reparse, limit=limit, urls=urls, incremental=incremental)
             # Successful finish: print stats
             sc.stats()
         except KeyboardInterrupt:
@@ -450,8 +812,12 @@ __doc__ = """
         -h, --help: Show this help text
         -i, --init: Initialize the scraper database, if required
         -r, --reparse: Reparse the oldest previously parsed articles
+        -n, --incremental: When reparsing, only reparse sentences that
+            failed or that may be affected by grammar changes
         -u filename, --urls=filename: Reparse the URLs listed in the given file
         -l N, --limit=N: Limit parsing session to N articles (default 10)
+        -s, --rebuild-stats: Recount the statistics counters of the roots
+            from the articles, in case they have drifted
 
     If --reparse is not specified, the scraper will read all previously
     unseen articles from the root domains and then proceed to parse any
@@ -473,7 +839,17 @@ def main(argv=None):
     try:
         try:
             opts, args = getopt.getopt(
-                argv[1:], "hirl:u:", ["help", "init", "reparse", "limit=", "urls="]
+                argv[1:],
+                "hirnl:u:s",
+                [
+                    "help",
+                    "init",
+                    "reparse",
+                    "incremental",
+                    "limit=",
+                    "urls=",
+                    "rebuild-stats",
+                ],
             )
         except getopt.error as msg:
             raise Usage(msg)
@@ -481,7 +857,9 @@ def main(argv=None):
         # !!! DEBUG default limit on number of articles to parse, unless otherwise specified
         limit = 10
         reparse = False
+        incremental = False
         urls = None
+        rebuild_stats = False
 
         # Process options
         for o, a in opts:
@@ -492,6 +870,8 @@ def main(argv=None):
                 init = True
             elif o in ("-r", "--reparse"):
                 reparse = True
+            elif o in ("-n", "--incremental"):
+                incremental = True
             elif o in ("-l", "--limit"):
                 # Maximum number of articles to parse
                 try:
@@ -500,6 +880,8 @@ def main(argv=None):
                     pass
             elif o in ("-u", "--urls"):
                 urls = a  # Text file with list of URLs
+            elif o in ("-s", "--rebuild-stats"):
+                rebuild_stats = True
 
         # Process arguments
         for _ in args:
@@ -522,9 +904,16 @@ def main(argv=None):
         if init:
             # Initialize the scraper database
             init_roots()
+        elif rebuild_stats:
+            # Recount the statistics counters
+            with SessionContext(commit=True) as session:
+                RootStats.rebuild(session)
+            Scraper.stats()
         else:
             # Run the scraper
-            scrape_articles(reparse=reparse, limit=limit, urls=urls)
+            scrape_articles(
+                reparse=reparse, limit=limit, urls=urls, incremental=incremental
+            )
 
     except Usage as err:
         print(err.msg, file=sys.stderr)
@@ -32,24 +32,34 @@ from time import sleep
 from sqlalchemy import create_engine, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship, backref
+from sqlalchemy.pool import NullPool
 from sqlalchemy import (
     Table,
     Column,
     Integer,
+    BigInteger,
     String,
+    LargeBinary,
     Float,
     DateTime,
+    Date,
     Sequence,
     Boolean,
     UniqueConstraint,
     ForeignKey,
     PrimaryKeyConstraint,
+    Index,
 )
-from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.dialects.postgresql import JSONB, ARRAY
 from sqlalchemy.exc import SQLAlchemyError as SqlError
 from sqlalchemy.exc import IntegrityError as SqlIntegrityError
 from sqlalchemy.exc import DataError as SqlDataError
 from sqlalchemy import desc as SqlDesc
+from sqlalchemy import or_ as SqlOr
+from sqlalchemy import tuple_ as SqlTuple
+from sqlalchemy.orm import defer as SqlDefer
+from sqlalchemy.orm import undefer_group as SqlUndeferGroup
+from sqlalchemy.orm import deferred
 from sqlalchemy.dialects.postgresql import UUID as psql_UUID
 from settings import Settings
 from sqlalchemy import func as dbfunc
@@ -62,16 +72,22 @@ Base = declarative_base()
 IntegrityError = SqlIntegrityError
 DatabaseError = SqlError
 DataError = SqlDataError
-# Same for the desc() function
+# Same for the desc(), or_(), tuple_(), defer() and undefer_group() functions
 desc = SqlDesc
+or_ = SqlOr
+tuple_ = SqlTuple
+defer = SqlDefer
+undefer_group = SqlUndeferGroup
 
 
 class Scraper_DB:
     """ Wrapper around the SQLAlchemy connection, engine and session """
 
-    def __init__(self):
+    def __init__(self, pooled=True):
 
-        """ Initialize the SQLAlchemy connection with the scraper database """
+        """ Initialize the SQLAlchemy connection with the scraper database.
+            If pooled is False, connections are not kept open between uses,
+            so that none are inherited by forked processes. """
 
         # Assemble the right connection string for CPython/psycopg2 vs.
         # PyPy/psycopg2cffi, respectively
@@ -82,13 +98,55 @@ class Scraper_DB:
             Settings.DB_HOSTNAME,
             Settings.DB_PORT,
         )
-        self._engine = create_engine(conn_str)
+        if pooled:
+            self._engine = create_engine(conn_str)
+        else:
+            self._engine = create_engine(conn_str, poolclass=NullPool)
         # Create a Session class bound to this engine
         self._Session = sessionmaker(bind=self._engine)
 
+    # Columns that have been added to existing tables, which
+    # create_all() does not add: (table name, column definition)
+    _ADDED_COLUMNS = (
+        ("articles", "tree_bin bytea"),
+        ("articles", "tokens_bin bytea"),
+        ("roots", "etag varchar"),
+        ("roots", "last_modified varchar"),
+        ("roots", "content_hash varchar(64)"),
+        ("articles", "simhash bigint"),
+        ("articles", "duplicate_of varchar"),
+        ("articles", "content_text varchar"),
+        ("articles", "content_key varchar"),
+        ("articles", "html_hash varchar(64)"),
+        ("roots", "new_rate double precision"),
+        ("roots", "poll_interval double precision"),
+        ("roots", "next_poll timestamp"),
+    )
+
     def create_tables(self):
-        """ Create all missing tables in the database """
+        """ Create all missing tables and columns in the database,
+            and (re)install the triggers that maintain the statistics
+            counters, filling the counters if they are empty """
         Base.metadata.create_all(self._engine)
+        for table, column in self._ADDED_COLUMNS:
+            self._engine.execute(
+                "ALTER TABLE {0} ADD COLUMN IF NOT EXISTS {1};".format(table, column)
+            )
+        with self._engine.begin() as conn:
+            for ddl in RootStats.TRIGGERS:
+                conn.execute(ddl)
+        session = self.session
+        try:
+            if session.query(RootStats.root_id).first() is None:
+                RootStats.rebuild(session)
+            session.commit()
+        finally:
+            session.close()
+
+    def dispose(self):
+        """ Close the pooled connections of the engine, e.g. before
+            forking worker processes """
+        self._engine.dispose()
 
     def execute(self, sql, **kwargs):
         """ Execute raw SQL directly on the engine """
@@ -191,6 +249,20 @@ class Root(Base):
     # Should articles of this root be scraped automatically?
     scrape = Column(Boolean, default=True)
 
+    # Validators of the root page as last fetched, for conditional GETs:
+    # the ETag and Last-Modified response headers, if any
+    etag = Column(String)
+    last_modified = Column(String)
+    # SHA-256 hash (in hex) of the root page as last scraped
+    content_hash = Column(String(64))
+
+    # Adaptive polling of this root (see frontier.py): estimated number
+    # of new articles per hour, time between polls in seconds, and time
+    # of the next poll. The time of the last poll is in scraped.
+    new_rate = Column(Float)
+    poll_interval = Column(Float)
+    next_poll = Column(DateTime)
+
     # The combination of domain + url must be unique
     __table_args__ = (UniqueConstraint("domain", "url"),)
 
@@ -254,14 +326,38 @@ class Article(Base):
     num_parsed = Column(Integer)
     ambiguity = Column(Float)
 
-    # The HTML obtained in the last scrape
-    html = Column(String)
+    # The large columns below are deferred, i.e. not loaded with the rest
+    # of the row, but loaded a group at a time when first accessed, so
+    # that queries for article metadata don't read them. Queries that
+    # need them undefer their group (e.g. .options(undefer_group("tree"))).
+
+    # The HTML obtained in the last scrape, unless it is kept in the
+    # htmlblobs table, in which case html_hash is its key there
+    html = deferred(Column(String), group="content")
+    html_hash = Column(String(64))
     # The parse tree obtained in the last parse
-    tree = Column(String)
+    tree = deferred(Column(String), group="tree")
+    # The same parse tree in binary format (see bintree.py), for fast loading
+    tree_bin = deferred(Column(LargeBinary), group="tree")
     # The tokens of the article in JSON string format
-    tokens = Column(String)
+    # (only for articles parsed before tokens_bin was introduced)
+    tokens = deferred(Column(String), group="tokens")
+    # The tokens of the article in compact, sentence-indexed format
+    # (see bintokens.py)
+    tokens_bin = deferred(Column(LargeBinary), group="tokens")
     # The article topic vector as an array of floats in JSON string format
-    topic_vector = Column(String)
+    topic_vector = deferred(Column(String), group="topic")
+
+    # SimHash signature of the article text (see dedup.py)
+    simhash = Column(BigInteger)
+    # The URL of the earlier article of which this one is a near-duplicate
+    duplicate_of = Column(String)
+
+    # The text content of the article, with paragraph markers, as extracted
+    # from the HTML by a scrape helper, identified by its module, class and
+    # version, and the extraction path, in content_key (see Fetcher.helper_key())
+    content_text = deferred(Column(String), group="content")
+    content_key = Column(String)
 
     # The back-reference to the Root parent of this Article
     root = relationship(
@@ -275,6 +371,293 @@ class Article(Base):
             self.url, self.heading, self.scraped
         )
 
+    # Insert the child URLs of a root as unscraped articles in a single
+    # statement, skipping the URLs that are already known. Returns the
+    # URLs that were actually inserted.
+    _Q_INSERT_URLS = """
+        insert into articles (url, root_id)
+            select url, cast(:root_id as integer)
+                from unnest(cast(:urls as varchar[])) as u (url)
+            on conflict (url) do nothing
+            returning url;
+        """
+
+    @staticmethod
+    def insert_urls(session, root_id, urls):
+        """ Insert article URLs of a root, ignoring those that already exist,
+            in one round trip. Returns a list of the new URLs. """
+        if not urls:
+            return []
+        return [
+            r.url
+            for r in session.execute(
+                Article._Q_INSERT_URLS, dict(root_id=root_id, urls=list(set(urls)))
+            )
+        ]
+
+
+class RootStats(Base):
+    """ Represents the statistics counters of the articles of a root
+        that have a given date. The counters are maintained by triggers
+        on the articles and persons tables, so that statistics can be
+        obtained without scanning those tables. """
+
+    __tablename__ = "rootstats"
+
+    # The root of the articles, or 0 for articles without a root
+    # (not a foreign key, because of the 0)
+    root_id = Column(Integer, primary_key=True)
+    # The date of the articles' time stamps, or 1970-01-01
+    # for articles without a time stamp
+    day = Column(Date, primary_key=True)
+
+    # Number of articles, scraped articles and parsed articles
+    articles = Column(Integer, nullable=False, server_default=text("0"))
+    scraped = Column(Integer, nullable=False, server_default=text("0"))
+    parsed = Column(Integer, nullable=False, server_default=text("0"))
+    # Sum of num_sentences and num_parsed over the articles
+    sentences = Column(Integer, nullable=False, server_default=text("0"))
+    sent_parsed = Column(Integer, nullable=False, server_default=text("0"))
+    # The same for the parsed articles that have more than one sentence
+    parsed_multi = Column(Integer, nullable=False, server_default=text("0"))
+    multi_sentences = Column(Integer, nullable=False, server_default=text("0"))
+    multi_sent_parsed = Column(Integer, nullable=False, server_default=text("0"))
+    # Number of persons in the articles, in total and by gender
+    persons = Column(Integer, nullable=False, server_default=text("0"))
+    kk = Column(Integer, nullable=False, server_default=text("0"))
+    kvk = Column(Integer, nullable=False, server_default=text("0"))
+    hk = Column(Integer, nullable=False, server_default=text("0"))
+
+    def __repr__(self):
+        return "RootStats(root_id={0}, day='{1}', articles={2})".format(
+            self.root_id, self.day, self.articles
+        )
+
+    @classmethod
+    def table(cls):
+        return cls.__table__
+
+    # The functions and triggers that maintain the counters, installed by
+    # Scraper_DB.create_tables(). The persons of an article are subtracted
+    # when the article is deleted (before the foreign key sets their
+    # article_url to null), and moved when the root or date of the article
+    # changes. Persons that are moved between articles are not tracked;
+    # rebuild() recounts everything from scratch.
+    TRIGGERS = (
+        """
+        create or replace function rootstats_articles(
+            p_root integer, p_ts timestamp, p_count integer, p_scraped boolean,
+            p_parsed boolean, p_sent integer, p_sent_parsed integer
+        ) returns void as $$
+        declare
+            multi boolean := p_parsed and coalesce(p_sent, 0) > 1;
+        begin
+            insert into rootstats as s (
+                root_id, day, articles, scraped, parsed, sentences, sent_parsed,
+                parsed_multi, multi_sentences, multi_sent_parsed
+            ) values (
+                coalesce(p_root, 0),
+                coalesce(cast(p_ts as date), date '1970-01-01'),
+                p_count,
+                case when p_scraped then p_count else 0 end,
+                case when p_parsed then p_count else 0 end,
+                p_count * coalesce(p_sent, 0),
+                p_count * coalesce(p_sent_parsed, 0),
+                case when multi then p_count else 0 end,
+                case when multi then p_count * p_sent else 0 end,
+                case when multi then p_count * coalesce(p_sent_parsed, 0) else 0 end
+            )
+            on conflict (root_id, day) do update set
+                articles = s.articles + excluded.articles,
+                scraped = s.scraped + excluded.scraped,
+                parsed = s.parsed + excluded.parsed,
+                sentences = s.sentences + excluded.sentences,
+                sent_parsed = s.sent_parsed + excluded.sent_parsed,
+                parsed_multi = s.parsed_multi + excluded.parsed_multi,
+                multi_sentences = s.multi_sentences + excluded.multi_sentences,
+                multi_sent_parsed = s.multi_sent_parsed + excluded.multi_sent_parsed;
+        end;
+        $$ language plpgsql;
+        """,
+        """
+        create or replace function rootstats_persons(
+            p_root integer, p_ts timestamp, p_gender varchar, p_count integer
+        ) returns void as $$
+        begin
+            insert into rootstats as s (root_id, day, persons, kk, kvk, hk)
+            values (
+                coalesce(p_root, 0),
+                coalesce(cast(p_ts as date), date '1970-01-01'),
+                p_count,
+                case when p_gender = 'kk' then p_count else 0 end,
+                case when p_gender = 'kvk' then p_count else 0 end,
+                case when p_gender = 'hk' then p_count else 0 end
+            )
+            on conflict (root_id, day) do update set
+                persons = s.persons + excluded.persons,
+                kk = s.kk + excluded.kk,
+                kvk = s.kvk + excluded.kvk,
+                hk = s.hk + excluded.hk;
+        end;
+        $$ language plpgsql;
+        """,
+        """
+        create or replace function rootstats_article_trigger() returns trigger as $$
+        declare
+            g record;
+        begin
+            if tg_op = 'DELETE' then
+                perform rootstats_articles(
+                    old.root_id, old.timestamp, -1, old.scraped is not null,
+                    old.tree is not null, old.num_sentences, old.num_parsed
+                );
+                for g in
+                    select gender, count(*) as cnt from persons
+                        where article_url = old.url group by gender
+                loop
+                    perform rootstats_persons(
+                        old.root_id, old.timestamp, g.gender, -cast(g.cnt as integer)
+                    );
+                end loop;
+                return old;
+            end if;
+            if tg_op = 'UPDATE' then
+                if (
+                    old.root_id, old.timestamp, old.scraped is null, old.tree is null,
+                    old.num_sentences, old.num_parsed
+                ) is not distinct from (
+                    new.root_id, new.timestamp, new.scraped is null, new.tree is null,
+                    new.num_sentences, new.num_parsed
+                ) then
+                    return null;
+                end if;
+                perform rootstats_articles(
+                    old.root_id, old.timestamp, -1, old.scraped is not null,
+                    old.tree is not null, old.num_sentences, old.num_parsed
+                );
+                if (old.root_id, cast(old.timestamp as date))
+                    is distinct from (new.root_id, cast(new.timestamp as date))
+                then
+                    for g in
+                        select gender, count(*) as cnt from persons
+                            where article_url = new.url group by gender
+                    loop
+                        perform rootstats_persons(
+                            old.root_id, old.timestamp, g.gender, -cast(g.cnt as integer)
+                        );
+                        perform rootstats_persons(
+                            new.root_id, new.timestamp, g.gender, cast(g.cnt as integer)
+                        );
+                    end loop;
+                end if;
+            end if;
+            perform rootstats_articles(
+                new.root_id, new.timestamp, 1, new.scraped is not null,
+                new.tree is not null, new.num_sentences, new.num_parsed
+            );
+            return null;
+        end;
+        $$ language plpgsql;
+        """,
+        """
+        create or replace function rootstats_person_trigger() returns trigger as $$
+        declare
+            a record;
+        begin
+            if tg_op <> 'INSERT' then
+                select art.root_id, art.timestamp into a
+                    from articles as art where art.url = old.article_url;
+                if found then
+                    perform rootstats_persons(a.root_id, a.timestamp, old.gender, -1);
+                end if;
+            end if;
+            if tg_op <> 'DELETE' then
+                select art.root_id, art.timestamp into a
+                    from articles as art where art.url = new.article_url;
+                if found then
+                    perform rootstats_persons(a.root_id, a.timestamp, new.gender, 1);
+                end if;
+            end if;
+            return null;
+        end;
+        $$ language plpgsql;
+        """,
+        "drop trigger if exists rootstats_articles_delete on articles;",
+        """
+        create trigger rootstats_articles_delete
+            before delete on articles
+            for each row execute procedure rootstats_article_trigger();
+        """,
+        "drop trigger if exists rootstats_articles_change on articles;",
+        """
+        create trigger rootstats_articles_change
+            after insert or update of root_id, timestamp, scraped, tree, num_sentences, num_parsed
+            on articles
+            for each row execute procedure rootstats_article_trigger();
+        """,
+        "drop trigger if exists rootstats_persons_change on persons;",
+        """
+        create trigger rootstats_persons_change
+            after insert or delete or update of gender on persons
+            for each row execute procedure rootstats_person_trigger();
+        """,
+    )
+
+    _Q_LOCK = """
+        lock table articles, persons in share mode;
+        """
+
+    _Q_DELETE = """
+        delete from rootstats;
+        """
+
+    _Q_COUNT_ARTICLES = """
+        insert into rootstats (
+            root_id, day, articles, scraped, parsed, sentences, sent_parsed,
+            parsed_multi, multi_sentences, multi_sent_parsed
+        )
+        select coalesce(a.root_id, 0) as rid,
+            coalesce(cast(a.timestamp as date), date '1970-01-01') as d,
+            count(*),
+            sum(case when a.scraped is not null then 1 else 0 end),
+            sum(case when a.tree is not null then 1 else 0 end),
+            coalesce(sum(a.num_sentences), 0),
+            coalesce(sum(a.num_parsed), 0),
+            sum(case when a.tree is not null and a.num_sentences > 1 then 1 else 0 end),
+            sum(case when a.tree is not null and a.num_sentences > 1
+                then a.num_sentences else 0 end),
+            sum(case when a.tree is not null and a.num_sentences > 1
+                then coalesce(a.num_parsed, 0) else 0 end)
+            from articles as a
+            group by rid, d;
+        """
+
+    _Q_COUNT_PERSONS = """
+        insert into rootstats as s (root_id, day, persons, kk, kvk, hk)
+        select coalesce(a.root_id, 0) as rid,
+            coalesce(cast(a.timestamp as date), date '1970-01-01') as d,
+            count(*),
+            sum(case when p.gender = 'kk' then 1 else 0 end),
+            sum(case when p.gender = 'kvk' then 1 else 0 end),
+            sum(case when p.gender = 'hk' then 1 else 0 end)
+            from persons as p, articles as a
+            where p.article_url = a.url
+            group by rid, d
+        on conflict (root_id, day) do update set
+            persons = excluded.persons,
+            kk = excluded.kk,
+            kvk = excluded.kvk,
+            hk = excluded.hk;
+        """
+
+    @classmethod
+    def rebuild(cls, session):
+        """ Recount all statistics counters from the articles and persons
+            tables. This scans both tables and blocks writes to them
+            until the enclosing transaction is committed. """
+        for q in (cls._Q_LOCK, cls._Q_DELETE, cls._Q_COUNT_ARTICLES, cls._Q_COUNT_PERSONS):
+            session.execute(q)
+
 
 class Person(Base):
     """ Represents a person """
@@ -457,6 +840,59 @@ class Word(Base):
         PrimaryKeyConstraint("article_id", "stem", "cat", name="words_pkey"),
     )
 
+    # Replace the word stems of a set of articles with new ones, in a
+    # single statement. Stems that no longer occur in an article are deleted,
+    # new stems are inserted, and existing stems are only updated if their
+    # count has changed. The new stems are passed as parallel arrays.
+    _Q_REPLACE = """
+        with new (article_id, stem, cat, cnt) as (
+            select * from unnest(
+                cast(:ids as uuid[]),
+                cast(:stems as varchar[]),
+                cast(:cats as varchar[]),
+                cast(:cnts as integer[])
+            )
+        ),
+        deleted as (
+            delete from words w
+                where w.article_id = any(cast(:articles as uuid[]))
+                and not exists (
+                    select 1 from new n
+                        where n.article_id = w.article_id
+                        and n.stem = w.stem and n.cat = w.cat
+                )
+        )
+        insert into words as w (article_id, stem, cat, cnt)
+            select article_id, stem, cat, cnt from new
+            on conflict (article_id, stem, cat)
+            do update set cnt = excluded.cnt where w.cnt <> excluded.cnt;
+        """
+
+    @staticmethod
+    def replace(session, article_words):
+        """ Replace the stored word stems of one or more articles in one
+            round trip. article_words is a dict of article ids, each mapping
+            to a list of (stem, cat, cnt) tuples. """
+        if not article_words:
+            return
+        ids, stems, cats, cnts = [], [], [], []
+        for article_id, words in article_words.items():
+            for stem, cat, cnt in words:
+                ids.append(article_id)
+                stems.append(stem)
+                cats.append(cat)
+                cnts.append(cnt)
+        session.execute(
+            Word._Q_REPLACE,
+            dict(
+                ids=ids,
+                stems=stems,
+                cats=cats,
+                cnts=cnts,
+                articles=list(article_words.keys()),
+            ),
+        )
+
     def __repr__(self):
         return "Word(stem='{0}', cat='{1}', cnt='{2}')".format(
             self.stem, self.cat, self.cnt
@@ -467,6 +903,112 @@ class Word(Base):
         return cls.__table__
 
 
+class TreeSymbol(Base):
+    """ Represents a symbol (nonterminal, terminal category or lemma)
+        occurring in the simplified sentence trees of an article,
+        along with the indices of the sentences where it occurs
+        (see treeindex.py) """
+
+    __tablename__ = "treesymbols"
+
+    MAX_SYMBOL_LEN = 64
+
+    # Foreign key to an article
+    article_id = Column(
+        psql_UUID(as_uuid=False),
+        ForeignKey("articles.id", onupdate="CASCADE", ondelete="CASCADE"),
+        nullable=False,
+    )
+
+    # The symbol, e.g. 'N:NP', 'T:so' or 'L:hestur'
+    symbol = Column(String(MAX_SYMBOL_LEN), index=True, nullable=False)
+
+    # The 1-based indices of the sentences containing the symbol
+    sentences = Column(ARRAY(Integer), nullable=False)
+
+    __table_args__ = (
+        PrimaryKeyConstraint("article_id", "symbol", name="treesymbols_pkey"),
+    )
+
+    # Replace the symbols of a set of articles with new ones, in a single
+    # statement, in the same manner as Word.replace(). The sentence index
+    # lists are passed as comma-separated strings, since Postgres arrays
+    # must be rectangular.
+    _Q_REPLACE = """
+        with new (article_id, symbol, sentences) as (
+            select a, s, cast(string_to_array(x, ',') as integer[]) from unnest(
+                cast(:ids as uuid[]),
+                cast(:symbols as varchar[]),
+                cast(:sentences as varchar[])
+            ) as t (a, s, x)
+        ),
+        deleted as (
+            delete from treesymbols ts
+                where ts.article_id = any(cast(:articles as uuid[]))
+                and not exists (
+                    select 1 from new n
+                        where n.article_id = ts.article_id
+                        and n.symbol = ts.symbol
+                )
+        )
+        insert into treesymbols as ts (article_id, symbol, sentences)
+            select article_id, symbol, sentences from new
+            on conflict (article_id, symbol)
+            do update set sentences = excluded.sentences
+                where ts.sentences <> excluded.sentences;
+        """
+
+    @staticmethod
+    def replace(session, article_symbols):
+        """ Replace the stored symbols of one or more articles in one
+            round trip. article_symbols is a dict of article ids, each mapping
+            to a dict of symbols and lists of sentence indices. """
+        if not article_symbols:
+            return
+        ids, symbols, sentences = [], [], []
+        for article_id, syms in article_symbols.items():
+            for sym, ixs in syms.items():
+                ids.append(article_id)
+                symbols.append(sym)
+                sentences.append(",".join(str(ix) for ix in ixs))
+        session.execute(
+            TreeSymbol._Q_REPLACE,
+            dict(
+                ids=ids,
+                symbols=symbols,
+                sentences=sentences,
+                articles=list(article_symbols.keys()),
+            ),
+        )
+
+    @staticmethod
+    def lookup(session, article_ids, symbols):
+        """ Return a dict of article ids, each mapping to a dict of the given
+            symbols (that occur in the article) and their sentence indices """
+        result = dict()
+        if not article_ids:
+            return result
+        q = (
+            session.query(
+                TreeSymbol.article_id, TreeSymbol.symbol, TreeSymbol.sentences
+            )
+            .filter(TreeSymbol.article_id.in_(article_ids))
+            .filter(TreeSymbol.symbol.in_(symbols))
+        )
+        for article_id, symbol, sentences in q:
+            result.setdefault(article_id, dict())[symbol] = sentences
+        return result
+
+    def __repr__(self):
+        return "TreeSymbol(symbol='{0}', sentences={1})".format(
+            self.symbol, self.sentences
+        )
+
+    @classmethod
+    def table(cls):
+        return cls.__table__
+
+
 class Topic(Base):
     """ Represents a topic for an article """
 
@@ -655,6 +1197,358 @@ class BlacklistedLink(Base):
         return cls.__table__
 
 
+class CachedSentence(Base):
+    """ Represents the cached parse result of a sentence,
+        shared between parser processes (see parsecache.py) """
+
+    __tablename__ = "sentcache"
+
+    # Key: hash of the sentence tokens and the parser version
+    key = Column(String(40), primary_key=True)
+
+    # The parser version that produced this result
+    version = Column(String(64), nullable=False)
+
+    # The parse result, compressed
+    data = Column(LargeBinary, nullable=False)
+
+    # Number of cache hits for this entry
+    hits = Column(Integer, nullable=False, default=0)
+
+    # Timestamp of the last store or hit of this entry, used for eviction
+    timestamp = Column(DateTime, nullable=False, index=True)
+
+    # Insert a new entry, unless another process got there first
+    _Q_INSERT = """
+        insert into sentcache (key, version, data, hits, timestamp)
+            values (:key, :version, :data, 0, :ts)
+            on conflict (key) do nothing;
+        """
+
+    # Note a cache hit
+    _Q_HIT = """
+        update sentcache set hits = hits + 1, timestamp = :ts where key = :key;
+        """
+
+    # Evict the least recently used entries in excess of a maximum count
+    _Q_EVICT = """
+        delete from sentcache where key in (
+            select key from sentcache order by timestamp desc offset :max_entries
+        );
+        """
+
+    @staticmethod
+    def insert(session, key, version, data, ts):
+        """ Insert a cache entry, doing nothing if it already exists """
+        session.execute(
+            CachedSentence._Q_INSERT,
+            dict(key=key, version=version, data=data, ts=ts),
+        )
+
+    @staticmethod
+    def hit(session, key, ts):
+        """ Increment the hit count and update the timestamp of an entry """
+        session.execute(CachedSentence._Q_HIT, dict(key=key, ts=ts))
+
+    @staticmethod
+    def evict(session, max_entries):
+        """ Delete the least recently used entries in excess of max_entries """
+        session.execute(CachedSentence._Q_EVICT, dict(max_entries=max_entries))
+
+    def __repr__(self):
+        return "CachedSentence(key='{0}', version='{1}', hits={2}, ts='{3}')".format(
+            self.key, self.version, self.hits, self.timestamp
+        )
+
+    @classmethod
+    def table(cls):
+        return cls.__table__
+
+
+class GrammarVersion(Base):
+    """ Represents a grammar version that has been used for parsing,
+        with a digest of the productions of each of its nonterminals
+        (see grammardiff.py) """
+
+    __tablename__ = "grammars"
+
+    # The parser version string, including the grammar timestamp
+    version = Column(String(64), primary_key=True)
+
+    # Timestamp of this entry
+    timestamp = Column(DateTime, nullable=False)
+
+    # Dictionary of nonterminal names and production digests
+    digests = Column(JSONB, nullable=False)
+
+    def __repr__(self):
+        return "GrammarVersion(version='{0}', ts='{1}')".format(
+            self.version, self.timestamp
+        )
+
+    @classmethod
+    def table(cls):
+        return cls.__table__
+
+
+class Job(Base):
+    """ Represents a unit of work, such as parsing an article, in a queue
+        that is shared by the hosts working on a stage (see jobqueue.py).
+        A host claims a job by taking a lease on it, which it renews
+        while working on the job, and deletes the job when done. A job
+        whose lease has expired, e.g. because its host died, can be
+        claimed again, up to a maximum number of attempts. """
+
+    __tablename__ = "jobs"
+
+    # The stage that the job belongs to, such as 'parse' or 'process'
+    stage = Column(String(16), primary_key=True)
+    # The URL of the article to work on
+    url = Column(String, primary_key=True)
+    # Estimated cost of the job; the most expensive jobs are claimed first
+    cost = Column(Integer, nullable=False, server_default=text("0"))
+    # The host and process that has claimed the job, if any
+    owner = Column(String)
+    # Expiry time (UTC) of the claim, or the time of the last release
+    lease = Column(DateTime)
+    # Number of times the job has been claimed
+    attempts = Column(Integer, nullable=False, server_default=text("0"))
+
+    __table_args__ = (Index("ix_jobs_stage_cost", "stage", "cost"),)
+
+    def __repr__(self):
+        return "Job(stage='{0}', url='{1}', owner='{2}', attempts={3})".format(
+            self.stage, self.url, self.owner, self.attempts
+        )
+
+    @classmethod
+    def table(cls):
+        return cls.__table__
+
+    # Add jobs, ignoring those that are already queued
+    _Q_ENQUEUE = """
+        insert into jobs (stage, url, cost)
+            select cast(:stage as varchar), u.url, u.cost
+                from unnest(cast(:urls as varchar[]), cast(:costs as integer[]))
+                    as u (url, cost)
+            on conflict (stage, url) do nothing;
+        """
+
+    # Delete the jobs that have failed too often, a while ago, so that
+    # they can be queued again
+    _Q_PURGE = """
+        delete from jobs
+            where stage = :stage and attempts >= :attempts
+            and lease < (now() at time zone 'utc') - interval '1 day';
+        """
+
+    # Claim a batch of unclaimed jobs, or jobs whose leases have expired,
+    # skipping those being claimed concurrently by other hosts
+    _Q_CLAIM = """
+        with c as (
+            select stage, url from jobs
+                where stage = :stage
+                and attempts < :attempts
+                and (lease is null or lease < (now() at time zone 'utc'))
+                order by cost desc
+                limit :batch
+                for update skip locked
+        )
+        update jobs as j set
+            owner = :owner,
+            lease = (now() at time zone 'utc')
+                + cast(:lease as double precision) * interval '1 second',
+            attempts = j.attempts + 1
+            from c
+            where j.stage = c.stage and j.url = c.url
+            returning j.url, j.cost;
+        """
+
+    # Extend the leases of all jobs of a stage claimed by an owner
+    _Q_RENEW = """
+        update jobs set
+            lease = (now() at time zone 'utc')
+                + cast(:lease as double precision) * interval '1 second'
+            where stage = :stage and owner = :owner;
+        """
+
+    _Q_COMPLETE = """
+        delete from jobs
+            where stage = :stage and url = :url and owner = :owner;
+        """
+
+    # Give up the claim on a job, making it available to others at once
+    _Q_RELEASE = """
+        update jobs set owner = null, lease = (now() at time zone 'utc')
+            where stage = :stage and url = :url and owner = :owner;
+        """
+
+    _Q_RELEASE_ALL = """
+        update jobs set owner = null, lease = (now() at time zone 'utc')
+            where stage = :stage and owner = :owner;
+        """
+
+    _Q_COUNTS = """
+        select
+            sum(case when attempts < :attempts and owner is null then 1 else 0 end),
+            sum(case when owner is not null then 1 else 0 end),
+            sum(case when attempts >= :attempts and owner is null then 1 else 0 end)
+            from jobs
+            where stage = :stage;
+        """
+
+    @staticmethod
+    def enqueue(session, stage, jobs, attempts):
+        """ Add jobs to a stage, given as (url, cost) tuples, ignoring
+            those that are already queued. Jobs that have failed at least
+            the given number of attempts are purged first, if their last
+            attempt was more than a day ago. """
+        session.execute(Job._Q_PURGE, dict(stage=stage, attempts=attempts))
+        if not jobs:
+            return
+        session.execute(
+            Job._Q_ENQUEUE,
+            dict(
+                stage=stage,
+                urls=[url for url, _ in jobs],
+                costs=[cost for _, cost in jobs],
+            ),
+        )
+
+    @staticmethod
+    def claim(session, stage, owner, batch, lease, attempts):
+        """ Claim up to batch jobs of a stage for the given owner, for lease
+            seconds. Returns a list of (url, cost) tuples, most expensive first. """
+        return sorted(
+            (
+                (r.url, r.cost)
+                for r in session.execute(
+                    Job._Q_CLAIM,
+                    dict(
+                        stage=stage,
+                        owner=owner,
+                        batch=batch,
+                        lease=lease,
+                        attempts=attempts,
+                    ),
+                )
+            ),
+            key=lambda r: r[1],
+            reverse=True,
+        )
+
+    @staticmethod
+    def renew(session, stage, owner, lease):
+        """ Extend the leases of the owner's jobs of a stage by lease
+            seconds from now """
+        session.execute(Job._Q_RENEW, dict(stage=stage, owner=owner, lease=lease))
+
+    @staticmethod
+    def complete(session, stage, url, owner):
+        """ Delete a finished job, if it is still claimed by the owner """
+        session.execute(Job._Q_COMPLETE, dict(stage=stage, url=url, owner=owner))
+
+    @staticmethod
+    def release(session, stage, owner, url=None):
+        """ Release the owner's claim on a job, or on all its jobs of a stage """
+        if url is None:
+            session.execute(Job._Q_RELEASE_ALL, dict(stage=stage, owner=owner))
+        else:
+            session.execute(Job._Q_RELEASE, dict(stage=stage, url=url, owner=owner))
+
+    @staticmethod
+    def counts(session, stage, attempts):
+        """ Return a tuple of the numbers of queued, claimed and failed
+            jobs of a stage, where failed jobs have had the given number
+            of attempts """
+        r = session.execute(Job._Q_COUNTS, dict(stage=stage, attempts=attempts)).fetchone()
+        return tuple(n or 0 for n in r)
+
+
+class HtmlBlob(Base):
+    """ Represents the compressed HTML of one or more articles, keyed by
+        the SHA-256 hash of the HTML, so that identical documents are only
+        stored once (see htmlstore.py) """
+
+    __tablename__ = "htmlblobs"
+
+    # SHA-256 hash (in hex) of the HTML, UTF-8 encoded
+    hash = Column(String(64), primary_key=True)
+    # The compression method, 'zstd' or 'zlib'
+    codec = Column(String(8), nullable=False)
+    # Size of the uncompressed HTML in bytes
+    size = Column(Integer, nullable=False)
+    # The compressed HTML
+    data = Column(LargeBinary, nullable=False)
+
+    def __repr__(self):
+        return "HtmlBlob(hash='{0}', codec='{1}', size={2})".format(
+            self.hash, self.codec, self.size
+        )
+
+    @classmethod
+    def table(cls):
+        return cls.__table__
+
+    # Add a blob, unless an identical one is already stored
+    _Q_INSERT = """
+        insert into htmlblobs (hash, codec, size, data)
+            values (:hash, :codec, :size, :data)
+            on conflict (hash) do nothing;
+        """
+
+    # Delete the blobs that no article refers to
+    _Q_PURGE = """
+        delete from htmlblobs as b
+            where not exists (select 1 from articles as a where a.html_hash = b.hash);
+        """
+
+    # The number and size of the articles' HTML stored in each way, and
+    # the total size of the tables including their TOAST storage
+    _Q_SPACE = """
+        select
+            (select count(*) from articles where html is not null) as inline_articles,
+            (select coalesce(sum(octet_length(html)), 0) from articles) as inline_size,
+            (select coalesce(sum(pg_column_size(html)), 0) from articles) as inline_stored,
+            (select count(*) from articles where html_hash is not null) as blob_articles,
+            (select count(*) from htmlblobs) as blobs,
+            (select coalesce(sum(size), 0) from htmlblobs) as blob_size,
+            (select coalesce(sum(octet_length(data)), 0) from htmlblobs) as blob_stored,
+            pg_total_relation_size('articles') as articles_table,
+            pg_total_relation_size('htmlblobs') as blobs_table;
+        """
+
+    @staticmethod
+    def store(session, key, codec, size, data):
+        """ Store a blob under the given hash key, unless it is already stored """
+        session.execute(
+            HtmlBlob._Q_INSERT, dict(hash=key, codec=codec, size=size, data=data)
+        )
+
+    @staticmethod
+    def load(session, key):
+        """ Return a tuple (codec, data) of the blob with the given hash
+            key, or None if not found """
+        return (
+            session
+            .query(HtmlBlob.codec, HtmlBlob.data)
+            .filter(HtmlBlob.hash == key)
+            .one_or_none()
+        )
+
+    @staticmethod
+    def purge(session):
+        """ Delete the blobs that are no longer referred to, returning their number """
+        return session.execute(HtmlBlob._Q_PURGE).rowcount
+
+    @staticmethod
+    def space(session):
+        """ Return a dict of the space used by the articles' HTML, inline
+            and in blobs, in bytes (see _Q_SPACE) """
+        r = session.execute(HtmlBlob._Q_SPACE).fetchone()
+        return {key: int(r[key] or 0) for key in r.keys()}
+
+
 class _BaseQuery:
     def __init__(self):
         pass
@@ -673,62 +1567,83 @@ class _BaseQuery:
 
 
 class GenderQuery(_BaseQuery):
-    """ A query for gender representation in the persons table """
+    """ A query for gender representation in the persons table,
+        read from the statistics counters """
 
     _Q = """
-        select domain,
-            sum(case when gender = 'kk' then cnt else 0 end) as kk,
-            sum(case when gender = 'kvk' then cnt else 0 end) as kvk,
-            sum(case when gender = 'hk' then cnt else 0 end) as hk,
-            sum(cnt) as total
-            from (
-                select r.domain, p.gender, sum(1) as cnt
-                    from persons as p, articles as a, roots as r
-                    where p.article_url = a.url and a.root_id = r.id and r.visible
-                    group by r.domain, p.gender
-            ) as q
-            group by domain
-            order by domain;
+        select r.domain,
+            sum(s.kk) as kk,
+            sum(s.kvk) as kvk,
+            sum(s.hk) as hk,
+            sum(s.persons) as total
+            from rootstats as s, roots as r
+            where s.root_id = r.id and r.visible
+            group by r.domain
+            having sum(s.persons) > 0
+            order by r.domain;
         """
 
 
 class StatsQuery(_BaseQuery):
-    """ A query for statistics on articles """
+    """ A query for statistics on articles, read from the statistics counters """
 
     _Q = """
         select r.domain,
-            sum(1) as art,
-            sum(a.num_sentences) as sent,
-            sum(a.num_parsed) as parsed
-            from articles as a, roots as r
-            where a.root_id = r.id and r.visible
+            sum(s.articles) as art,
+            sum(s.sentences) as sent,
+            sum(s.sent_parsed) as parsed
+            from rootstats as s, roots as r
+            where s.root_id = r.id and r.visible
             group by r.domain
+            having sum(s.articles) > 0
             order by r.domain;
         """
 
 
 class ChartsQuery(_BaseQuery):
-    """ Statistics on article, sentence and parse count  
-        for all sources for a given time period """
+    """ Statistics on article, sentence and parse count
+        for all sources for a given time period, read from
+        the statistics counters. The period is in whole days. """
 
     _Q = """
         select r.description AS name,
-            count(a.id) AS cnt,
-            coalesce(sum(a.num_sentences),0) as sent,
-            coalesce(sum(a.num_parsed), 0) as parsed
+            coalesce(sum(s.articles), 0) AS cnt,
+            coalesce(sum(s.sentences), 0) as sent,
+            coalesce(sum(s.sent_parsed), 0) as parsed
             from roots as r
-            left join articles as a on r.id = a.root_id
-            and a.timestamp >= :start and a.timestamp < :end
+            left join rootstats as s on r.id = s.root_id
+            and s.day >= cast(:start as date) and s.day < cast(:end as date)
             where r.visible and r.scrape
             group by name
             order by name
         """
 
+    # The same, for each day of the period. The day is null
+    # for sources without articles in the period.
+    _Q_DAILY = """
+        select r.description AS name,
+            s.day,
+            coalesce(sum(s.articles), 0) AS cnt,
+            coalesce(sum(s.sentences), 0) as sent,
+            coalesce(sum(s.sent_parsed), 0) as parsed
+            from roots as r
+            left join rootstats as s on r.id = s.root_id
+            and s.day >= cast(:start as date) and s.day < cast(:end as date)
+            where r.visible and r.scrape
+            group by name, s.day
+            order by name, s.day
+        """
+
     @classmethod
     def period(cls, start, end, enclosing_session=None):
         with SessionContext(session=enclosing_session, commit=False) as session:
             return cls().execute(session, start=start, end=end)
 
+    @classmethod
+    def daily(cls, start, end, enclosing_session=None):
+        with SessionContext(session=enclosing_session, commit=False) as session:
+            return cls().execute_q(session, cls._Q_DAILY, start=start, end=end)
+
 
 class BestAuthorsQuery(_BaseQuery):
     """ A query for statistics on authors with the best parse ratios.
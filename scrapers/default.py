@@ -58,6 +58,12 @@ class ScrapeHelper:
 
     """ Generic scraping helper base class """
 
+    # Selectors of the article content and of the elements to remove from
+    # it, for finding the content with lxml instead of the soup (see
+    # fastextract.py). None means that get_content() must be used.
+    CONTENT_SELECTORS = None
+    CONTENT_REMOVE = ()
+
     def __init__(self, root):
         self._domain = root.domain
         self._authority = root.authority
@@ -290,6 +296,16 @@ class KjarninnScraper(ScrapeHelper):
 
     """ Scraping helper for Kjarninn.is """
 
+    # Content selectors for the lxml fast path (see fastextract.py)
+    CONTENT_SELECTORS = ("article div.article-body", "article")
+    CONTENT_REMOVE = (
+        "div.container.title-container",
+        "div.container.quote-container",
+        "div.container-fluid",
+        "div.category_snippet",
+        "div.ad-container",
+    )
+
     def __init__(self, root):
         super().__init__(root)
 
@@ -374,6 +390,22 @@ class RuvScraper(ScrapeHelper):
 
     """ Scraping helper for RUV.is """
 
+    # Content selectors for the lxml fast path (see fastextract.py)
+    CONTENT_SELECTORS = (
+        "div.region.region-two-66-33-first div.region-inner",
+        "div.view-content div.second",
+        "div.block.block-system",
+    )
+    CONTENT_REMOVE = (
+        "div.pane-custom",
+        "div.title-wrapper",
+        "div.views-field-field-user-display-name",
+        "div.field-name-myndatexti-credit-source",
+        "div.region-conditional-stack",
+        "twitterwidget",
+        "div.pane-author",
+    )
+
     _SKIP_PREFIXES = [
         "/frontpage",
         "/sarpurinn/",
@@ -455,6 +487,29 @@ class MblScraper(ScrapeHelper):
 
     """ Scraping helper for Mbl.is """
 
+    # Content selectors for the lxml fast path (see fastextract.py)
+    CONTENT_SELECTORS = (
+        "div.main-layout",
+        "div.frett-main",
+        "div.pistill-entry-body",
+        "main[role=main]",
+        "div#non-galleria",
+    )
+    CONTENT_REMOVE = (
+        "h1",
+        # Paragraphs of intermediate links
+        ".//p[.//strong//a]",
+        "div.reporter-profile",
+        "div.mainimg-big",
+        "div.extraimg-big-w-txt",
+        "div.extraimg-big",
+        "div.newsimg-left",
+        "div.newsimg-right",
+        "div.newsitem-bottom-toolbar",
+        "div.sidebar-mobile",
+        "div.embedded-media",
+    )
+
     _SKIP_PREFIXES = [
         "/fasteignir/",
         "/english/",
@@ -611,6 +666,14 @@ class VisirScraper(ScrapeHelper):
 
     """ Scraping helper for Visir.is """
 
+    # Content selectors for the lxml fast path (see fastextract.py)
+    CONTENT_SELECTORS = (
+        "div.article div.articletext",
+        "div.article-single__content",
+        "div.articlewrapper",
+    )
+    CONTENT_REMOVE = ("div.media", "div.meta", "figure")
+
     _SKIP_PREFIXES = [
         "/english/",
         "/section/",  # All /section/X URLs seem to be (extreeeemely long) summaries
@@ -793,6 +856,10 @@ class StjornlagaradScraper(ScrapeHelper):
 
     """ Scraping helper for stjornlagarad.is """
 
+    # Content selectors for the lxml fast path (see fastextract.py)
+    CONTENT_SELECTORS = ("body",)
+    CONTENT_REMOVE = ("div#header", "div#samskiptasattmali", "div#mjog-stor-footer")
+
     def __init__(self, root):
         super().__init__(root)
 
@@ -893,6 +960,10 @@ class KvennabladidScraper(ScrapeHelper):
 
     """ Scraping helper for Kvennabladid.is """
 
+    # Content selectors for the lxml fast path (see fastextract.py)
+    CONTENT_SELECTORS = ("div.blog-content",)
+    CONTENT_REMOVE = ("div.wp-caption",)
+
     def __init__(self, root):
         super().__init__(root)
 
@@ -968,6 +1039,9 @@ class AlthingiScraper(ScrapeHelper):
 
     """ Scraping helper for althingi.is """
 
+    # Content selectors for the lxml fast path (see fastextract.py)
+    CONTENT_SELECTORS = ("div.pgmain div.news div.boxbody",)
+
     def __init__(self, root):
         super().__init__(root)
 
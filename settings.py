@@ -629,6 +629,90 @@ class Settings:
     # Flask debug parameter
     DEBUG = False
 
+    # Sentence parse cache (see parsecache.py): enabled or not,
+    # maximum number of entries in the shared database table,
+    # and maximum number of entries in the in-process dictionary
+    SENTENCE_CACHE = False
+    SENTENCE_CACHE_SIZE = 1000000
+    SENTENCE_CACHE_LOCAL_SIZE = 5000
+
+    # Sentence parse governor (see governor.py): enabled or not,
+    # wall-clock time budget per sentence in seconds, and memory
+    # budget of the parse worker process in megabytes (None = unlimited)
+    PARSE_GOVERNOR = False
+    PARSE_TIME_BUDGET = 120.0
+    PARSE_MEMORY_BUDGET = 4096
+
+    # Number of processes in the pool used to parse the sentences of
+    # a single article or text in parallel (see parsepool.py), or 0
+    # to parse them serially
+    PARSE_POOL = 0
+
+    # HTTP fetch engine of the scraper (see fetchengine.py): maximum number
+    # of concurrent requests in total and per domain, timeout in seconds,
+    # number of retries upon transient errors, and initial backoff in
+    # seconds between retries (doubled after each retry)
+    FETCH_CONNECTIONS = 16
+    FETCH_DOMAIN_CONNECTIONS = 4
+    FETCH_TIMEOUT = 30.0
+    FETCH_RETRIES = 3
+    FETCH_BACKOFF = 1.0
+    # Minimum time in seconds between the starts of consecutive
+    # requests to the same domain
+    FETCH_DOMAIN_DELAY = 0.5
+
+    # Recycling of the scraper's parser processes (see workerpool.py):
+    # number of articles parsed by a process before it is replaced, and
+    # resident set size in megabytes above which it is replaced
+    # (None = no limit)
+    PARSE_WORKER_TASKS = 100
+    PARSE_WORKER_RSS = None
+
+    # Maximum total estimated cost of the articles being parsed or queued
+    # for parsing by the scraper at any time, in kilobytes of stored HTML
+    # (None = no limit)
+    PARSE_MAX_COST = None
+
+    # Near-duplicate article detection (see dedup.py): enabled or not,
+    # maximum Hamming distance between the 64-bit SimHash signatures of
+    # near-duplicate texts, number of days that the signatures of scraped
+    # articles are kept for comparison, and whether near-duplicates are
+    # skipped by the parser instead of reusing the sentences of the
+    # canonical copy
+    DEDUP = False
+    DEDUP_DISTANCE = 3
+    DEDUP_DAYS = 7
+    DEDUP_SKIP = False
+
+    # Shared job queues for parsing and processing on several hosts
+    # (see jobqueue.py): enabled or not, lease time of claimed jobs in
+    # seconds, number of jobs claimed at a time, and maximum number of
+    # times that a job is claimed before it is considered failed
+    JOB_QUEUE = False
+    JOB_LEASE = 300.0
+    JOB_BATCH = 10
+    JOB_ATTEMPTS = 3
+
+    # Adaptive crawl frontier (see frontier.py): enabled or not, minimum
+    # and maximum time between polls of a root in seconds, and the number
+    # of new articles that a poll should find on average
+    FRONTIER = False
+    FRONTIER_MIN_INTERVAL = 600.0
+    FRONTIER_MAX_INTERVAL = 86400.0
+    FRONTIER_TARGET = 2.0
+
+    # Find the content of articles for parsing with lxml and the content
+    # selectors of the scrape helpers, where available (see fastextract.py)
+    LXML_EXTRACT = False
+
+    # Keep the text content extracted from the HTML of each scraped article,
+    # so that it is not extracted again when the article is (re)parsed
+    TEXT_CACHE = True
+
+    # Store the HTML of scraped articles compressed, and only once for
+    # identical documents, in the htmlblobs table (see htmlstore.py)
+    HTML_BLOBS = False
+
     # Similarity server
     SIMSERVER_HOST = os.environ.get("SIMSERVER_HOST", "localhost")
     SIMSERVER_PORT = os.environ.get("SIMSERVER_PORT", "5001")
@@ -681,6 +765,68 @@ class Settings:
                 Settings.SIMSERVER_PORT = int(val)
             elif par == "debug":
                 Settings.DEBUG = bool(val)
+            elif par == "sentence_cache":
+                Settings.SENTENCE_CACHE = bool(val)
+            elif par == "sentence_cache_size":
+                Settings.SENTENCE_CACHE_SIZE = int(val)
+            elif par == "sentence_cache_local_size":
+                Settings.SENTENCE_CACHE_LOCAL_SIZE = int(val)
+            elif par == "parse_governor":
+                Settings.PARSE_GOVERNOR = bool(val)
+            elif par == "parse_time_budget":
+                Settings.PARSE_TIME_BUDGET = float(val)
+            elif par == "parse_memory_budget":
+                Settings.PARSE_MEMORY_BUDGET = None if val is None else int(val)
+            elif par == "parse_pool":
+                Settings.PARSE_POOL = int(val)
+            elif par == "fetch_connections":
+                Settings.FETCH_CONNECTIONS = max(1, int(val))
+            elif par == "fetch_domain_connections":
+                Settings.FETCH_DOMAIN_CONNECTIONS = max(1, int(val))
+            elif par == "fetch_timeout":
+                Settings.FETCH_TIMEOUT = float(val)
+            elif par == "fetch_retries":
+                Settings.FETCH_RETRIES = int(val)
+            elif par == "fetch_backoff":
+                Settings.FETCH_BACKOFF = float(val)
+            elif par == "fetch_domain_delay":
+                Settings.FETCH_DOMAIN_DELAY = max(0.0, float(val))
+            elif par == "parse_worker_tasks":
+                Settings.PARSE_WORKER_TASKS = None if val is None else int(val)
+            elif par == "parse_worker_rss":
+                Settings.PARSE_WORKER_RSS = None if val is None else int(val)
+            elif par == "parse_max_cost":
+                Settings.PARSE_MAX_COST = None if val is None else int(val)
+            elif par == "dedup":
+                Settings.DEDUP = bool(val)
+            elif par == "dedup_distance":
+                Settings.DEDUP_DISTANCE = max(0, min(15, int(val)))
+            elif par == "dedup_days":
+                Settings.DEDUP_DAYS = max(1, int(val))
+            elif par == "dedup_skip":
+                Settings.DEDUP_SKIP = bool(val)
+            elif par == "job_queue":
+                Settings.JOB_QUEUE = bool(val)
+            elif par == "job_lease":
+                Settings.JOB_LEASE = max(10.0, float(val))
+            elif par == "job_batch":
+                Settings.JOB_BATCH = max(1, int(val))
+            elif par == "job_attempts":
+                Settings.JOB_ATTEMPTS = max(1, int(val))
+            elif par == "frontier":
+                Settings.FRONTIER = bool(val)
+            elif par == "frontier_min_interval":
+                Settings.FRONTIER_MIN_INTERVAL = max(60.0, float(val))
+            elif par == "frontier_max_interval":
+                Settings.FRONTIER_MAX_INTERVAL = max(60.0, float(val))
+            elif par == "frontier_target":
+                Settings.FRONTIER_TARGET = max(0.1, float(val))
+            elif par == "lxml_extract":
+                Settings.LXML_EXTRACT = bool(val)
+            elif par == "text_cache":
+                Settings.TEXT_CACHE = bool(val)
+            elif par == "html_blobs":
+                Settings.HTML_BLOBS = bool(val)
             else:
                 raise ConfigError("Unknown configuration parameter '{0}'".format(par))
         except ValueError:
@@ -0,0 +1,131 @@
+"""
+
+    Reynir: Natural language processing for Icelandic
+
+    Tests for near-duplicate article detection
+
+    Copyright (C) 2018 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+    These tests cover the signatures and the signature index of dedup.py,
+    and the detection of near-duplicates among the articles scraped by
+    the scraper's pool of worker processes. The database is not used:
+    storing the scraped articles, and marking the near-duplicates, are
+    replaced by recording functions.
+
+"""
+
+import os
+import sys
+import time
+
+# Make the modules in the main directory (the parent of /test) importable
+basepath, _ = os.path.split(os.path.realpath(__file__))
+mainpath = os.path.join(basepath, "..")
+if mainpath not in sys.path:
+    sys.path.insert(0, mainpath)
+
+from dedup import simhash, distance, SignatureIndex
+from article import Article
+from fetcher import Fetcher
+from scraper import Scraper, ArticleDescr
+
+
+_STORY = (
+    "Ríkisstjórnin kynnti í dag nýja aðgerðaáætlun í húsnæðismálum sem á að "
+    "auka framboð íbúða á höfuðborgarsvæðinu á næstu árum. Samkvæmt áætluninni "
+    "verða byggðar um þrjú þúsund íbúðir á vegum óhagnaðardrifinna leigufélaga "
+    "og sveitarfélögin fá aukið svigrúm til að úthluta lóðum. Ráðherra sagði á "
+    "blaðamannafundi að aðgerðirnar ættu að lækka leiguverð og auðvelda ungu "
+    "fólki að eignast sitt fyrsta heimili."
+)
+
+_OTHER = (
+    "Íslenska karlalandsliðið í handbolta vann öruggan sigur á Portúgal í "
+    "undankeppni Evrópumótsins í gærkvöldi. Leikurinn fór fram í Laugardalshöll "
+    "fyrir fullu húsi og var staðan jöfn í hálfleik. Í síðari hálfleik tók "
+    "íslenska liðið öll völd á vellinum og markvörðurinn varði fjölmörg skot. "
+    "Þjálfarinn var ánægður með frammistöðuna en segir að liðið þurfi að bæta "
+    "varnarleikinn fyrir næstu leiki í riðlinum."
+)
+
+
+def test_simhash():
+    assert simhash("Of stutt.") is None
+    sig = simhash(_STORY)
+    assert sig is not None
+    assert -(1 << 63) <= sig < (1 << 63)
+    assert simhash(_STORY) == sig
+    assert distance(sig, sig) == 0
+    # The signatures of unrelated texts differ in many bits
+    assert distance(sig, simhash(_OTHER)) > 3
+
+
+def test_signature_index():
+    index = SignatureIndex(3, 3600)
+    sig = simhash(_STORY)
+    assert index.find(sig) is None
+    # Entries are added in order of age, and those older than
+    # the maximum age are expired
+    index.add(simhash(_OTHER), "http://a.is/2", time.time() - 7200)
+    index.add(sig, "http://a.is/1")
+    assert len(index) == 1
+    assert index.find(simhash(_OTHER)) is None
+    assert index.find(sig) == ("http://a.is/1", 0)
+    assert index.find(sig, exclude="http://a.is/1") is None
+    # A signature that differs in a few bits is found
+    assert index.find(sig ^ 0b101) == ("http://a.is/1", 2)
+
+
+def test_duplicates_scraped_by_different_workers(monkeypatch, tmp_path):
+    """ Two copies of the same story, scraped by different worker
+        processes, are found to be near-duplicates """
+
+    def scrape_article(self, url, helper, html=None):
+        # Record the worker process, and keep it busy long enough
+        # for the other article to be taken by another worker
+        (tmp_path / "{0}.{1}".format(os.getpid(), url.rsplit("/", 1)[1])).touch()
+        time.sleep(0.5)
+        return simhash(html)
+
+    duplicates = []
+
+    def check_duplicate(cls, url, sig, enclosing_session=None):
+        duplicate_of = cls.find_duplicate(None, url, sig)
+        if duplicate_of is not None:
+            duplicates.append((url, duplicate_of))
+        return duplicate_of
+
+    monkeypatch.setattr(Scraper, "scrape_article", scrape_article)
+    monkeypatch.setattr(Fetcher, "_get_helper", classmethod(lambda cls, root: root))
+    monkeypatch.setattr(Article, "check_duplicate", classmethod(check_duplicate))
+    # An empty index of signatures, instead of one loaded from the database
+    monkeypatch.setattr(Article, "_signatures", SignatureIndex(3, 3600))
+
+    articles = [
+        (ArticleDescr(0, "root", "http://a.is/1"), _STORY),
+        (ArticleDescr(1, "root", "http://b.is/2"), _STORY),
+        (ArticleDescr(2, "root", "http://c.is/3"), _OTHER),
+    ]
+    sc = Scraper()
+    ps = sc._scrape_articles(iter(articles), processes=3)
+    assert ps.tasks == 3
+    assert ps.failed == 0
+    # The two copies were scraped by different processes
+    pids = {name.split(".")[0] for name in os.listdir(tmp_path) if not name.endswith(".3")}
+    assert len(pids) == 2
+    assert len(duplicates) == 1
+    assert {duplicates[0][0], duplicates[0][1]} == {"http://a.is/1", "http://b.is/2"}
+    assert sc._duplicates == 1
@@ -0,0 +1,267 @@
+"""
+
+    Reynir: Natural language processing for Icelandic
+
+    Tests for the fetch engine module
+
+    Copyright (C) 2018 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+    These tests run the fetch engine (fetchengine.py) against a stub
+    HTTP server on the local host, which serves documents, conditional
+    GETs, transient errors and slow responses on different paths.
+
+"""
+
+import os
+import sys
+import time
+import threading
+from collections import defaultdict
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+
+import pytest
+
+# Make the modules in the main directory (the parent of /test) importable
+basepath, _ = os.path.split(os.path.realpath(__file__))
+mainpath = os.path.join(basepath, "..")
+if mainpath not in sys.path:
+    sys.path.insert(0, mainpath)
+
+from fetchengine import FetchEngine, NOT_MODIFIED, domain_of
+
+
+_ETAG = '"v1"'
+_LAST_MODIFIED = "Mon, 01 Jan 2018 00:00:00 GMT"
+
+
+class _StubServer(ThreadingMixIn, HTTPServer):
+
+    """ A threaded HTTP server that records the requests made to it """
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _StubHandler)
+        self.lock = threading.Lock()
+        self.requests = defaultdict(int)
+        self.active = 0
+        self.max_active = 0
+
+    @property
+    def base(self):
+        return "http://127.0.0.1:{0}".format(self.server_address[1])
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+
+    """ Serves the paths:
+        /page/<n>: a document;
+        /etag: a document with validators, or 304 if they match;
+        /flaky/<n>: 503 on the first request, then a document;
+        /missing: 404;
+        /slow: a document after one second;
+        /busy/<n>: a document after a short while """
+
+    def log_message(self, format, *args):
+        # Keep the test output clean
+        pass
+
+    def _send(self, status, body=None, headers=None):
+        data = (body or "").encode("utf-8")
+        self.send_response(status)
+        for name, value in (headers or dict()).items():
+            self.send_header(name, value)
+        if status != NOT_MODIFIED:
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if status != NOT_MODIFIED:
+            self.wfile.write(data)
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests[self.path] += 1
+            count = server.requests[self.path]
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+        try:
+            body = "<html><body><p>{0}</p></body></html>".format(self.path)
+            if self.path.startswith("/page/"):
+                self._send(200, body)
+            elif self.path == "/etag":
+                validators = {"ETag": _ETAG, "Last-Modified": _LAST_MODIFIED}
+                if self.headers.get("If-None-Match") == _ETAG:
+                    self._send(NOT_MODIFIED, headers=validators)
+                else:
+                    self._send(200, body, validators)
+            elif self.path.startswith("/flaky/"):
+                self._send(503 if count == 1 else 200, body)
+            elif self.path == "/slow":
+                time.sleep(1.0)
+                self._send(200, body)
+            elif self.path.startswith("/busy/"):
+                time.sleep(0.1)
+                self._send(200, body)
+            else:
+                self._send(404, "Not found")
+        finally:
+            with server.lock:
+                server.active -= 1
+
+
+@pytest.fixture
+def server():
+    s = _StubServer()
+    t = threading.Thread(target=s.serve_forever, daemon=True)
+    t.start()
+    yield s
+    s.shutdown()
+    s.server_close()
+
+
+def _engine(**kwargs):
+    """ Return an engine with small timeouts and delays, for testing """
+    params = dict(
+        connections=8,
+        domain_connections=4,
+        timeout=0.5,
+        retries=2,
+        backoff=0.01,
+        domain_delay=0.0,
+    )
+    params.update(kwargs)
+    return FetchEngine(**params)
+
+
+def _fetch(engine, items):
+    """ Fetch the items, returning the results by url """
+    try:
+        return {r.url: r for r in engine.fetch_all(items)}
+    finally:
+        engine.close()
+
+
+def test_domain_of():
+    assert domain_of("http://www.ruv.is/frett/1") == "ruv.is"
+    assert domain_of("https://mbl.is:443/") == "mbl.is"
+    assert domain_of("http://127.0.0.1:8080/page/1") == "127.0.0.1"
+
+
+def test_fetch_documents(server):
+    engine = _engine()
+    urls = [server.base + "/page/{0}".format(i) for i in range(20)]
+    results = _fetch(engine, [(url, i, None, None) for i, url in enumerate(urls)])
+    assert set(results) == set(urls)
+    for i, url in enumerate(urls):
+        r = results[url]
+        assert r.data == i
+        assert r.status == 200
+        assert r.error is None
+        assert r.attempts == 1
+        assert "/page/{0}".format(i) in r.html
+    stats = engine.stats()
+    assert stats["fetched"] == 20
+    assert stats["failed"] == 0
+    assert stats["bytes"] > 0
+
+
+def test_conditional_get(server):
+    engine = _engine()
+    url = server.base + "/etag"
+    r = _fetch(engine, [(url, None, None, None)])[url]
+    assert r.status == 200
+    assert r.validators == dict(etag=_ETAG, last_modified=_LAST_MODIFIED)
+    engine = _engine()
+    r = _fetch(engine, [(url, None, None, {"If-None-Match": _ETAG})])[url]
+    assert r.status == NOT_MODIFIED
+    assert r.html is None
+    assert r.error is None
+    assert r.validators["etag"] == _ETAG
+    assert engine.stats()["not_modified"] == 1
+
+
+def test_retry_transient_error(server):
+    engine = _engine()
+    url = server.base + "/flaky/1"
+    r = _fetch(engine, [(url, None, None, None)])[url]
+    assert r.status == 200
+    assert r.html
+    assert r.attempts == 2
+    assert engine.stats()["retried"] == 1
+
+
+def test_no_retry_client_error(server):
+    engine = _engine()
+    url = server.base + "/missing"
+    r = _fetch(engine, [(url, None, None, None)])[url]
+    assert r.html is None
+    assert r.status == 404
+    assert r.error == "HTTP status 404"
+    assert r.attempts == 1
+    assert server.requests["/missing"] == 1
+    assert engine.stats()["failed"] == 1
+
+
+def test_timeout(server):
+    engine = _engine(timeout=0.2, retries=1)
+    url = server.base + "/slow"
+    r = _fetch(engine, [(url, None, None, None)])[url]
+    assert r.html is None
+    assert r.error.startswith("Timeout")
+    assert r.attempts == 2
+    assert engine.stats()["failed"] == 1
+
+
+def test_domain_connections(server):
+    engine = _engine(domain_connections=2)
+    urls = [server.base + "/busy/{0}".format(i) for i in range(8)]
+    results = _fetch(engine, [(url, None, None, None) for url in urls])
+    assert all(results[url].html for url in urls)
+    assert server.max_active == 2
+
+
+def test_domain_delay(server):
+    engine = _engine(domain_delay=0.1)
+    urls = [server.base + "/page/{0}".format(i) for i in range(4)]
+    t0 = time.time()
+    results = _fetch(engine, [(url, None, None, None) for url in urls])
+    assert len(results) == 4
+    # The requests are started at least 0.1 seconds apart
+    assert time.time() - t0 >= 0.3
+    assert engine.stats()["delayed"] == 3
+
+
+def test_custom_fetch(server):
+    engine = _engine()
+    url = server.base + "/page/custom"
+    r = _fetch(engine, [(url, None, lambda u: "<html>" + u + "</html>", None)])[url]
+    assert r.html == "<html>" + url + "</html>"
+    assert r.status is None
+    assert server.requests["/page/custom"] == 0
+
+
+def test_stop_early(server):
+    engine = _engine(connections=2)
+    urls = [server.base + "/busy/{0}".format(i) for i in range(20)]
+    g = engine.fetch_all([(url, None, None, None) for url in urls])
+    first = next(g)
+    assert first.html
+    # Closing the generator cancels the remaining fetches
+    g.close()
+    engine.close()
+    assert sum(server.requests.values()) < len(urls)
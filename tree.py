@@ -21,7 +21,8 @@
 
 
     This module implements a data structure for parsed sentence trees that can
-    be loaded from text strings and processed by plug-in processing functions.
+    be loaded from text strings (or their binary encoding, see bintree.py)
+    and processed by plug-in processing functions.
 
     A set of provided utility functions allow the extraction of nominative, indefinite
     and canonical (nominative + indefinite + singular) forms of the text within any subtree.
@@ -40,6 +41,8 @@ from reynir.binparser import BIN_Token
 from reynir.matcher import SimpleTreeBuilder
 from reynir.cache import LRU_Cache
 
+import bintree
+
 
 BIN_ORDFL = {
     "no": {"kk", "kvk", "hk"},
@@ -1141,12 +1144,15 @@ class TreeBase:
         """ Return the length of the sentence with index n, in tokens, or 0 if unknown """
         return self.lengths.get(n, 0)
 
-    def simple_trees(self, nt_map=None, id_map=None, terminal_map=None):
-        """ Generate simple trees out of the sentences in this tree """
+    def simple_trees(self, nt_map=None, id_map=None, terminal_map=None, indices=None):
+        """ Generate simple trees out of the sentences in this tree,
+            optionally only those whose indices are in the given set """
         # Hack to allow nodes to access the BIN database
         with BIN_Db.get_db() as bin_db:
             state = dict(bin_db=bin_db)
             for ix, sent in self.s.items():
+                if indices is not None and ix not in indices:
+                    continue
                 builder = SimpleTreeBuilder(nt_map, id_map, terminal_map)
                 builder.state = state
                 sent.build_simple_tree(builder)
@@ -1199,8 +1205,9 @@ class TreeBase:
         self.stack = None
         self.n = None
 
-    def handle_E(self, n):
-        """ End of sentence with error """
+    def handle_E(self, n, reason=None):
+        """ End of sentence with error, optionally noting the reason
+            why the parse was abandoned """
         # Nothing stored
         assert self.n not in self.s
         self.stack = None
@@ -1264,7 +1271,10 @@ class TreeBase:
 
     def handle_T(self, n, s):
         """ Terminal """
-        terminal, augmented_terminal, token, tokentype, aux, cat = self._parse_T(s)
+        self.add_terminal(n, *self._parse_T(s))
+
+    def add_terminal(self, n, terminal, augmented_terminal, token, tokentype, aux, cat):
+        """ Add a terminal node, already split into its components """
         constructor = self._TC.get(cat, TerminalNode)
         self.push(
             n,
@@ -1279,7 +1289,11 @@ class TreeBase:
         self.push(n, NonterminalNode(nonterminal))
 
     def load(self, txt):
-        """ Loads a tree from the text format stored by the scraper """
+        """ Loads a tree from the text format stored by the scraper,
+            or from the binary format if txt is a bytes-like object """
+        if not isinstance(txt, str):
+            self._load_binary(txt)
+            return
         for line in txt.split("\n"):
             if not line:
                 continue
@@ -1297,6 +1311,121 @@ class TreeBase:
             else:
                 assert False, "*** No handler for {0}".format(line)
 
+    def _load_binary(self, data):
+        """ Loads a tree from the binary format (see bintree.py),
+            invoking the same handlers as the text format loader """
+        strings, ints = bintree.decode(data)
+        handle_N = self.handle_N
+        add_terminal = self.add_terminal
+        pos = 1
+        for _ in range(ints[0]):
+            # Sentence index, record length and sentence kind
+            end = pos + 2 + ints[pos + 1]
+            self.handle_S(ints[pos])
+            if ints[pos + 2] == bintree.SENT_ERROR:
+                if ints[pos + 1] > 2:
+                    self.handle_E(ints[pos + 3], strings[ints[pos + 4]])
+                else:
+                    self.handle_E(ints[pos + 3])
+                pos = end
+                continue
+            self.handle_C(ints[pos + 3])
+            self.handle_L(ints[pos + 4])
+            p = pos + 5
+            while p < end:
+                code = ints[p]
+                if code == bintree.NODE_T:
+                    add_terminal(
+                        ints[p + 1],
+                        strings[ints[p + 2]],
+                        strings[ints[p + 3]],
+                        strings[ints[p + 4]],
+                        strings[ints[p + 5]],
+                        strings[ints[p + 6]],
+                        strings[ints[p + 7]],
+                    )
+                    p += 8
+                elif code == bintree.NODE_N:
+                    handle_N(ints[p + 1], strings[ints[p + 2]])
+                    p += 3
+                else:
+                    self.handle_P(ints[p + 1])
+                    p += 2
+            self.handle_Q(0)
+            pos = end
+
+
+class _BinaryTreeConverter(TreeBase):
+
+    """ Converts a tree in text format to the binary format """
+
+    def __init__(self):
+        super().__init__()
+        self._writer = bintree.BinaryTreeWriter()
+        self._score = 0
+        self._length = 0
+        self._begun = False
+
+    def _begin(self):
+        """ Begin the sentence record, once the score and length are known """
+        if not self._begun:
+            self._writer.begin_sentence(self.n, self._score, self._length)
+            self._begun = True
+
+    def handle_S(self, n):
+        """ Start of sentence """
+        self.n = n
+        self._score = 0
+        self._length = 0
+        self._begun = False
+
+    def handle_C(self, n):
+        """ Sentence score """
+        self._score = n
+
+    def handle_L(self, n):
+        """ Sentence length """
+        self._length = n
+
+    def handle_Q(self, n):
+        """ End of sentence """
+        self._begin()
+        self._writer.end_sentence()
+        self.n = None
+
+    def handle_E(self, n, reason=None):
+        """ End of sentence with error """
+        self._writer.error_sentence(self.n, n, reason)
+        self.n = None
+
+    def handle_P(self, n):
+        """ Epsilon node """
+        self._begin()
+        self._writer.epsilon(n)
+
+    def handle_N(self, n, nonterminal):
+        """ Nonterminal """
+        self._begin()
+        self._writer.nonterminal(n, nonterminal)
+
+    def add_terminal(self, n, terminal, augmented_terminal, token, tokentype, aux, cat):
+        """ Terminal """
+        self._begin()
+        self._writer.terminal(
+            n, terminal, augmented_terminal, token, tokentype, aux, cat
+        )
+
+    def result(self):
+        return self._writer.result()
+
+
+def tree_to_binary(txt):
+    """ Convert a tree in the text format stored by the scraper
+        to the binary format """
+    converter = _BinaryTreeConverter()
+    converter.load(txt)
+    return converter.result()
+
 
 class Tree(TreeBase):
 
@@ -1382,11 +1511,18 @@ class TreeGist(TreeBase):
         super().__init__()
         # Dictionary of error token indices for sentences that weren't successfully parsed
         self._err_index = dict()
+        # Dictionary of reasons for abandoning the parse of sentences, if known
+        self._reason = dict()
 
     def err_index(self, n):
         """ Return the error token index for an unparsed sentence, if any, or None """
         return self._err_index.get(n)
 
+    def err_reason(self, n):
+        """ Return the reason why the parse of a sentence was abandoned
+            (e.g. 'timeout' or 'memory'), or None """
+        return self._reason.get(n)
+
     def push(self, n, node):
         """ This should not be invoked for a gist """
         assert False
@@ -1400,16 +1536,22 @@ class TreeGist(TreeBase):
         self.stack = None
         self.n = None
 
-    def handle_E(self, n):
+    def handle_E(self, n, reason=None):
         """ End of sentence with error """
-        super().handle_E(n)
+        if reason:
+            self._reason[self.n] = reason
         self._err_index[self.n] = n  # Note the index of the error token
+        super().handle_E(n)
 
     def handle_T(self, n, s):
         """ Terminal """
         # No need to store anything for gists
         pass
 
+    def add_terminal(self, n, terminal, augmented_terminal, token, tokentype, aux, cat):
+        """ Terminal, from the binary format """
+        pass
+
     def handle_N(self, n, nonterminal):
         """ Nonterminal """
         # No need to store anything for gists
@@ -1436,12 +1578,13 @@ class TreeTokenList(TreeBase):
         self.stack = None
         self.n = None
 
-    def handle_T(self, n, s):
+    def add_terminal(self, n, terminal, augmented_terminal, token, tokentype, aux, cat):
         """ Terminal """
-        t = self._parse_T(s)
         # Append to token list for current sentence
         assert self.stack is not None
-        self.stack.append(TreeToken(*t))
+        self.stack.append(
+            TreeToken(terminal, augmented_terminal, token, tokentype, aux, cat)
+        )
 
     def handle_N(self, n, nonterminal):
         """ Nonterminal """
@@ -0,0 +1,204 @@
+"""
+
+    Reynir: Natural language processing for Icelandic
+
+    Tree symbol index module
+
+    Copyright (C) 2018 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+    This module maintains an inverted index of the symbols occurring in the
+    simplified sentence trees of each article (see the treesymbols table),
+    and derives the symbols required by a tree pattern (see matcher.py),
+    so that Article.all_matches() only needs to load and match the
+    sentences that can possibly match the pattern.
+
+    The symbols are strings with a one-letter prefix:
+
+    * N:TAG for each nonterminal tag, including each of its hyphen-separated
+      prefixes (NP-POSS yields N:NP and N:NP-POSS), since the pattern item
+      NP matches NP-POSS as well;
+    * T:cat for the category of each terminal (no, so, person...);
+    * L:lemma for the lemma of each terminal.
+
+    In addition, the empty symbol maps to all indexed sentences of the
+    article, and its presence shows that the article has been indexed.
+
+    The required symbols of a pattern are derived conservatively, as a list
+    of clauses, each a set of alternative symbols: any matching sentence
+    contains at least one symbol from each clause. Items that cannot be
+    indexed (wildcards, literal text, optional items) yield no clause.
+    If a pattern yields no clauses at all, it cannot be pruned and all
+    sentences must be scanned.
+
+"""
+
+import re
+from collections import defaultdict
+from itertools import chain
+
+from reynir.matcher import SimpleTree
+
+from tree import Tree
+
+
+# Maximum length of a symbol in the index (see TreeSymbol in scraperdb.py)
+MAX_SYMBOL_LEN = 64
+
+# The symbol that maps to all indexed sentences of an article
+ALL_SENTENCES = ""
+
+
+def _node_symbols(node, symbols):
+    """ Add the symbols of a simple tree node to the given set """
+    if node.is_terminal:
+        lemma = node.own_lemma
+        if lemma:
+            symbols.add("L:" + lemma)
+    if node.terminal:
+        symbols.add("T:" + node.tcat)
+    else:
+        tag = node.tag
+        if tag:
+            parts = tag.split("-")
+            for i in range(1, len(parts) + 1):
+                symbols.add("N:" + "-".join(parts[0:i]))
+
+
+def sentence_symbols(simple_tree):
+    """ Return the set of symbols occurring in a simple sentence tree """
+    symbols = set()
+    for node in chain([simple_tree], simple_tree.descendants):
+        _node_symbols(node, symbols)
+    return symbols
+
+
+def tree_symbols(tree_data):
+    """ Return a dict of symbols, each mapping to a sorted list of the
+        1-based indices of the sentences where the symbol occurs, for an
+        article tree in text or binary format """
+    tree = Tree()
+    tree.load(tree_data)
+    index = defaultdict(list)
+    for ix, simple_tree in tree.simple_trees():
+        index[ALL_SENTENCES].append(ix)
+        for sym in sentence_symbols(simple_tree):
+            if len(sym) <= MAX_SYMBOL_LEN:
+                index[sym].append(ix)
+    return {sym: sorted(ixs) for sym, ixs in index.items()}
+
+
+def _item_symbol(item):
+    """ Return the symbol required by a single pattern item,
+        or None if the item doesn't require any indexed symbol """
+    if not isinstance(item, str) or not item:
+        return None
+    if item.startswith("'"):
+        # Word lemma
+        if len(item) < 3 or not item.endswith("'"):
+            return None
+        sym = "L:" + item[1:-1]
+    elif item[0].isupper():
+        # Nonterminal tag, matching by prefix
+        sym = "N:" + "-".join(re.split(r"[_\-]", item))
+    elif item[0].islower():
+        # Terminal, possibly with variants
+        sym = "T:" + item.split("_")[0]
+    else:
+        # Wildcard, literal text, operator...
+        return None
+    return sym if len(sym) <= MAX_SYMBOL_LEN else None
+
+
+def _item_clauses(item):
+    """ Return the clauses required by a single pattern item,
+        which may be a nested list of alternatives """
+    if isinstance(item, SimpleTree._NestedList):
+        if item.kind == "(":
+            # Alternatives: one of them must match. We can only use this
+            # if each alternative requires a single symbol.
+            alternatives = set()
+            for i in range(0, len(item), 2):
+                sym = _item_symbol(item[i])
+                if sym is None:
+                    return []
+                alternatives.add(sym)
+            return [frozenset(alternatives)]
+        return []
+    sym = _item_symbol(item)
+    return [] if sym is None else [frozenset((sym,))]
+
+
+def _clauses(items, sequence):
+    """ Return the clauses required by a list of compiled pattern items,
+        matched either as a sequence or as a set """
+    clauses = []
+    len_items = len(items)
+    i = 0
+    while i < len_items:
+        item = items[i]
+        i += 1
+        optional = False
+        if sequence and i < len_items and items[i] in {"*", "?", "+"}:
+            # Repeat specifier: * and ? make the item optional
+            optional = items[i] != "+"
+            i += 1
+        if not optional:
+            clauses.extend(_item_clauses(item))
+        if i < len_items and items[i] == ">":
+            # Containment: the argument is required as well
+            i += 1
+            if i < len_items and items[i] == ">":
+                i += 1
+            if i >= len_items:
+                break
+            arg = items[i]
+            i += 1
+            if optional:
+                continue
+            if isinstance(arg, SimpleTree._NestedList) and arg.kind in {"[", "{"}:
+                clauses.extend(_clauses(arg, arg.kind == "["))
+            else:
+                clauses.extend(_item_clauses(arg))
+    return clauses
+
+
+def pattern_clauses(pattern):
+    """ Return a list of clauses (sets of alternative symbols) that must be
+        satisfied by any sentence matching the pattern. An empty list means
+        that the pattern cannot be pruned using the index. """
+    try:
+        items = SimpleTree._compile(pattern)
+    except ValueError:
+        # Let the matcher itself report errors in the pattern
+        return []
+    # The top level items are matched as a set against each subtree root
+    clauses = _clauses(items, False)
+    # Remove duplicates, keeping the order
+    return list(dict.fromkeys(clauses))
+
+
+def matching_sentences(symbols, clauses):
+    """ Given a dict of symbols and their sentence indices (for an article),
+        return the set of sentence indices that satisfy all the clauses """
+    result = None
+    for clause in clauses:
+        ixs = set()
+        for sym in clause:
+            ixs.update(symbols.get(sym, ()))
+        result = ixs if result is None else result & ixs
+        if not result:
+            break
+    return set() if result is None else result
@@ -31,6 +31,7 @@ from nertokenizer import TOK, tokenize_and_recognize
 from reynir.binparser import canonicalize_token, augment_terminal
 from reynir.fastparser import Fast_Parser, ParseForestNavigator
 from incparser import IncrementalParser
+from parsepool import ParsePool
 from scraperdb import SessionContext
 from settings import Settings
 from reynir.matcher import SimpleTree, SimpleTreeBuilder
@@ -370,6 +371,25 @@ class TreeUtility:
                 words[wt] += 1
         return dump
 
+    @staticmethod
+    def words_from_token_dicts(token_dicts, words):
+        """ Fill in the words dictionary with (stem, cat) keys and occurrence
+            counts from a list of token dicts of a parsed sentence, in the same
+            way as dump_tokens() does when given a parse tree """
+        for d in token_dicts:
+            kind = d.get("k", TOK.WORD)
+            wt = None
+            if "t" in d and kind != TOK.PUNCTUATION:
+                m = d.get("m")
+                if m is not None:
+                    wt = WordTuple(stem=m[0].replace("-", ""), cat=m[1])
+                elif kind == TOK.ENTITY:
+                    wt = WordTuple(stem=d["x"], cat="entity")
+            if kind == TOK.PERSON and "g" in d:
+                wt = WordTuple(stem=d["v"], cat="person_" + d["g"])
+            if wt is not None:
+                words[wt] += 1
+
     @staticmethod
     def _simplify_tree(tokens, tree, nt_map=None, id_map=None, terminal_map=None):
         """ Return a simplified parse tree for a sentence, including POS-tagged,
@@ -407,21 +427,54 @@ class TreeUtility:
         stats["total_time"] = t2 - t0
         return (pgs, stats, register)
 
+    @staticmethod
+    def _xform_tokens(tokens, tree, err_index):
+        """ Transformation function that simply returns a list of POS-tagged,
+            normalized tokens for the sentence """
+        return TreeUtility.dump_tokens(tokens, tree, None, err_index)
+
+    @staticmethod
+    def _xform_simplified(tokens, tree, err_index):
+        """ Transformation function that yields a simplified parse tree
+            with POS-tagged, normalized terminal leaves for the sentence """
+        if err_index is not None:
+            return TreeUtility.dump_tokens(tokens, tree, None, err_index)
+        # Successfully parsed: return a simplified tree for the sentence
+        return TreeUtility._simplify_tree(tokens, tree)
+
     @staticmethod
     def _process_toklist(parser, session, toklist, xform):
         """ Low-level utility function to parse token lists and return
             the result of a transformation function (xform) for each sentence """
         pgs = []  # Paragraph list, containing sentences, containing tokens
         ip = IncrementalParser(parser, toklist, verbose=True)
-        for p in ip.paragraphs():
-            pgs.append([])
-            for sent in p.sentences():
-                if sent.parse():
-                    # Parsed successfully
-                    pgs[-1].append(xform(sent.tokens, sent.tree, None))
-                else:
-                    # Error in parse
-                    pgs[-1].append(xform(sent.tokens, None, sent.err_index))
+        # Use a pool of parser processes if available, but only for
+        # transformation functions that can be sent to the workers
+        # (i.e. not closures)
+        pool = None
+        if "<locals>" not in xform.__qualname__:
+            pool = ParsePool.instance(parser)
+        if pool is not None:
+            # Submit all sentences up front to be parsed in parallel,
+            # then collect the results in order
+            plist = [list(p.sentences()) for p in ip.paragraphs()]
+            pending = [[pool.submit_xform(sent.tokens, xform) for sent in p] for p in plist]
+            for p, pp in zip(plist, pending):
+                pgs.append([])
+                for sent, r in zip(p, pp):
+                    result, value = r.get()
+                    sent.reuse(result)
+                    pgs[-1].append(value)
+        else:
+            for p in ip.paragraphs():
+                pgs.append([])
+                for sent in p.sentences():
+                    if sent.parse():
+                        # Parsed successfully
+                        pgs[-1].append(xform(sent.tokens, sent.tree, None))
+                    else:
+                        # Error in parse
+                        pgs[-1].append(xform(sent.tokens, None, sent.err_index))
 
         stats = dict(
             num_tokens=ip.num_tokens,
@@ -440,10 +493,7 @@ class TreeUtility:
             where each sentence is a list of tagged tokens. Uses a caller-provided
             parser object. """
 
-        def xform(tokens, tree, err_index):
-            """ Transformation function that simply returns a list of POS-tagged,
-                normalized tokens for the sentence """
-            return TreeUtility.dump_tokens(tokens, tree, None, err_index)
+        xform = TreeUtility._xform_tokens
 
         return TreeUtility._process_text(parser, session, text, all_names, xform)
 
@@ -459,10 +509,7 @@ class TreeUtility:
         """ Parse plain text and return the parsed paragraphs as lists of sentences
             where each sentence is a list of tagged tokens """
 
-        def xform(tokens, tree, err_index):
-            """ Transformation function that simply returns a list of POS-tagged,
-                normalized tokens for the sentence """
-            return TreeUtility.dump_tokens(tokens, tree, None, err_index)
+        xform = TreeUtility._xform_tokens
 
         with Fast_Parser(verbose=False) as parser:  # Don't emit diagnostic messages
             pgs, stats = TreeUtility._process_toklist(parser, session, toklist, xform)
@@ -479,10 +526,7 @@ class TreeUtility:
             where each sentence is a list of tagged tokens. The result does not
             include a name register. """
 
-        def xform(tokens, tree, err_index):
-            """ Transformation function that simply returns a list of POS-tagged,
-                normalized tokens for the sentence """
-            return TreeUtility.dump_tokens(tokens, tree, None, err_index)
+        xform = TreeUtility._xform_tokens
 
         with Fast_Parser(verbose=False, root=root) as parser:
             return TreeUtility._process_toklist(parser, session, toklist, xform)
@@ -491,13 +535,7 @@ class TreeUtility:
     def parse_text(session, text, all_names=False):
         """ Parse plain text and return the parsed paragraphs as simplified trees """
 
-        def xform(tokens, tree, err_index):
-            """ Transformation function that yields a simplified parse tree
-                with POS-tagged, normalized terminal leaves for the sentence """
-            if err_index is not None:
-                return TreeUtility.dump_tokens(tokens, tree, None, err_index)
-            # Successfully parsed: return a simplified tree for the sentence
-            return TreeUtility._simplify_tree(tokens, tree)
+        xform = TreeUtility._xform_simplified
 
         with Fast_Parser(verbose=False) as parser:  # Don't emit diagnostic messages
             return TreeUtility._process_text(parser, session, text, all_names, xform)
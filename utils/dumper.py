@@ -29,7 +29,6 @@
 import getopt
 import sys
 import time
-import json
 
 from contextlib import closing
 from datetime import datetime
@@ -37,6 +36,7 @@ from datetime import datetime
 from settings import Settings, ConfigError
 from scraperdb import Scraper_DB, Article
 from tokenizer import TOK
+import bintokens
 
 
 # Default output file name
@@ -57,106 +57,105 @@ class Dumper:
         pass
 
 
-    def dump(self, tokens_json, file):
-        """ Dump the sentences of a single article to a text file,
-            one sentence per line """
-        tokens = json.loads(tokens_json)
+    def dump(self, doc, file):
+        """ Dump the sentences of a single article, given as a
+            bintokens.TokenDoc, to a text file, one sentence per line """
         skip_punctuation = frozenset(( '„', '“', '”' ))
         abort_punctuation = frozenset(( '…', '|', '#', '@' ))
-        for p in tokens:
-            for sent in p:
-                try:
-                    out = []
-                    wcnt = 0
-                    err = False
-                    for t in sent:
-                        if "err" in t:
-                            err = True
-                            break
-                        kind = t.get("k")
-                        text = t.get("x")
-                        m = t.get("m")
-                        if text:
-                            # Person and entity names may contain spaces,
-                            # but we want to keep them together as single tokens,
-                            # so we replace the spaces with underscores
-                            if kind == TOK.PERSON:
-                                out.append(text.replace(" ", "_") + "/p")
-                                wcnt += 1
-                            elif kind == TOK.ENTITY:
-                                out.append(text.replace(" ", "_") + "/e")
-                                wcnt += 1
-                            elif kind == TOK.PUNCTUATION:
-                                # Skip insignificant punctuation, such as double quotes
-                                if text in abort_punctuation:
-                                    raise Dumper.AbortSentence()
-                                elif text not in skip_punctuation:
-                                    out.append(text)
-                            elif kind == TOK.YEAR:
-                                out.append(text + "/y")
-                                wcnt += 1
-                            elif kind == TOK.AMOUNT:
-                                out.append(text.replace(" ", "_") + "/amt")
-                                wcnt += 1
-                            elif kind == TOK.NUMBER:
-                                out.append(text.replace(" ", "_") + "/n")
-                                wcnt += 1
-                            elif kind == TOK.PERCENT:
-                                out.append(text.replace(" ", "_") + "/pc")
-                                wcnt += 1
-                            elif kind == TOK.CURRENCY:
-                                out.append(text.replace(" ", "_") + "/c")
-                                wcnt += 1
-                            elif kind == TOK.DATE:
-                                out.append(text.replace(" ", "_") + "/d")
-                                wcnt += 1
-                            elif kind == TOK.TIME:
-                                out.append(text.replace(" ", "_") + "/t")
-                                wcnt += 1
-                            elif kind == TOK.TIMESTAMP:
-                                out.append(text.replace(" ", "_") + "/ts")
-                                wcnt += 1
-                            elif kind == TOK.EMAIL:
-                                out.append(text + "/email")
-                                wcnt += 1
-                            elif kind == TOK.URL:
-                                out.append(text + "/url")
-                                wcnt += 1
-                            elif kind == TOK.TELNO:
-                                out.append(text + "/tel")
-                                wcnt += 1
-                            elif kind == TOK.ORDINAL:
-                                out.append(text + "/o")
-                                wcnt += 1
-                            else:
-                                if wcnt == 0 and text[0].isupper():
-                                    # First word in sentence, uppercase and we
-                                    # know its stem: check whether the stem is lowercase
-                                    # and if so, output the word in lowercase as well
-                                    if m is None or not m[0][0].isupper():
-                                        original = text
-                                        text = text[0].lower() + text[1:]
-                                if m is None:
-                                    terminal = t.get("t")
-                                    if terminal is not None:
-                                        if terminal.startswith("sérnafn"):
-                                            out.append(text.replace(" ", "_") + "/s")
-                                        else:
-                                            out.append(text.replace(" ", "_") + "/" + terminal.split("_")[0])
+        # Error sentences are not dumped, so we don't decode them
+        for _, sent in doc.sentences(skip_errors = True):
+            try:
+                out = []
+                wcnt = 0
+                err = False
+                for t in sent:
+                    if "err" in t:
+                        err = True
+                        break
+                    kind = t.get("k")
+                    text = t.get("x")
+                    m = t.get("m")
+                    if text:
+                        # Person and entity names may contain spaces,
+                        # but we want to keep them together as single tokens,
+                        # so we replace the spaces with underscores
+                        if kind == TOK.PERSON:
+                            out.append(text.replace(" ", "_") + "/p")
+                            wcnt += 1
+                        elif kind == TOK.ENTITY:
+                            out.append(text.replace(" ", "_") + "/e")
+                            wcnt += 1
+                        elif kind == TOK.PUNCTUATION:
+                            # Skip insignificant punctuation, such as double quotes
+                            if text in abort_punctuation:
+                                raise Dumper.AbortSentence()
+                            elif text not in skip_punctuation:
+                                out.append(text)
+                        elif kind == TOK.YEAR:
+                            out.append(text + "/y")
+                            wcnt += 1
+                        elif kind == TOK.AMOUNT:
+                            out.append(text.replace(" ", "_") + "/amt")
+                            wcnt += 1
+                        elif kind == TOK.NUMBER:
+                            out.append(text.replace(" ", "_") + "/n")
+                            wcnt += 1
+                        elif kind == TOK.PERCENT:
+                            out.append(text.replace(" ", "_") + "/pc")
+                            wcnt += 1
+                        elif kind == TOK.CURRENCY:
+                            out.append(text.replace(" ", "_") + "/c")
+                            wcnt += 1
+                        elif kind == TOK.DATE:
+                            out.append(text.replace(" ", "_") + "/d")
+                            wcnt += 1
+                        elif kind == TOK.TIME:
+                            out.append(text.replace(" ", "_") + "/t")
+                            wcnt += 1
+                        elif kind == TOK.TIMESTAMP:
+                            out.append(text.replace(" ", "_") + "/ts")
+                            wcnt += 1
+                        elif kind == TOK.EMAIL:
+                            out.append(text + "/email")
+                            wcnt += 1
+                        elif kind == TOK.URL:
+                            out.append(text + "/url")
+                            wcnt += 1
+                        elif kind == TOK.TELNO:
+                            out.append(text + "/tel")
+                            wcnt += 1
+                        elif kind == TOK.ORDINAL:
+                            out.append(text + "/o")
+                            wcnt += 1
+                        else:
+                            if wcnt == 0 and text[0].isupper():
+                                # First word in sentence, uppercase and we
+                                # know its stem: check whether the stem is lowercase
+                                # and if so, output the word in lowercase as well
+                                if m is None or not m[0][0].isupper():
+                                    original = text
+                                    text = text[0].lower() + text[1:]
+                            if m is None:
+                                terminal = t.get("t")
+                                if terminal is not None:
+                                    if terminal.startswith("sérnafn"):
+                                        out.append(text.replace(" ", "_") + "/s")
                                     else:
-                                        # print("No meaning associated with {0}".format(t))
-                                        out.append(text.replace(" ", "_") + "/x")
+                                        out.append(text.replace(" ", "_") + "/" + terminal.split("_")[0])
                                 else:
-                                    out.append(text.replace(" ", "_") + "/" + m[1])  # Add word category
-                                wcnt += 1
-                    if out and not err:
-                        line = " ".join(out)
-                        if line != "." and not line.startswith("mbl.is/unk /"):
-                            print(line, file = file)
-                except Dumper.AbortSentence:
-                    # If a sentence contains particular 'stop tokens',
-                    # don't write it to the result file
-                    pass
+                                    # print("No meaning associated with {0}".format(t))
+                                    out.append(text.replace(" ", "_") + "/x")
+                            else:
+                                out.append(text.replace(" ", "_") + "/" + m[1])  # Add word category
+                            wcnt += 1
+                if out and not err:
+                    line = " ".join(out)
+                    if line != "." and not line.startswith("mbl.is/unk /"):
+                        print(line, file = file)
+            except Dumper.AbortSentence:
+                # If a sentence contains particular 'stop tokens',
+                # don't write it to the result file
+                pass
 
 
     def go(self, output, limit):
@@ -166,7 +165,10 @@ class Dumper:
         with closing(db.session) as session, open(output, "w") as file:
 
             """ Go through parsed articles and process them """
-            q = session.query(Article.tokens).filter(Article.tree != None)
+            q = (
+                session.query(Article.tokens, Article.tokens_bin)
+                .filter(Article.tree != None)
+            )
             if limit > 0:
                 q = q[0:limit]
             else:
@@ -175,7 +177,9 @@ class Dumper:
             for a in q:
                 if cnt % 1000 == 0:
                     print("Dumped {0} articles".format(cnt), end=chr(13))
-                self.dump(a.tokens, file)
+                doc = bintokens.load(a.tokens_bin, a.tokens)
+                if doc is not None:
+                    self.dump(doc, file)
                 cnt += 1
             print("Dumped {0} articles".format(cnt), end=chr(13))
 
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+"""
+
+    Reynir: Natural language processing for Icelandic
+
+    Content extraction benchmark
+
+    Copyright (C) 2018 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+    This utility program compares the two ways of finding the text of an
+    article in its stored HTML: building a BeautifulSoup tree and calling
+    the scrape helper's get_content(), or using lxml with the helper's
+    content selectors (see fastextract.py).
+
+    For a sample of the most recently scraped articles of each root, it
+    reports the average time per article of each path, the speedup, and
+    the proportion of articles for which the two paths yield the same
+    text. The fast path is only available for helpers that declare
+    content selectors, and only if lxml and cssselect are installed.
+
+"""
+
+import os
+import sys
+import getopt
+import time
+
+# Hack to make this Python program executable from the utils subdirectory
+basepath, _ = os.path.split(os.path.realpath(__file__))
+_UTILS = os.sep + "utils"
+if basepath.endswith(_UTILS):
+    basepath = basepath[0:-len(_UTILS)]
+    sys.path.append(basepath)
+
+from settings import Settings, ConfigError
+from fetcher import Fetcher
+from fastextract import FastExtractor, HAS_LXML
+from scraperdb import SessionContext, Root, Article as ArticleRow, desc
+
+
+def _soup_text(html, helper):
+    """ Extract the text of an article by way of the soup """
+    soup = Fetcher.make_soup(html, helper)
+    content = helper.get_content(soup) if soup is not None else None
+    return Fetcher.content_text(content) if content else None
+
+
+def _bench_root(session, root, samples, show_diff):
+    """ Run the benchmark on a sample of the articles of a root,
+        returning a tuple of the results or None if not applicable """
+    helper = Fetcher._get_helper(root)
+    if helper is None or FastExtractor.for_helper(helper) is None:
+        return None
+    q = (
+        session
+        .query(ArticleRow.url, ArticleRow.html)
+        .filter(ArticleRow.root_id == root.id)
+        .filter(ArticleRow.html != None)
+        .order_by(desc(ArticleRow.scraped))
+        .limit(samples)
+    )
+    n = same = fallback = 0
+    soup_time = fast_time = 0.0
+    for url, html in q:
+        t0 = time.time()
+        soup_text = _soup_text(html, helper)
+        t1 = time.time()
+        fast_text = Fetcher.fast_content_text(html, helper)
+        t2 = time.time()
+        n += 1
+        soup_time += t1 - t0
+        fast_time += t2 - t1
+        if fast_text is None:
+            # The fast path found nothing and would fall back to the soup
+            fallback += 1
+        elif fast_text == soup_text:
+            same += 1
+        elif show_diff:
+            print("\n{0}\n  soup: {1}\n  lxml: {2}".format(url, soup_text, fast_text))
+    return n, soup_time, fast_time, same, fallback
+
+
+def _run(samples, domain, show_diff):
+    """ Run the benchmark on the roots of the database """
+    print(
+        "\n{0:<24} {1:>7} {2:>10} {3:>10} {4:>8} {5:>7} {6:>9}".format(
+            "Domain", "Samples", "Soup ms", "lxml ms", "Speedup", "Same", "Fallback"
+        )
+    )
+    total_n = 0
+    total_soup = total_fast = 0.0
+    with SessionContext(read_only=True) as session:
+        q = session.query(Root).filter(Root.scrape == True).order_by(Root.domain)
+        if domain:
+            q = q.filter(Root.domain == domain)
+        for root in q.all():
+            result = _bench_root(session, root, samples, show_diff)
+            if result is None:
+                print("{0:<24} {1:>7}".format(root.domain, "-"))
+                continue
+            n, soup_time, fast_time, same, fallback = result
+            if not n:
+                continue
+            total_n += n
+            total_soup += soup_time
+            total_fast += fast_time
+            print(
+                "{0:<24} {1:>7} {2:>10.2f} {3:>10.2f} {4:>7.1f}x {5:>6.0%} {6:>9}"
+                .format(
+                    root.domain, n,
+                    1000.0 * soup_time / n, 1000.0 * fast_time / n,
+                    soup_time / fast_time if fast_time else 0.0,
+                    same / n, fallback,
+                )
+            )
+    if total_n:
+        print(
+            "\nTotal: {0} articles, {1:.2f} ms per article with the soup, "
+            "{2:.2f} ms with lxml"
+            .format(total_n, 1000.0 * total_soup / total_n, 1000.0 * total_fast / total_n)
+        )
+
+
+class Usage(Exception):
+
+    def __init__(self, msg):
+        self.msg = msg
+
+
+__doc__ = """
+
+    Reynir - Natural language processing for Icelandic
+
+    Content extraction benchmark
+
+    Usage:
+        python extractbench.py [options]
+
+    Options:
+        -h, --help: Show this help text
+        -n N, --samples=N: Number of articles per root (default 50)
+        -d DOMAIN, --domain=DOMAIN: Only benchmark the roots of this domain
+        -v, --diff: Show the articles whose text differs between the paths
+
+"""
+
+
+def main(argv=None):
+    """ Guido van Rossum's pattern for a Python main function """
+
+    if argv is None:
+        argv = sys.argv
+    try:
+        try:
+            opts, args = getopt.getopt(
+                argv[1:], "hn:d:v", ["help", "samples=", "domain=", "diff"]
+            )
+        except getopt.error as msg:
+            raise Usage(msg)
+        samples = 50
+        domain = None
+        show_diff = False
+        # Process options
+        for o, a in opts:
+            if o in ("-h", "--help"):
+                print(__doc__)
+                return 0
+            elif o in ("-n", "--samples"):
+                try:
+                    samples = max(1, int(a))
+                except ValueError:
+                    pass
+            elif o in ("-d", "--domain"):
+                domain = a
+            elif o in ("-v", "--diff"):
+                show_diff = True
+
+        if not HAS_LXML:
+            print("lxml and cssselect must be installed", file=sys.stderr)
+            return 2
+
+        # Read the configuration settings file
+        try:
+            Settings.read(os.path.join(basepath, "config", "Reynir.conf"))
+        except ConfigError as e:
+            print("Configuration error: {0}".format(e), file=sys.stderr)
+            return 2
+
+        _run(samples, domain, show_diff)
+
+    except Usage as err:
+        print(err.msg, file=sys.stderr)
+        print("For help use --help", file=sys.stderr)
+        return 2
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
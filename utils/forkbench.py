@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+"""
+
+    Reynir: Natural language processing for Icelandic
+
+    Warm fork benchmark
+
+    Copyright (C) 2018 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+    This utility program measures the effect of preloading the grammar
+    and the BIN lexicon in a parent process before forking worker
+    processes (see preload.py). It forks a number of workers, first from
+    a cold parent and then from a preloaded one, and reports for each
+    worker the time from the fork until its first sentence was parsed,
+    and its resident (RSS), proportional (PSS), shared and private
+    memory after the parse. The database is not used.
+
+"""
+
+import os
+import sys
+import getopt
+import time
+import json
+
+# Hack to make this Python program executable from the utils subdirectory
+basepath, _ = os.path.split(os.path.realpath(__file__))
+_UTILS = os.sep + "utils"
+if basepath.endswith(_UTILS):
+    basepath = basepath[0:-len(_UTILS)]
+    sys.path.append(basepath)
+
+from settings import Settings, ConfigError
+
+
+_SENTENCE = "Hundurinn elti köttinn upp í tré í garðinum í gær."
+
+
+def _first_parse():
+    """ Parse a sentence, as a freshly forked worker would """
+    # Import here, so that the import time is included in a cold worker
+    from reynir.bintokenizer import tokenize
+    from reynir.fastparser import Fast_Parser
+    from incparser import IncrementalParser
+
+    with Fast_Parser(verbose=False) as parser:
+        ip = IncrementalParser(parser, list(tokenize(_SENTENCE)))
+        for p in ip.paragraphs():
+            for sent in p.sentences():
+                sent.parse()
+
+
+def _run_workers(processes):
+    """ Fork worker processes, each parsing a sentence, and return
+        a list of their (time to first parse, memory usage) results """
+    from preload import memory_usage
+
+    workers = []
+    for _ in range(processes):
+        rfd, wfd = os.pipe()
+        # The workers wait for this pipe to close before exiting, so
+        # that they are all alive when their memory is measured
+        hold_r, hold_w = os.pipe()
+        t0 = time.time()
+        pid = os.fork()
+        if pid == 0:
+            os.close(rfd)
+            os.close(hold_w)
+            # Don't hold on to the pipes of the previously forked workers
+            for _, prev_rfd, prev_hold_w in workers:
+                os.close(prev_rfd)
+                os.close(prev_hold_w)
+            try:
+                _first_parse()
+                elapsed = time.time() - t0
+                with os.fdopen(wfd, "w") as f:
+                    f.write(json.dumps([elapsed, memory_usage()]))
+                os.read(hold_r, 1)
+            finally:
+                os._exit(0)
+        os.close(wfd)
+        os.close(hold_r)
+        workers.append((pid, rfd, hold_w))
+    results = []
+    for pid, rfd, hold_w in workers:
+        with os.fdopen(rfd, "r") as f:
+            results.append(json.loads(f.read() or "null"))
+    for pid, rfd, hold_w in workers:
+        os.close(hold_w)
+        os.waitpid(pid, 0)
+    return results
+
+
+def _report(title, parent, results):
+    """ Print the results of a run """
+    print("\n{0}".format(title))
+    if parent is not None:
+        print(
+            "Parent: RSS {0:.0f} MB, shared {1:.0f} MB, private {2:.0f} MB".format(
+                parent["rss"], parent["shared"], parent["private"]
+            )
+        )
+    print(
+        "{0:>6} {1:>10} {2:>8} {3:>8} {4:>8} {5:>8}".format(
+            "Worker", "1st parse", "RSS", "PSS", "Shared", "Private"
+        )
+    )
+    total_pss = 0.0
+    for i, r in enumerate(results):
+        if r is None:
+            print("{0:>6} failed".format(i + 1))
+            continue
+        elapsed, m = r
+        total_pss += m["pss"]
+        print(
+            "{0:>6} {1:>9.2f}s {2:>5.0f} MB {3:>5.0f} MB {4:>5.0f} MB {5:>5.0f} MB".format(
+                i + 1, elapsed, m["rss"], m["pss"], m["shared"], m["private"]
+            )
+        )
+    print("Total PSS of workers: {0:.0f} MB".format(total_pss))
+
+
+def _run(processes, warm):
+    """ Run the benchmark in a child process, so that each
+        run starts with a cold parent """
+    pid = os.fork()
+    if pid == 0:
+        try:
+            from preload import preload, memory_usage
+
+            parent = None
+            if warm:
+                elapsed = preload()
+                parent = memory_usage()
+                title = "Warm fork (preloaded in {0:.2f} seconds)".format(elapsed)
+            else:
+                title = "Cold fork"
+            _report(title, parent, _run_workers(processes))
+            sys.stdout.flush()
+        finally:
+            os._exit(0)
+    os.waitpid(pid, 0)
+
+
+class Usage(Exception):
+
+    def __init__(self, msg):
+        self.msg = msg
+
+
+__doc__ = """
+
+    Reynir - Natural language processing for Icelandic
+
+    Warm fork benchmark
+
+    Usage:
+        python forkbench.py [options]
+
+    Options:
+        -h, --help: Show this help text
+        -p N, --processes=N: Number of worker processes to fork (default 4)
+
+"""
+
+
+def main(argv=None):
+    """ Guido van Rossum's pattern for a Python main function """
+
+    if argv is None:
+        argv = sys.argv
+    try:
+        try:
+            opts, args = getopt.getopt(argv[1:], "hp:", ["help", "processes="])
+        except getopt.error as msg:
+            raise Usage(msg)
+        processes = 4
+        # Process options
+        for o, a in opts:
+            if o in ("-h", "--help"):
+                print(__doc__)
+                return 0
+            elif o in ("-p", "--processes"):
+                try:
+                    processes = max(1, int(a))
+                except ValueError:
+                    pass
+
+        # Read the configuration settings file
+        try:
+            Settings.read(os.path.join(basepath, "config", "Reynir.conf"))
+        except ConfigError as e:
+            print("Configuration error: {0}".format(e), file=sys.stderr)
+            return 2
+
+        _run(processes, warm=False)
+        _run(processes, warm=True)
+
+    except Usage as err:
+        print(err.msg, file=sys.stderr)
+        print("For help use --help", file=sys.stderr)
+        return 2
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+"""
+
+    Reynir: Natural language processing for Icelandic
+
+    HTML blob migration utility
+
+    Copyright (C) 2018 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+    This utility program moves the HTML of the articles in the scraper
+    database from the articles table into the compressed, content-addressed
+    blob store (see htmlstore.py), deletes blobs that are no longer
+    referred to, and reports the space used by the HTML in each form.
+
+    The articles are moved in batches, each in its own transaction, so the
+    migration can be interrupted and resumed, and can run while the scraper
+    is running. Note that PostgreSQL only returns the space freed in the
+    articles table to the operating system after a VACUUM FULL.
+
+"""
+
+import os
+import sys
+import getopt
+import time
+
+# Hack to make this Python program executable from the utils subdirectory
+basepath, _ = os.path.split(os.path.realpath(__file__))
+_UTILS = os.sep + "utils"
+if basepath.endswith(_UTILS):
+    basepath = basepath[0:-len(_UTILS)]
+    sys.path.append(basepath)
+
+from settings import Settings, ConfigError
+from scraperdb import SessionContext, HtmlBlob, Article as ArticleRow, dbfunc
+from htmlstore import store_html, HAS_ZSTD
+
+
+_MB = 1024.0 * 1024.0
+
+
+def _migrate(batch, limit):
+    """ Move the inline HTML of articles into the blob store """
+    moved = 0
+    freed = 0
+    t0 = time.time()
+    while not limit or moved < limit:
+        n = batch if not limit else min(batch, limit - moved)
+        with SessionContext(commit=True) as session:
+            rows = (
+                session
+                .query(
+                    ArticleRow.id,
+                    ArticleRow.html,
+                    dbfunc.pg_column_size(ArticleRow.html),
+                )
+                .filter(ArticleRow.html != None)
+                .limit(n)
+                .with_for_update(skip_locked=True)
+                .all()
+            )
+            if not rows:
+                break
+            for uuid, html, stored in rows:
+                key = store_html(session, html)
+                session.query(ArticleRow).filter(ArticleRow.id == uuid).update(
+                    dict(html=None, html_hash=key), synchronize_session=False
+                )
+                freed += stored or 0
+        moved += len(rows)
+        print(
+            "Moved {0} articles, {1:.1f} MB of inline HTML, in {2:.1f} seconds"
+            .format(moved, freed / _MB, time.time() - t0)
+        )
+    return moved
+
+
+def _purge():
+    """ Delete the blobs that no article refers to """
+    with SessionContext(commit=True) as session:
+        n = HtmlBlob.purge(session)
+    print("Deleted {0} unreferenced blobs".format(n))
+
+
+def _report():
+    """ Report the space used by the articles' HTML """
+    with SessionContext(read_only=True) as session:
+        s = HtmlBlob.space(session)
+    print(
+        "\nInline: {0} articles, {1:.1f} MB of HTML stored in {2:.1f} MB"
+        .format(s["inline_articles"], s["inline_size"] / _MB, s["inline_stored"] / _MB)
+    )
+    print(
+        "Blobs: {0} articles in {1} blobs, {2:.1f} MB of HTML stored in {3:.1f} MB"
+        .format(
+            s["blob_articles"], s["blobs"], s["blob_size"] / _MB, s["blob_stored"] / _MB
+        )
+    )
+    if s["blob_stored"]:
+        print(
+            "Compression ratio of blobs: {0:.1f}, articles per blob: {1:.2f}"
+            .format(s["blob_size"] / s["blob_stored"], s["blob_articles"] / s["blobs"])
+        )
+    print(
+        "Tables: articles {0:.1f} MB, htmlblobs {1:.1f} MB (including indexes and TOAST)"
+        .format(s["articles_table"] / _MB, s["blobs_table"] / _MB)
+    )
+
+
+class Usage(Exception):
+
+    def __init__(self, msg):
+        self.msg = msg
+
+
+__doc__ = """
+
+    Reynir - Natural language processing for Icelandic
+
+    HTML blob migration utility
+
+    Usage:
+        python htmlblobs.py [options]
+
+    Options:
+        -h, --help: Show this help text
+        -m, --migrate: Move the inline HTML of articles into the blob store
+        -b N, --batch=N: Number of articles moved per transaction (default 100)
+        -l N, --limit=N: Maximum number of articles to move (default no limit)
+        -p, --purge: Delete blobs that no article refers to
+
+    The space used by the HTML is reported in any case.
+
+"""
+
+
+def main(argv=None):
+    """ Guido van Rossum's pattern for a Python main function """
+
+    if argv is None:
+        argv = sys.argv
+    try:
+        try:
+            opts, args = getopt.getopt(
+                argv[1:], "hmb:l:p", ["help", "migrate", "batch=", "limit=", "purge"]
+            )
+        except getopt.error as msg:
+            raise Usage(msg)
+        migrate = False
+        purge = False
+        batch = 100
+        limit = 0
+        # Process options
+        for o, a in opts:
+            if o in ("-h", "--help"):
+                print(__doc__)
+                return 0
+            elif o in ("-m", "--migrate"):
+                migrate = True
+            elif o in ("-p", "--purge"):
+                purge = True
+            elif o in ("-b", "--batch"):
+                try:
+                    batch = max(1, int(a))
+                except ValueError:
+                    pass
+            elif o in ("-l", "--limit"):
+                try:
+                    limit = max(0, int(a))
+                except ValueError:
+                    pass
+
+        # Read the configuration settings file
+        try:
+            Settings.read(os.path.join(basepath, "config", "Reynir.conf"))
+        except ConfigError as e:
+            print("Configuration error: {0}".format(e), file=sys.stderr)
+            return 2
+
+        if migrate:
+            if not HAS_ZSTD:
+                print("The zstandard package is not installed: compressing with zlib")
+            _report()
+            _migrate(batch, limit)
+        if purge:
+            _purge()
+        _report()
+
+    except Usage as err:
+        print(err.msg, file=sys.stderr)
+        print("For help use --help", file=sys.stderr)
+        return 2
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+"""
+
+    Reynir: Natural language processing for Icelandic
+
+    Parallel parsing benchmark
+
+    Copyright (C) 2018 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+    This utility program measures the latency of parsing a fixed set of
+    long articles, first serially and then with a pool of parser processes
+    (see parsepool.py), and verifies that both yield identical results.
+    The set consists of the articles with the most sentences, unless
+    article ids are given on the command line. The sentence cache is
+    disabled and nothing is written to the database.
+
+"""
+
+import os
+import sys
+import getopt
+import time
+
+# Hack to make this Python program executable from the utils subdirectory
+basepath, _ = os.path.split(os.path.realpath(__file__))
+_UTILS = os.sep + "utils"
+if basepath.endswith(_UTILS):
+    basepath = basepath[0:-len(_UTILS)]
+    sys.path.append(basepath)
+
+from settings import Settings, ConfigError
+from scraperdb import SessionContext, Article as ArticleRow, desc
+from article import Article
+from parsepool import ParsePool
+
+
+def _article_ids(limit):
+    """ Return the ids of the parsed articles with the most sentences """
+    with SessionContext(read_only=True) as session:
+        q = (
+            session.query(ArticleRow.id)
+            .filter(ArticleRow.tree != None)
+            .order_by(desc(ArticleRow.num_sentences), ArticleRow.id)
+            .limit(limit)
+        )
+        return [r.id for r in q]
+
+
+def _parse_all(ids):
+    """ Parse the given articles, returning a list of
+        (id, elapsed time, number of sentences, result) tuples """
+    results = []
+    with SessionContext(read_only=True) as session:
+        for uuid in ids:
+            a = Article.load_from_uuid(uuid, session, for_parse=True)
+            if a is None:
+                print("Article {0} not found".format(uuid), file=sys.stderr)
+                continue
+            t0 = time.time()
+            a._parse(session)
+            elapsed = time.time() - t0
+            results.append((uuid, elapsed, a.num_sentences, (a.tree, a.tokens)))
+    return results
+
+
+def bench(ids, processes):
+    """ Parse the articles serially and in parallel, and compare """
+    # Each sentence must actually be parsed in both runs
+    Settings.SENTENCE_CACHE = False
+    print("Articles: {0}".format(len(ids)))
+    # Load the parser before measuring anything
+    Article.get_parser()
+
+    Settings.PARSE_POOL = 0
+    serial = _parse_all(ids)
+
+    Settings.PARSE_POOL = processes
+    # Start the pool before measuring, as it would be in a web server
+    ParsePool.instance(Article.get_parser())
+    parallel = _parse_all(ids)
+
+    print(
+        "{0:<36} {1:>9} {2:>9} {3:>9} {4:>8}".format(
+            "Article", "Sentences", "Serial", "Parallel", "Speedup"
+        )
+    )
+    total_serial = total_parallel = 0.0
+    mismatches = 0
+    for (uuid, ts, num_sent, rs), (_, tp, _, rp) in zip(serial, parallel):
+        total_serial += ts
+        total_parallel += tp
+        if rs != rp:
+            mismatches += 1
+        print(
+            "{0:<36} {1:>9} {2:>8.2f}s {3:>8.2f}s {4:>7.2f}x{5}".format(
+                uuid,
+                num_sent,
+                ts,
+                tp,
+                ts / tp if tp else 0.0,
+                "" if rs == rp else " MISMATCH",
+            )
+        )
+    print(
+        "Total: serial {0:.2f}s, parallel with {1} processes {2:.2f}s, "
+        "speedup {3:.2f}x".format(
+            total_serial,
+            processes,
+            total_parallel,
+            total_serial / total_parallel if total_parallel else 0.0,
+        )
+    )
+    if mismatches:
+        print("{0} articles had different results in parallel mode".format(mismatches))
+        return False
+    print("All results identical")
+    return True
+
+
+class Usage(Exception):
+
+    def __init__(self, msg):
+        self.msg = msg
+
+
+__doc__ = """
+
+    Reynir - Natural language processing for Icelandic
+
+    Parallel parsing benchmark
+
+    Usage:
+        python parsebench.py [options] [article_id ...]
+
+    Options:
+        -h, --help: Show this help text
+        -l N, --limit=N: Use the N articles with the most sentences (default 10)
+        -p N, --processes=N: Number of parser processes in the pool (default 4)
+
+"""
+
+
+def main(argv=None):
+    """ Guido van Rossum's pattern for a Python main function """
+
+    if argv is None:
+        argv = sys.argv
+    try:
+        try:
+            opts, args = getopt.getopt(
+                argv[1:], "hl:p:", ["help", "limit=", "processes="]
+            )
+        except getopt.error as msg:
+            raise Usage(msg)
+        limit = 10
+        processes = 4
+        # Process options
+        for o, a in opts:
+            if o in ("-h", "--help"):
+                print(__doc__)
+                return 0
+            elif o in ("-l", "--limit"):
+                try:
+                    limit = int(a)
+                except ValueError:
+                    pass
+            elif o in ("-p", "--processes"):
+                try:
+                    processes = max(1, int(a))
+                except ValueError:
+                    pass
+
+        # Read the configuration settings file
+        try:
+            Settings.read(os.path.join(basepath, "config", "Reynir.conf"))
+        except ConfigError as e:
+            print("Configuration error: {0}".format(e), file=sys.stderr)
+            return 2
+
+        ids = args or _article_ids(limit)
+        if not bench(ids, processes):
+            return 1
+
+    except Usage as err:
+        print(err.msg, file=sys.stderr)
+        print("For help use --help", file=sys.stderr)
+        return 2
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
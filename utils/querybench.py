@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+"""
+
+    Reynir: Natural language processing for Icelandic
+
+    Article query benchmark
+
+    Copyright (C) 2018 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+    This utility program measures the effect of deferring the large
+    columns of the articles table (html, content_text, tree, tree_bin,
+    tokens, tokens_bin and topic_vector, see scraperdb.py) on the main
+    queries that list articles.
+
+    Each query is run with all columns loaded, as before the columns were
+    deferred, and then as it is now run, loading the metadata only or the
+    column groups that its caller needs. The median elapsed time of a
+    number of runs of each is reported.
+
+"""
+
+import os
+import sys
+import getopt
+import time
+from datetime import datetime
+
+# Hack to make this Python program executable from the utils subdirectory
+basepath, _ = os.path.split(os.path.realpath(__file__))
+_UTILS = os.sep + "utils"
+if basepath.endswith(_UTILS):
+    basepath = basepath[0:-len(_UTILS)]
+    sys.path.append(basepath)
+
+from settings import Settings, ConfigError
+from scraperdb import SessionContext, Root, Article as ArticleRow, desc, undefer_group
+
+
+# The deferred column groups of article rows
+_ALL_GROUPS = ("content", "tree", "tokens", "topic")
+
+
+def _top_news(session, groups, limit):
+    """ The article list of the front page (see main.top_news()) """
+    return (
+        session
+        .query(ArticleRow)
+        .options(*(undefer_group(g) for g in groups))
+        .filter(ArticleRow.tree != None)
+        .filter(ArticleRow.timestamp != None)
+        .filter(ArticleRow.timestamp <= datetime.utcnow())
+        .filter(ArticleRow.heading > "")
+        .filter(ArticleRow.num_sentences > 0)
+        .join(Root)
+        .filter(Root.visible == True)
+        .distinct()
+        .order_by(desc(ArticleRow.timestamp))
+        .limit(limit)
+        .all()
+    )
+
+
+def _unparsed(session, groups, limit):
+    """ The articles to be parsed by the scraper (see Scraper.go()) """
+    return (
+        session
+        .query(ArticleRow)
+        .options(*(undefer_group(g) for g in groups))
+        .filter(ArticleRow.scraped != None)
+        .filter(ArticleRow.tree == None)
+        .filter(ArticleRow.root_id != None)
+        .limit(limit)
+        .all()
+    )
+
+
+def _parsed(session, groups, limit):
+    """ Parsed articles, as iterated by Article.articles() """
+    return (
+        session
+        .query(ArticleRow)
+        .options(*(undefer_group(g) for g in groups))
+        .filter(ArticleRow.tree != None)
+        .order_by(desc(ArticleRow.parsed))
+        .limit(limit)
+        .all()
+    )
+
+
+# The benchmarked queries: name, function, row limit, and the column
+# groups that are loaded by the current code
+_QUERIES = (
+    ("top_news", _top_news, 20, ()),
+    ("unparsed articles", _unparsed, 1000, ()),
+    ("Article.articles()", _parsed, 1000, ("tree", "tokens")),
+)
+
+
+def _time(func, groups, limit, runs):
+    """ Run a query a number of times, returning the median elapsed
+        time in seconds and the number of rows """
+    times = []
+    rows = 0
+    for _ in range(runs):
+        with SessionContext(read_only=True) as session:
+            t0 = time.time()
+            rows = len(func(session, groups, limit))
+            times.append(time.time() - t0)
+    times.sort()
+    return times[len(times) // 2], rows
+
+
+def _run(runs):
+    """ Run all the queries, before and after """
+    print(
+        "\n{0:<24} {1:>6} {2:>12} {3:>12} {4:>8}".format(
+            "Query", "Rows", "Before ms", "After ms", "Speedup"
+        )
+    )
+    for name, func, limit, groups in _QUERIES:
+        before, rows = _time(func, _ALL_GROUPS, limit, runs)
+        after, _ = _time(func, groups, limit, runs)
+        print(
+            "{0:<24} {1:>6} {2:>12.1f} {3:>12.1f} {4:>7.1f}x".format(
+                name, rows, 1000.0 * before, 1000.0 * after,
+                before / after if after else 0.0
+            )
+        )
+
+
+class Usage(Exception):
+
+    def __init__(self, msg):
+        self.msg = msg
+
+
+__doc__ = """
+
+    Reynir - Natural language processing for Icelandic
+
+    Article query benchmark
+
+    Usage:
+        python querybench.py [options]
+
+    Options:
+        -h, --help: Show this help text
+        -r N, --runs=N: Number of runs of each query (default 5)
+
+"""
+
+
+def main(argv=None):
+    """ Guido van Rossum's pattern for a Python main function """
+
+    if argv is None:
+        argv = sys.argv
+    try:
+        try:
+            opts, args = getopt.getopt(argv[1:], "hr:", ["help", "runs="])
+        except getopt.error as msg:
+            raise Usage(msg)
+        runs = 5
+        # Process options
+        for o, a in opts:
+            if o in ("-h", "--help"):
+                print(__doc__)
+                return 0
+            elif o in ("-r", "--runs"):
+                try:
+                    runs = max(1, int(a))
+                except ValueError:
+                    pass
+
+        # Read the configuration settings file
+        try:
+            Settings.read(os.path.join(basepath, "config", "Reynir.conf"))
+        except ConfigError as e:
+            print("Configuration error: {0}".format(e), file=sys.stderr)
+            return 2
+
+        _run(runs)
+
+    except Usage as err:
+        print(err.msg, file=sys.stderr)
+        print("For help use --help", file=sys.stderr)
+        return 2
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+"""
+
+    Reynir: Natural language processing for Icelandic
+
+    Token format converter
+
+    Copyright (C) 2018 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+    This utility program converts the tokens of already parsed articles
+    from the JSON string format to the compact, sentence-indexed format
+    (see bintokens.py), storing the result in the articles.tokens_bin
+    column and clearing the JSON string. The column is added to the
+    articles table if it does not exist.
+
+"""
+
+import os
+import sys
+import getopt
+import time
+
+# Hack to make this Python program executable from the utils subdirectory
+basepath, _ = os.path.split(os.path.realpath(__file__))
+_UTILS = os.sep + "utils"
+if basepath.endswith(_UTILS):
+    basepath = basepath[0:-len(_UTILS)]
+    sys.path.append(basepath)
+
+from settings import Settings, ConfigError
+from scraperdb import SessionContext, Article, undefer_group
+import bintokens
+
+
+# Number of articles to convert in each transaction
+BATCH_SIZE = 500
+
+
+def add_column():
+    """ Add the tokens_bin column to the articles table, if not already there """
+    SessionContext.db.execute(
+        "ALTER TABLE articles ADD COLUMN IF NOT EXISTS tokens_bin bytea;"
+    )
+
+
+def convert(limit, keep_json):
+    """ Convert JSON tokens to the compact format, in batches """
+    add_column()
+    cnt = 0
+    json_bytes = 0
+    bin_bytes = 0
+    t0 = time.time()
+    while limit is None or cnt < limit:
+        batch = BATCH_SIZE if limit is None else min(BATCH_SIZE, limit - cnt)
+        with SessionContext(commit=True) as session:
+            q = (
+                session.query(Article)
+                .options(undefer_group("tokens"))
+                .filter(Article.tokens != None)
+                .filter(Article.tokens_bin == None)
+                .limit(batch)
+                .all()
+            )
+            if not q:
+                break
+            for a in q:
+                doc = bintokens.TokenDoc.from_json(a.tokens)
+                a.tokens_bin = bintokens.encode(doc.to_list())
+                json_bytes += len(a.tokens.encode("utf-8"))
+                bin_bytes += len(a.tokens_bin)
+                if not keep_json:
+                    a.tokens = None
+                cnt += 1
+        print("Converted {0} articles".format(cnt), end=chr(13))
+    t1 = time.time()
+    print("\nConverted {0} articles in {1:.2f} seconds".format(cnt, t1 - t0))
+    if json_bytes:
+        print(
+            "JSON tokens: {0:,} bytes; compact tokens: {1:,} bytes ({2:.1f}%)".format(
+                json_bytes, bin_bytes, 100.0 * bin_bytes / json_bytes
+            )
+        )
+
+
+class Usage(Exception):
+
+    def __init__(self, msg):
+        self.msg = msg
+
+
+__doc__ = """
+
+    Reynir - Natural language processing for Icelandic
+
+    Token format converter
+
+    Usage:
+        python tokenconv.py [options]
+
+    Options:
+        -h, --help: Show this help text
+        -l N, --limit=N: Limit processing to N articles
+        -k, --keep: Keep the JSON token string after conversion
+
+"""
+
+
+def main(argv=None):
+    """ Guido van Rossum's pattern for a Python main function """
+
+    if argv is None:
+        argv = sys.argv
+    try:
+        try:
+            opts, args = getopt.getopt(argv[1:], "hl:k", ["help", "limit=", "keep"])
+        except getopt.error as msg:
+            raise Usage(msg)
+        limit = None
+        keep_json = False
+        # Process options
+        for o, a in opts:
+            if o in ("-h", "--help"):
+                print(__doc__)
+                return 0
+            elif o in ("-l", "--limit"):
+                try:
+                    limit = int(a)
+                except ValueError:
+                    pass
+            elif o in ("-k", "--keep"):
+                keep_json = True
+
+        # Read the configuration settings file
+        try:
+            Settings.read(os.path.join(basepath, "config", "Reynir.conf"))
+        except ConfigError as e:
+            print("Configuration error: {0}".format(e), file=sys.stderr)
+            return 2
+
+        convert(limit, keep_json)
+
+    except Usage as err:
+        print(err.msg, file=sys.stderr)
+        print("For help use --help", file=sys.stderr)
+        return 2
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
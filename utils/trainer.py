@@ -39,7 +39,7 @@ if basepath.endswith(_UTILS):
 
 from bindb import BIN_Db
 from settings import Settings, ConfigError
-from article import Article
+from corpusstream import CorpusStream
 from postagger import IFD_Corpus, IFD_Tagset
 from tnttagger import TnT
 
@@ -69,9 +69,12 @@ def train_tagger():
         with timeit(f"Train TnT tagger on {TRAINING_SET} sentences from articles"):
             # Get a sentence stream from parsed articles
             # Number of sentences, size of training set
-            sentence_stream = Article.sentence_stream(limit = TRAINING_SET, skip = TEST_SET)
+            # The token blobs are decoded in parallel by a pool of worker processes
+            corpus = CorpusStream(processes = os.cpu_count() or 1)
+            sentence_stream = corpus.sentences(limit = TRAINING_SET, skip = TEST_SET)
             word_tag_stream = IFD_Tagset.word_tag_stream(sentence_stream)
             tnt_tagger.train(word_tag_stream)
+            print("Article sentence stream: {0}".format(corpus.throughput()))
     with timeit(f"Train TnT tagger on IFD training set"):
         # Get a sentence stream from parsed articles
         # Number of sentences, size of training set
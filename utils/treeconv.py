@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+"""
+
+    Reynir: Natural language processing for Icelandic
+
+    Tree format converter and benchmark
+
+    Copyright (C) 2018 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+    This utility program converts the parse trees of already parsed
+    articles from the S/C/L/T/N text format to the binary format
+    (see bintree.py), storing the result in the articles.tree_bin column.
+    The column is added to the articles table if it does not exist.
+
+    With the --bench option, the program instead loads a sample of
+    trees from the database and compares the load throughput of the
+    text and binary formats, without modifying the database.
+
+"""
+
+import os
+import sys
+import getopt
+import time
+
+# Hack to make this Python program executable from the utils subdirectory
+basepath, _ = os.path.split(os.path.realpath(__file__))
+_UTILS = os.sep + "utils"
+if basepath.endswith(_UTILS):
+    basepath = basepath[0:-len(_UTILS)]
+    sys.path.append(basepath)
+
+from settings import Settings, ConfigError
+from scraperdb import SessionContext, Article, undefer_group
+from tree import Tree, tree_to_binary
+
+
+# Number of articles to convert in each transaction
+BATCH_SIZE = 500
+
+
+def add_column():
+    """ Add the tree_bin column to the articles table, if not already there """
+    SessionContext.db.execute(
+        "ALTER TABLE articles ADD COLUMN IF NOT EXISTS tree_bin bytea;"
+    )
+
+
+def convert(limit):
+    """ Convert text trees to binary trees, in batches """
+    add_column()
+    cnt = 0
+    text_bytes = 0
+    bin_bytes = 0
+    t0 = time.time()
+    while limit is None or cnt < limit:
+        batch = BATCH_SIZE if limit is None else min(BATCH_SIZE, limit - cnt)
+        with SessionContext(commit=True) as session:
+            q = (
+                session.query(Article)
+                .options(undefer_group("tree"))
+                .filter(Article.tree != None)
+                .filter(Article.tree_bin == None)
+                .limit(batch)
+                .all()
+            )
+            if not q:
+                break
+            for a in q:
+                a.tree_bin = tree_to_binary(a.tree)
+                text_bytes += len(a.tree.encode("utf-8"))
+                bin_bytes += len(a.tree_bin)
+                cnt += 1
+        print("Converted {0} articles".format(cnt), end=chr(13))
+    t1 = time.time()
+    print("\nConverted {0} articles in {1:.2f} seconds".format(cnt, t1 - t0))
+    if text_bytes:
+        print(
+            "Text trees: {0:,} bytes; binary trees: {1:,} bytes ({2:.1f}%)".format(
+                text_bytes, bin_bytes, 100.0 * bin_bytes / text_bytes
+            )
+        )
+
+
+def _time_loads(trees):
+    """ Load all the given trees, returning the elapsed time in seconds """
+    t0 = time.time()
+    for t in trees:
+        tree = Tree()
+        tree.load(t)
+    return time.time() - t0
+
+
+def bench(limit):
+    """ Compare the load throughput of text and binary trees """
+    with SessionContext(read_only=True) as session:
+        q = (
+            session.query(Article.tree, Article.tree_bin)
+            .filter(Article.tree != None)
+            .order_by(Article.timestamp.desc())
+            .limit(limit or 1000)
+        )
+        texts = []
+        bins = []
+        for a in q:
+            texts.append(a.tree)
+            # Convert on the fly if the article has not been migrated yet
+            bins.append(bytes(a.tree_bin) if a.tree_bin else tree_to_binary(a.tree))
+    if not texts:
+        print("No parsed articles found")
+        return
+    num_sentences = sum(t.count("\nS") + t.startswith("S") for t in texts)
+    print(
+        "Loading {0} trees containing {1} sentences".format(len(texts), num_sentences)
+    )
+    for name, trees in (("text", texts), ("binary", bins)):
+        size = sum(len(t.encode("utf-8") if isinstance(t, str) else t) for t in trees)
+        elapsed = _time_loads(trees)
+        print(
+            "{0:>6}: {1:.2f} seconds, {2:.0f} trees/sec, {3:.0f} sentences/sec, "
+            "{4:,} bytes".format(
+                name,
+                elapsed,
+                len(trees) / elapsed if elapsed else 0.0,
+                num_sentences / elapsed if elapsed else 0.0,
+                size,
+            )
+        )
+
+
+class Usage(Exception):
+
+    def __init__(self, msg):
+        self.msg = msg
+
+
+__doc__ = """
+
+    Reynir - Natural language processing for Icelandic
+
+    Tree format converter and benchmark
+
+    Usage:
+        python treeconv.py [options]
+
+    Options:
+        -h, --help: Show this help text
+        -l N, --limit=N: Limit processing to N articles
+        -b, --bench: Benchmark text vs. binary tree loading (no conversion)
+
+"""
+
+
+def main(argv=None):
+    """ Guido van Rossum's pattern for a Python main function """
+
+    if argv is None:
+        argv = sys.argv
+    try:
+        try:
+            opts, args = getopt.getopt(argv[1:], "hl:b", ["help", "limit=", "bench"])
+        except getopt.error as msg:
+            raise Usage(msg)
+        limit = None
+        benchmark = False
+        # Process options
+        for o, a in opts:
+            if o in ("-h", "--help"):
+                print(__doc__)
+                return 0
+            elif o in ("-l", "--limit"):
+                try:
+                    limit = int(a)
+                except ValueError:
+                    pass
+            elif o in ("-b", "--bench"):
+                benchmark = True
+
+        # Read the configuration settings file
+        try:
+            Settings.read(os.path.join(basepath, "config", "Reynir.conf"))
+        except ConfigError as e:
+            print("Configuration error: {0}".format(e), file=sys.stderr)
+            return 2
+
+        if benchmark:
+            bench(limit)
+        else:
+            convert(limit)
+
+    except Usage as err:
+        print(err.msg, file=sys.stderr)
+        print("For help use --help", file=sys.stderr)
+        return 2
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
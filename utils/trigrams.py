@@ -42,7 +42,7 @@ else:
 from settings import Settings, ConfigError, Prepositions
 from tokenizer import tokenize, correct_spaces, TOK
 from reynir.bindb import BIN_Db
-from scraperdb import SessionContext, Article, Trigram, DatabaseError, desc
+from scraperdb import SessionContext, Article, Trigram, DatabaseError, desc, undefer_group
 from tree import TreeTokenList, TerminalDescriptor
 
 
@@ -55,6 +55,7 @@ def dump_tokens(limit):
         # Iterate through the articles
         q = (
             session.query(Article)
+            .options(undefer_group("tree"))
             .filter(Article.tree != None)
             .order_by(Article.timestamp)
         )
@@ -68,7 +69,7 @@ def dump_tokens(limit):
                 .format(a)
             )
             tree = TreeTokenList()
-            tree.load(a.tree)
+            tree.load(a.tree_bin or a.tree)
             for ix, toklist in tree.sentences():
                 print("\nSentence {0}:".format(ix))
                 at_start = True
@@ -105,7 +106,7 @@ def make_trigrams(limit, output_tsv=False):
 
         # Iterate through the articles
         q = (
-            session.query(Article.url, Article.timestamp, Article.tree)
+            session.query(Article.url, Article.timestamp, Article.tree, Article.tree_bin)
             .filter(Article.tree != None)
             .order_by(Article.timestamp)
         )
@@ -119,7 +120,7 @@ def make_trigrams(limit, output_tsv=False):
             for a in q:
                 print("Processing article from {0.timestamp}: {0.url}".format(a))
                 tree = TreeTokenList()
-                tree.load(a.tree)
+                tree.load(a.tree_bin or a.tree)
                 for ix, toklist in tree.sentences():
                     if toklist and len(toklist) > 1:
                         # For each sentence, start and end with empty strings
@@ -0,0 +1,338 @@
+"""
+
+    Reynir: Natural language processing for Icelandic
+
+    Worker pool module
+
+    Copyright (C) 2018 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+    This module implements a long-lived pool of worker processes that is
+    fed from a bounded queue, used for the parse phase of the scraper.
+
+    Unlike multiprocessing.Pool used in chunks, there is no barrier at
+    which all workers wait for the slowest task of a chunk: each worker
+    takes a new task as soon as it has finished the previous one. To
+    contain memory creep, a worker exits after a given number of tasks,
+    or when its resident set size exceeds a given threshold, and is
+    replaced by a fresh process forked from the (warm) parent process.
+    A worker that dies within a task, e.g. by running out of memory,
+    is replaced as well, and the task is reported as failed.
+
+    The tasks can be given an estimated cost, and the total estimated cost
+    of the tasks in flight (queued or being worked on) can be capped, so
+    that the memory use of the workers stays bounded. A task whose cost
+    alone exceeds the cap is dispatched when nothing else is in flight.
+
+    The pool measures its utilization, i.e. the fraction of the available
+    worker time that was spent working on tasks.
+
+"""
+
+import os
+import time
+import queue
+import logging
+import resource
+import threading
+import multiprocessing
+from collections import namedtuple
+
+
+# Messages from the workers to the pool
+_STARTED = 0  # (_STARTED, worker id, task id)
+_DONE = 1  # (_DONE, worker id, task id, result, busy seconds)
+_EXIT = 2  # (_EXIT, worker id, reason)
+
+# Number of seconds between checks of the workers' health
+_POLL_INTERVAL = 1.0
+
+# Number of consecutive idle polls after which tasks that were taken by
+# workers that died before reporting them are considered lost
+_IDLE_POLLS = 5
+
+
+# Statistics of a pool run
+PoolStats = namedtuple(
+    "PoolStats",
+    ["tasks", "failed", "recycled", "crashed", "elapsed", "busy", "utilization"],
+)
+
+
+def _rss_mb():
+    """ Return the resident set size of the current process in megabytes """
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return 0
+    return pages * resource.getpagesize() / (1024 * 1024)
+
+
+def _worker(wid, func, initializer, tasks, results, maxtasks, max_rss):
+    """ The main loop of a worker process """
+    if initializer is not None:
+        initializer()
+    completed = 0
+    while True:
+        item = tasks.get()
+        if item is None:
+            reason = None
+            break
+        task_id, task = item
+        results.put((_STARTED, wid, task_id))
+        t0 = time.time()
+        result = func(task)
+        results.put((_DONE, wid, task_id, result, time.time() - t0))
+        completed += 1
+        if maxtasks and completed >= maxtasks:
+            reason = "tasks"
+            break
+        if max_rss and _rss_mb() > max_rss:
+            reason = "rss"
+            break
+    results.put((_EXIT, wid, reason))
+
+
+class WorkerPool:
+
+    """ A pool of long-lived, recycled worker processes fed from a bounded queue """
+
+    def __init__(
+        self,
+        func,
+        processes=None,
+        initializer=None,
+        maxtasks=None,
+        max_rss=None,
+        queue_size=None,
+        cost=None,
+        max_cost=None,
+    ):
+        """ Create a pool of worker processes that apply func to each task.
+            A worker is recycled after maxtasks tasks, or when its resident
+            set size exceeds max_rss megabytes, if given. At most queue_size
+            tasks (by default twice the number of processes) are queued.
+            If given, cost is a function returning the estimated cost of
+            a task, and max_cost caps the total cost of tasks in flight. """
+        self._func = func
+        self._processes = processes or os.cpu_count() or 1
+        self._initializer = initializer
+        self._maxtasks = maxtasks
+        self._max_rss = max_rss
+        self._cost = cost
+        self._max_cost = max_cost
+        # The workers are forked, inheriting the state of the parent,
+        # such as a loaded grammar
+        self._ctx = multiprocessing.get_context("fork")
+        self._tasks = self._ctx.Queue(maxsize=queue_size or 2 * self._processes)
+        self._results = self._ctx.Queue()
+        self._workers = dict()
+        self._next_wid = 0
+        # Statistics
+        self._stats = dict(tasks=0, failed=0, recycled=0, crashed=0)
+        self._busy = 0.0
+        self._elapsed = 0.0
+
+    def _spawn(self):
+        """ Start a new worker process """
+        wid = self._next_wid
+        self._next_wid += 1
+        p = self._ctx.Process(
+            target=_worker,
+            args=(
+                wid,
+                self._func,
+                self._initializer,
+                self._tasks,
+                self._results,
+                self._maxtasks,
+                self._max_rss,
+            ),
+            daemon=True,
+        )
+        p.start()
+        self._workers[wid] = p
+
+    def _feed(self, iterable, state):
+        """ Put the tasks into the bounded queue, in a background thread """
+        cond = state["cond"]
+        pending = state["pending"]
+        max_cost = self._max_cost
+        try:
+            for task in iterable:
+                cost = 0 if self._cost is None else self._cost(task)
+                with cond:
+                    if max_cost:
+                        # Wait until there is room for the task's cost
+                        cond.wait_for(
+                            lambda: state["stop"]
+                            or not pending
+                            or state["inflight"] + cost <= max_cost
+                        )
+                    if state["stop"]:
+                        break
+                    task_id = state["submitted"]
+                    pending[task_id] = cost
+                    state["inflight"] += cost
+                    state["submitted"] += 1
+                self._tasks.put((task_id, task))
+        except Exception as e:
+            logging.warning("Exception when feeding worker pool: {0!r}".format(e))
+        finally:
+            state["fed"] = True
+
+    def imap_unordered(self, iterable):
+        """ Apply the function to each task in the iterable, which is consumed
+            in a background thread, yielding the results in order of completion.
+            None is yielded for a task whose worker died. """
+        state = dict(
+            submitted=0,
+            fed=False,
+            stop=False,
+            # Estimated cost of each task in flight, and their total
+            pending=dict(),
+            inflight=0,
+            cond=threading.Condition(),
+        )
+
+        def finish(task_id):
+            """ Note that a task is finished, releasing its cost """
+            with state["cond"]:
+                state["inflight"] -= state["pending"].pop(task_id, 0)
+                state["cond"].notify()
+
+        feeder = threading.Thread(
+            target=self._feed, args=(iterable, state), name="WorkerPoolFeeder", daemon=True
+        )
+        t0 = time.time()
+        for _ in range(self._processes):
+            self._spawn()
+        feeder.start()
+        # The task being worked on by each worker, if any
+        running = dict()
+        # The ids of the tasks that are finished, successfully or not
+        done = set()
+        finished = 0
+        idle = 0
+        try:
+            while not (state["fed"] and finished >= state["submitted"]):
+                try:
+                    msg = self._results.get(timeout=_POLL_INTERVAL)
+                except queue.Empty:
+                    msg = None
+                if msg is None:
+                    # Check for workers that died without saying goodbye
+                    for wid, p in list(self._workers.items()):
+                        if p.is_alive():
+                            continue
+                        p.join()
+                        del self._workers[wid]
+                        self._stats["crashed"] += 1
+                        task_id = running.pop(wid, None)
+                        if task_id is not None:
+                            logging.warning(
+                                "Worker process died with exit code {0}"
+                                .format(p.exitcode)
+                            )
+                            done.add(task_id)
+                            finish(task_id)
+                            finished += 1
+                            self._stats["failed"] += 1
+                            yield None
+                        self._spawn()
+                    if state["pending"] and not running and self._tasks.empty():
+                        # All tasks in flight have been taken, but some were
+                        # taken by workers that died before reporting them
+                        idle += 1
+                        if idle >= _IDLE_POLLS:
+                            with state["cond"]:
+                                lost = list(state["pending"].keys())
+                            logging.warning("{0} tasks were lost".format(len(lost)))
+                            for task_id in lost:
+                                done.add(task_id)
+                                finish(task_id)
+                                finished += 1
+                                self._stats["failed"] += 1
+                                yield None
+                            idle = 0
+                    continue
+                idle = 0
+                kind, wid = msg[0], msg[1]
+                if kind == _STARTED:
+                    running[wid] = msg[2]
+                elif kind == _DONE:
+                    running.pop(wid, None)
+                    if msg[2] in done:
+                        # Already given up on, as the worker seemed to have died
+                        continue
+                    done.add(msg[2])
+                    finish(msg[2])
+                    finished += 1
+                    self._stats["tasks"] += 1
+                    self._busy += msg[4]
+                    yield msg[3]
+                elif kind == _EXIT:
+                    p = self._workers.pop(wid, None)
+                    if p is None:
+                        # Already replaced, as the worker seemed to have died
+                        continue
+                    p.join()
+                    if msg[2] is not None:
+                        # The worker was recycled
+                        self._stats["recycled"] += 1
+                        self._spawn()
+        finally:
+            with state["cond"]:
+                state["stop"] = True
+                state["cond"].notify()
+            self._elapsed += time.time() - t0
+            self._shutdown(feeder)
+
+    def _shutdown(self, feeder):
+        """ Stop the workers and the feeder thread """
+        # Let the workers exit normally, running their exit handlers
+        for _ in self._workers:
+            try:
+                self._tasks.put(None, timeout=_POLL_INTERVAL)
+            except queue.Full:
+                break
+        deadline = time.time() + 10 * _POLL_INTERVAL
+        for p in self._workers.values():
+            p.join(max(0.0, deadline - time.time()))
+            if p.is_alive():
+                p.terminate()
+                p.join()
+        self._workers = dict()
+        # Unblock the feeder thread, if it is waiting for room in the queue
+        while feeder.is_alive():
+            try:
+                self._tasks.get(timeout=_POLL_INTERVAL)
+            except queue.Empty:
+                pass
+            feeder.join(0.0)
+
+    def stats(self):
+        """ Return the statistics of the pool as a PoolStats tuple """
+        capacity = self._elapsed * self._processes
+        return PoolStats(
+            self._stats["tasks"],
+            self._stats["failed"],
+            self._stats["recycled"],
+            self._stats["crashed"],
+            self._elapsed,
+            self._busy,
+            self._busy / capacity if capacity > 0.0 else 0.0,
+        )